@@ -1,6 +1,8 @@
 from Innotter.celery import app as celery_app
 from Innotter.pika_di import pika_di
+from Innotter.timeline_di import timeline_di
 
 
 __all__ = ('celery_app',)
 pika_di()
+timeline_di()
@@ -0,0 +1,14 @@
+from Innotter.producer import stats_batch
+
+
+class StatsBatchMiddleware:
+    """
+    Send all statistic events of a request as one batched message after it is handled
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with stats_batch():
+            return self.get_response(request)
@@ -0,0 +1,93 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def encode_cursor(created_at: datetime, pk: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at.isoformat(), pk]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        created_at, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), int(pk)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise NotFound('Invalid cursor')
+
+
+def older_than(queryset, before: tuple):
+    """
+    Filter rows older than (created_at, ID) with a comparison of row values, so a composite index
+    on (created_at, id) is scanned from the cursor instead of sorting every row
+    @param queryset: Rows with created_at and id columns
+    @param before: Key of the last row that was already returned
+    """
+    created_at, pk = before
+    table = connection.ops.quote_name(queryset.model._meta.db_table)
+    created_at_column, pk_column = (connection.ops.quote_name(column) for column in ('created_at', 'id'))
+    return queryset.filter(RawSQL(f'({table}.{created_at_column}, {table}.{pk_column}) < (%s, %s)',
+                                  (connection.ops.adapt_datetimefield_value(created_at), pk),
+                                  output_field=BooleanField()))
+
+
+class KeysetPagination(BasePagination):
+    """
+    Pagination of posts newest first in a stable order of (created_at, id). The cursor is an opaque token
+    of the last returned key, every page is a LIMIT query after it and the total number is never counted
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+
+    def __init__(self, page_size: int = None, max_page_size: int = None) -> None:
+        self.page_size = page_size or settings.POSTS_PAGE_SIZE
+        self.max_page_size = max_page_size or settings.POSTS_MAX_PAGE_SIZE
+        self.request = None
+        self.next = None
+
+    def start(self, request) -> tuple | None:
+        """
+        Read page size and cursor of request
+        @return: Key (created_at, ID) the page starts after, None for the first page
+        """
+        self.request = request
+        try:
+            self.page_size = min(max(int(request.query_params[self.page_size_query_param]), 1), self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        cursor = request.query_params.get(self.cursor_query_param)
+        return decode_cursor(cursor) if cursor else None
+
+    def paginate_queryset(self, queryset, request, view=None) -> list:
+        before = self.start(request)
+        if before is not None:
+            queryset = older_than(queryset, before)
+        return self.paginate_rows(list(queryset.order_by('-created_at', '-pk')[:self.page_size + 1]))
+
+    def paginate_rows(self, rows: list) -> list:
+        """
+        Cut rows, fetched one more than page size, to a page and remember the cursor of the next one
+        """
+        self.next = None
+        if len(rows) > self.page_size:
+            rows = rows[:self.page_size]
+            self.next = (rows[-1].created_at, rows[-1].pk)
+        return rows
+
+    def get_next_link(self) -> str | None:
+        if self.next is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(*self.next))
+
+    def get_paginated_response(self, data) -> Response:
+        return Response({'next': self.get_next_link(), 'results': data})
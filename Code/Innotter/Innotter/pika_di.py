@@ -1,8 +1,13 @@
 from kink import di
 import pika
 
+from Innotter.producer import ChannelPool, StatsRpcClient
+from Innotter.settings import STATS_PUBLISHER_POOL_SIZE, STATS_RPC_TIMEOUT
+
 
 def pika_di():
     conn_params = pika.ConnectionParameters(host='rabbit', port=5672)
 
     di['conn_params'] = conn_params
+    di['channel_pool'] = lambda di: ChannelPool(di['conn_params'], size=STATS_PUBLISHER_POOL_SIZE)
+    di['stats_rpc'] = lambda di: StatsRpcClient(di['conn_params'], timeout=STATS_RPC_TIMEOUT)
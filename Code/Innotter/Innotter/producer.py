@@ -1,60 +1,459 @@
+import asyncio
 import json
-import pika
+import logging
+import os
+import queue
+import threading
+import time
 import uuid
+from collections import defaultdict, OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from functools import partial
+import pika
+from asgiref.local import Local
+from django.db import transaction
 from kink import inject
 from pika.connection import ConnectionParameters
-from pika.adapters.blocking_connection import BlockingChannel
+from pika.adapters.blocking_connection import BlockingChannel, BlockingConnection
+from pika.exceptions import AMQPError, AMQPConnectionError
 from pika.spec import BasicProperties, Basic
 
+STATS_QUEUE = 'fastapi'
+DIRECT_REPLY_TO = 'amq.rabbitmq.reply-to'
 
-@inject
-class Statistics:
-    def __init__(self, conn_params: ConnectionParameters) -> None:
-        self.connection = pika.BlockingConnection(conn_params)
-        self.channel = self.connection.channel()
-        stats = self.channel.queue_declare(queue='', exclusive=True)
-        self.callback_queue = stats.method.queue
-        self.channel.queue_declare(queue='fastapi')
 
-        self.channel.basic_consume(
-            queue=self.callback_queue,
-            on_message_callback=self.on_response,
-            auto_ack=True)
+class ChannelPool:
+    """
+    Process-wide pool of RabbitMQ connections, each with its own channel.
+    Blocking connections are not thread-safe, so every thread checks out a whole
+    connection for the duration of a publish and returns it afterwards.
+    The pool is reset in forked children, so workers never share sockets with their parent.
+    """
+
+    def __init__(self, conn_params: ConnectionParameters, size: int = 4, queue_name: str = STATS_QUEUE) -> None:
+        self.conn_params = conn_params
+        self.size = size
+        self.queue_name = queue_name
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self) -> None:
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._declare_lock = threading.Lock()
+        self._declared = False
+
+    def _connect(self) -> tuple[BlockingConnection, BlockingChannel]:
+        connection = pika.BlockingConnection(self.conn_params)
+        channel = connection.channel()
+        with self._declare_lock:
+            if not self._declared:
+                channel.queue_declare(queue=self.queue_name)
+                self._declared = True
+        return connection, channel
+
+    def acquire(self) -> tuple[BlockingConnection, BlockingChannel]:
+        """
+        Check out an open connection and its channel, opening a new one if none is idle
+        """
+        if self._pid != os.getpid():
+            self._reset()
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    connection, channel = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if connection.is_open and channel.is_open:
+                    return connection, channel
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, connection: BlockingConnection, channel: BlockingChannel, broken: bool = False) -> None:
+        """
+        Return a checked out connection to the pool, or drop it if it failed while in use
+        """
+        if broken:
+            self._declared = False
+            _close_quietly(connection)
+        elif self._pid == os.getpid():
+            self._idle.put((connection, channel))
+        self._slots.release()
+
+    def publish(self, body: str, properties: BasicProperties = None) -> None:
+        """
+        Publish a message to the statistics queue, reconnecting once if the pooled connection was lost
+        @param body: Serialized message
+        @param properties: Optional AMQP properties of the message
+        """
+        for attempt in range(2):
+            connection, channel = self.acquire()
+            try:
+                channel.basic_publish(exchange='', routing_key=self.queue_name, body=body, properties=properties)
+            except AMQPError:
+                self.release(connection, channel, broken=True)
+                if attempt:
+                    raise
+            else:
+                self.release(connection, channel)
+                return
+
+
+def _close_quietly(connection: BlockingConnection) -> None:
+    try:
+        if connection.is_open:
+            connection.close()
+    except AMQPError:
+        pass
+
+
+class StatsRpcError(Exception):
+    """
+    Error reply of microservice, e.g. when it could not read the requested statistic
+    """
+
+
+class StatsRpcClient:
+    """
+    RPC client for microservice that multiplexes many requests over one long-lived connection.
+    A background thread owns the connection and consumes replies from RabbitMQ direct reply-to,
+    resolving futures by correlation id, so any number of threads can wait for replies at once.
+    Replies are remembered and returned as a fallback when microservice does not answer in time.
+    """
+
+    def __init__(self, conn_params: ConnectionParameters, queue_name: str = STATS_QUEUE,
+                 timeout: float = 5, remember: int = 10000) -> None:
+        self.conn_params = conn_params
+        self.queue_name = queue_name
+        self.timeout = timeout
+        self.remember = remember
+        self._lock = threading.Lock()
+        self._last_known = OrderedDict()
+        self._pid = None
+        self._thread = None
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._pending = {}
+            self._connection = None
+            self._channel = None
+            self._ready = threading.Event()
+            self._thread = threading.Thread(target=self._run, name='stats-rpc', daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                connection = pika.BlockingConnection(self.conn_params)
+                channel = connection.channel()
+                channel.basic_consume(queue=DIRECT_REPLY_TO, on_message_callback=self._on_response, auto_ack=True)
+                self._connection, self._channel = connection, channel
+                self._ready.set()
+                while True:
+                    connection.process_data_events(time_limit=1)
+            except AMQPError as err:
+                logging.error('Statistics RPC connection lost: %r', err)
+                self._ready.clear()
+                self._connection = self._channel = None
+                for corr_id in list(self._pending):
+                    self._resolve(corr_id, error=err)
+                time.sleep(1)
+
+    def _on_response(self, ch: BlockingChannel, method: Basic.Deliver, props: BasicProperties, body: str) -> None:
+        """
+        Resolve the future that waits for this reply, late replies are dropped.
+        An error reply fails the future, so the caller falls back at once instead of waiting for timeout
+        """
+        if props.type == 'error':
+            self._resolve(props.correlation_id, error=StatsRpcError(json.loads(body).get('detail')))
+        else:
+            self._resolve(props.correlation_id, result=json.loads(body))
+
+    def _resolve(self, corr_id: str, result=None, error: Exception = None) -> None:
+        future = self._pending.pop(corr_id, None)
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _publish(self, corr_id: str, body: str) -> None:
+        try:
+            self._channel.basic_publish(exchange='',
+                                        routing_key=self.queue_name,
+                                        properties=pika.BasicProperties(reply_to=DIRECT_REPLY_TO,
+                                                                        correlation_id=corr_id),
+                                        body=body)
+        except AMQPError as err:
+            self._resolve(corr_id, error=err)
+
+    def request(self, message: dict, timeout: float = None) -> Future:
+        """
+        Send request to microservice without waiting for the reply
+        @param message: Request message
+        @param timeout: Seconds to wait for the connection, if it is not established yet
+        @return: Future that is resolved with the reply
+        """
+        self._ensure_started()
+        corr_id = str(uuid.uuid4())
+        future = Future()
+        self._pending[corr_id] = future
+        # a future given up by _fallback is forgotten, a reply that comes later finds nothing and is dropped
+        future.add_done_callback(lambda _: self._pending.pop(corr_id, None))
+        connection = self._connection if self._ready.wait(self.timeout if timeout is None else timeout) else None
+        try:
+            if connection is None:
+                raise AMQPConnectionError('Statistics RPC connection is not established')
+            connection.add_callback_threadsafe(partial(self._publish, corr_id, json.dumps(message)))
+        except AMQPError as err:
+            self._resolve(corr_id, error=err)
+        return future
+
+    def _remember(self, key, value):
+        if key is None:
+            return value
+        with self._lock:
+            self._last_known[key] = value
+            self._last_known.move_to_end(key)
+            if len(self._last_known) > self.remember:
+                self._last_known.popitem(last=False)
+        return value
+
+    def _fallback(self, key, future: Future):
+        future.cancel()
+        logging.error('Statistics RPC request %s failed, last known value is used', key)
+        return self._last_known.get(key)
+
+    def call(self, message: dict, key, timeout: float = None):
+        """
+        Send request to microservice and wait for the reply
+        @param message: Request message
+        @param key: Key under which the reply is remembered for fallback, None to not remember it
+        @param timeout: Seconds to wait, default timeout of the client if not specified
+        @return: Reply, or last known reply for the key if microservice did not answer in time or failed
+        """
+        timeout = self.timeout if timeout is None else timeout
+        future = self.request(message, timeout)
+        try:
+            return self._remember(key, future.result(timeout))
+        except (FutureTimeoutError, AMQPError, StatsRpcError):
+            return self._fallback(key, future)
+
+    async def acall(self, message: dict, key, timeout: float = None):
+        """
+        Same as call, but awaitable from async views
+        """
+        timeout = self.timeout if timeout is None else timeout
+        if self._pid == os.getpid() and self._ready.is_set():
+            future = self.request(message, timeout)
+        else:
+            # the first request of a process waits for the connection, which must not block the event loop
+            future = await asyncio.to_thread(self.request, message, timeout)
+        try:
+            return self._remember(key, await asyncio.wait_for(asyncio.wrap_future(future), timeout))
+        except (asyncio.TimeoutError, AMQPError, StatsRpcError):
+            return self._fallback(key, future)
+
+    def get_stats(self, page_pk: int, timeout: float = None) -> dict | None:
+        return self.call({'page': page_pk, 'field': 'page', 'action': 'stats'}, ('stats', page_pk), timeout)
+
+    async def aget_stats(self, page_pk: int, timeout: float = None) -> dict | None:
+        return await self.acall({'page': page_pk, 'field': 'page', 'action': 'stats'}, ('stats', page_pk), timeout)
+
+    def get_stats_many(self, page_pks: list, timeout: float = None) -> dict:
+        reply = self.call({'pages': list(page_pks), 'field': 'page', 'action': 'stats_many'}, None, timeout)
+        return self._by_page(page_pks, reply)
 
-        self.response = None
-        self.corr_id = None
+    async def aget_stats_many(self, page_pks: list, timeout: float = None) -> dict:
+        reply = await self.acall({'pages': list(page_pks), 'field': 'page', 'action': 'stats_many'}, None, timeout)
+        return self._by_page(page_pks, reply)
 
-    def on_response(self, ch: BlockingChannel, method: Basic.Deliver, props: BasicProperties, body: str) -> None:
+    def get_series(self, page_pk: int, granularity: str, start, end, timeout: float = None) -> list | None:
+        return self.call({'page': page_pk, 'field': 'page', 'action': 'series', 'granularity': granularity,
+                          'from': start.isoformat(), 'to': end.isoformat()}, None, timeout)
+
+    def _by_page(self, page_pks: list, reply: dict | None) -> dict:
         """
-        Check if it suitable message
+        Remember statistic of each page from a batch reply, or use last known ones if there is no reply
         """
-        if self.corr_id == props.correlation_id:
-            self.response = body
+        if reply is None:
+            return {page_pk: self._last_known.get(('stats', page_pk)) for page_pk in page_pks}
+        return {int(page_pk): self._remember(('stats', int(page_pk)), stats) for page_pk, stats in reply.items()}
+
+
+class StatsBuffer:
+    """
+    Collects statistic events and merges them into net deltas per (page, field),
+    so they can be sent to microservice as a single batched message. The buffer has its own event id,
+    sent as message id, so microservice can drop a message that is delivered again
+    """
+
+    def __init__(self) -> None:
+        self.event_id = uuid.uuid4().hex
+        self.new_pages = []
+        self.deleted_pages = []
+        self.deltas = defaultdict(int)
+
+    def add(self, page_pk: int, field: str, action: str) -> None:
+        match field, action:
+            case 'page', 'new':
+                if page_pk not in self.new_pages:
+                    self.new_pages.append(page_pk)
+            case 'page', 'delete':
+                if page_pk not in self.deleted_pages:
+                    self.deleted_pages.append(page_pk)
+            case _:
+                self.add_deltas(page_pk, {field: 1 if action == 'plus' else -1})
+
+    def add_deltas(self, page_pk: int, deltas: dict) -> None:
+        for field, delta in deltas.items():
+            self.deltas[(page_pk, field)] += delta
+
+    def message(self) -> dict | None:
+        """
+        Batched message for microservice, or None if events cancelled each other out.
+        Counters of deleted pages are dropped, the page is removed as a whole
+        """
+        new_pages = [page_pk for page_pk in self.new_pages if page_pk not in self.deleted_pages]
+        deleted_pages = [page_pk for page_pk in self.deleted_pages if page_pk not in self.new_pages]
+        deltas = defaultdict(dict)
+        for (page_pk, field), delta in self.deltas.items():
+            if delta and page_pk not in self.deleted_pages:
+                deltas[str(page_pk)][field] = delta
+        if not new_pages and not deleted_pages and not deltas:
+            return None
+        return {'field': 'batch', 'action': 'apply', 'new': new_pages, 'deltas': deltas, 'deleted': deleted_pages}
+
+
+_scopes = Local()
+
+
+def current_buffer() -> StatsBuffer | None:
+    stack = getattr(_scopes, 'stack', None)
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def stats_batch():
+    """
+    Buffer statistic events published inside the block and send them as one message.
+    Events are added to the buffer only when their transaction commits, and the buffer
+    itself is flushed after the surrounding transaction (if any) commits.
+    """
+    buffer = StatsBuffer()
+    if getattr(_scopes, 'stack', None) is None:
+        _scopes.stack = []
+    _scopes.stack.append(buffer)
+    try:
+        yield buffer
+    finally:
+        _scopes.stack.pop()
+        transaction.on_commit(partial(Statistics().send, buffer))
+
+
+@inject
+class Statistics:
+    def __init__(self, channel_pool: ChannelPool, stats_rpc: StatsRpcClient) -> None:
+        self.channel_pool = channel_pool
+        self.stats_rpc = stats_rpc
 
     def publish(self, page_pk: int, field: str, action: str) -> None:
         """
-        Send message to microservice for changing specified field on a specified page
+        Send message to microservice for changing specified field on a specified page,
+        once the current transaction commits. Inside stats_batch() events are merged instead
+        @param page_pk: ID of page that would be changed
+        @param field: Field that would be changed ('follower', 'like', 'post') or 'page'
+        @param action: 'plus', 'minus', or 'new' and 'delete' for a page
+        """
+        self._record('add', page_pk, field, action)
+
+    def publish_deltas(self, page_pk: int, deltas: dict) -> None:
+        """
+        Send message to microservice for changing several fields of a page at once, e.g. when a post is deleted
         @param page_pk: ID of page that would be changed
-        @param field: Field that would be changed ('followers_count', 'likes_count', 'posts_count')
-        @param action: 'plus' or 'minus'
+        @param deltas: Changes by field, e.g. {'like': -10, 'post': -1}
+        """
+        self._record('add_deltas', page_pk, deltas)
+
+    def _record(self, method: str, *args) -> None:
+        buffer = current_buffer()
+        if buffer is not None:
+            transaction.on_commit(partial(getattr(buffer, method), *args))
+        else:
+            buffer = StatsBuffer()
+            getattr(buffer, method)(*args)
+            transaction.on_commit(partial(self.send, buffer))
+
+    def send(self, buffer: StatsBuffer) -> None:
+        """
+        Send buffered events to microservice as a single message
+        @param buffer: Buffer with merged events
         """
-        message = {'page': page_pk, 'field': field, 'action': action}
-        self.channel.basic_publish(exchange='', routing_key='fastapi', body=json.dumps(message))
+        message = buffer.message()
+        if message is None:
+            return
+        try:
+            self.channel_pool.publish(json.dumps(message), pika.BasicProperties(message_id=buffer.event_id))
+        except AMQPError:
+            logging.exception('Statistics were not sent: %s', message)
 
-    def get_stats(self, page_pk: int) -> dict:
+    def publish_counters(self, counters: dict) -> None:
+        """
+        Send true values of counters to microservice right away, to replace the stored ones
+        @param counters: Values by ID of page and field, e.g. {1: {'like': 10, 'post': 2}}
+        """
+        message = {'field': 'batch', 'action': 'set',
+                   'counters': {str(page_pk): page_counters for page_pk, page_counters in counters.items()}}
+        self.channel_pool.publish(json.dumps(message), pika.BasicProperties(message_id=uuid.uuid4().hex))
+
+    def get_stats(self, page_pk: int, timeout: float = None) -> dict | None:
         """
         Get statistic of page from microservice
         @param page_pk: ID of page
-        @return: Dict with statistic
-        """
-        self.response = None
-        self.corr_id = str(uuid.uuid4())
-        self.channel.basic_publish(
-            exchange='',
-            routing_key='fastapi',
-            properties=pika.BasicProperties(
-                reply_to=self.callback_queue,
-                correlation_id=self.corr_id),
-            body=json.dumps({'page': page_pk, 'field': 'page', 'action': 'stats'}))
-        self.connection.process_data_events(time_limit=5)
-        return json.loads(self.response)
+        @param timeout: Seconds to wait for microservice
+        @return: Dict with statistic, last known statistic or None if microservice did not answer in time
+        """
+        return self.stats_rpc.get_stats(page_pk, timeout)
+
+    async def aget_stats(self, page_pk: int, timeout: float = None) -> dict | None:
+        """
+        Same as get_stats, but awaitable from async views
+        """
+        return await self.stats_rpc.aget_stats(page_pk, timeout)
+
+    def get_stats_many(self, page_pks: list, timeout: float = None) -> dict:
+        """
+        Get statistic of several pages from microservice in one request
+        @param page_pks: IDs of pages
+        @param timeout: Seconds to wait for microservice
+        @return: Dict with statistic by ID of page, pages without statistic get zero counters.
+        Pages the microservice could not read are None, so they are not mistaken for pages with zero counters.
+        If it does not reply, pages get their last known statistic, None if there is none
+        """
+        return self.stats_rpc.get_stats_many(page_pks, timeout)
+
+    async def aget_stats_many(self, page_pks: list, timeout: float = None) -> dict:
+        """
+        Same as get_stats_many, but awaitable from async views
+        """
+        return await self.stats_rpc.aget_stats_many(page_pks, timeout)
+
+    def get_series(self, page_pk: int, granularity: str, start, end, timeout: float = None) -> list | None:
+        """
+        Get changes of page statistic per hour or day from microservice
+        @param page_pk: ID of page
+        @param granularity: 'hour' or 'day'
+        @param start: Datetime in the first bucket of series
+        @param end: Datetime in the last bucket of series
+        @param timeout: Seconds to wait for microservice
+        @return: List of buckets with start of bucket and changes of counters, None if microservice did not answer in time
+        """
+        return self.stats_rpc.get_series(page_pk, granularity, start, end, timeout)
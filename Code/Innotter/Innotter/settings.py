@@ -10,6 +10,31 @@ SECRET_KEY = config.get('SECRET_KEY', 'secret')
 
 CELERY_BROKER_URL = config.get('CELERY_BROKER_URL', 'amqp://rabbit:5672/')
 
+STATS_PUBLISHER_POOL_SIZE = int(config.get('STATS_PUBLISHER_POOL_SIZE', 4))
+STATS_RPC_TIMEOUT = float(config.get('STATS_RPC_TIMEOUT', 5))
+STATS_SERVICE_URL = config.get('STATS_SERVICE_URL', 'http://microservice:8001')
+
+REDIS_URL = config.get('REDIS_URL', 'redis://redis:6379/0')
+
+TIMELINE_REDIS_URL = config.get('TIMELINE_REDIS_URL', REDIS_URL)
+# timelines in memory are kept per process, they are meant for runs without redis, tests keep them in memory too
+TIMELINE_STORE = config.get('TIMELINE_STORE', 'redis')
+TIMELINE_MEMORY_USERS = int(config.get('TIMELINE_MEMORY_USERS', 10000))
+TIMELINE_MAX_SIZE = int(config.get('TIMELINE_MAX_SIZE', 800))
+TIMELINE_FANOUT_LIMIT = int(config.get('TIMELINE_FANOUT_LIMIT', 10000))
+TIMELINE_TTL_DAYS = int(config.get('TIMELINE_TTL_DAYS', 7))
+
+POSTS_PAGE_SIZE = int(config.get('POSTS_PAGE_SIZE', 50))
+POSTS_MAX_PAGE_SIZE = int(config.get('POSTS_MAX_PAGE_SIZE', 200))
+THREAD_MAX_DEPTH = int(config.get('THREAD_MAX_DEPTH', 10))
+THREAD_MAX_SIZE = int(config.get('THREAD_MAX_SIZE', 1000))
+
+RANKING_CANDIDATES = int(config.get('RANKING_CANDIDATES', 10000))
+RANKING_WINDOW_DAYS = int(config.get('RANKING_WINDOW_DAYS', 7))
+RANKING_HALF_LIFE_HOURS = float(config.get('RANKING_HALF_LIFE_HOURS', 24))
+RANKING_LIKE_WEIGHT = float(config.get('RANKING_LIKE_WEIGHT', 1))
+RANKING_FOLLOWER_WEIGHT = float(config.get('RANKING_FOLLOWER_WEIGHT', 0.5))
+
 AWS = {
     'AWS_ACCESS_KEY_ID': config.get('AWS_ACCESS_KEY_ID', 'temp'),
     'AWS_SECRET_ACCESS_KEY': config.get('AWS_SECRET_ACCESS_KEY', 'temp'),
@@ -48,6 +73,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'Innotter.middleware.StatsBatchMiddleware',
 ]
 
 ROOT_URLCONF = 'Innotter.urls'
@@ -70,6 +96,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'Innotter.wsgi.application'
 
+TEST_RUNNER = 'Innotter.test_runner.TestRunner'
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
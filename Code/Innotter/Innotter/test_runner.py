@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from kink import di
+
+from posts.timelines import MemoryTimelineStore
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Test runner that keeps timelines in memory, so tests don't need redis, whatever TIMELINE_STORE is
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        di['timeline_store'] = lambda di: MemoryTimelineStore(max_size=settings.TIMELINE_MAX_SIZE,
+                                                              max_users=settings.TIMELINE_MEMORY_USERS)
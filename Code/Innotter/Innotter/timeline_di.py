@@ -0,0 +1,21 @@
+from kink import di
+
+from Innotter.settings import TIMELINE_STORE, TIMELINE_REDIS_URL, TIMELINE_MAX_SIZE, TIMELINE_TTL_DAYS, \
+    TIMELINE_MEMORY_USERS
+from posts.timelines import MemoryTimelineStore, RedisTimelineStore
+
+
+def redis_timeline_store() -> RedisTimelineStore:
+    # redis is needed only when timelines are kept in it
+    import redis
+
+    return RedisTimelineStore(redis.Redis.from_url(TIMELINE_REDIS_URL), max_size=TIMELINE_MAX_SIZE,
+                              ttl=TIMELINE_TTL_DAYS * 24 * 3600)
+
+
+def timeline_di():
+    if TIMELINE_STORE == 'redis':
+        di['timeline_store'] = lambda di: redis_timeline_store()
+    else:
+        di['timeline_store'] = lambda di: MemoryTimelineStore(max_size=TIMELINE_MAX_SIZE,
+                                                              max_users=TIMELINE_MEMORY_USERS)
@@ -0,0 +1,64 @@
+"""
+Throughput of statistics events published to RabbitMQ, before and after the pooled publisher.
+
+Usage (inside the web container, with the rabbit service running):
+    pipenv run python benchmarks/bench_publisher.py --events 2000 --threads 8
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pika
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Innotter.producer import ChannelPool  # noqa: E402
+
+
+def publish_with_new_connection(conn_params: pika.ConnectionParameters, queue: str, message: str) -> None:
+    """
+    What every signal handler did before: full handshake, callback queue and declare per event
+    """
+    connection = pika.BlockingConnection(conn_params)
+    channel = connection.channel()
+    channel.queue_declare(queue='', exclusive=True)
+    channel.queue_declare(queue=queue)
+    channel.basic_publish(exchange='', routing_key=queue, body=message)
+    connection.close()
+
+
+def run(label: str, publish, events: int, threads: int) -> None:
+    message = json.dumps({'page': 0, 'field': 'benchmark', 'action': 'plus'})
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda _: publish(message), range(events)))
+    elapsed = time.perf_counter() - started
+    print(f'{label:<24} {events} events in {elapsed:.2f}s -> {events / elapsed:.0f} events/sec')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='rabbit')
+    parser.add_argument('--port', type=int, default=5672)
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--queue', default='stats_benchmark', help='Throwaway queue, so the consumer is not involved')
+    args = parser.parse_args()
+
+    conn_params = pika.ConnectionParameters(host=args.host, port=args.port)
+    pool = ChannelPool(conn_params, size=args.threads, queue_name=args.queue)
+
+    run('connection per event', lambda message: publish_with_new_connection(conn_params, args.queue, message),
+        args.events, args.threads)
+    run('pooled publisher', pool.publish, args.events, args.threads)
+
+    connection = pika.BlockingConnection(conn_params)
+    connection.channel().queue_delete(queue=args.queue)
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Query plans and timings of the feed and page queries of viewsets, on a database seeded with millions of posts.
+Every query is run with EXPLAIN ANALYZE on PostgreSQL, other databases get their plan and the time of a plain run.
+Run it before and after `migrate` to compare the plans with and without the indexes.
+
+Usage (inside the web container, against a throwaway database):
+    pipenv run python benchmarks/bench_queries.py --seed --users 20000 --pages 50000 --posts 2000000
+    pipenv run python benchmarks/bench_queries.py --output plans.json
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+from datetime import timedelta
+
+import django
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Innotter.settings')
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.db.models import Count, Q  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from Innotter.pagination import older_than  # noqa: E402
+from pages.models import Page  # noqa: E402
+from posts import viewset_data  # noqa: E402
+from posts.models import Post  # noqa: E402
+from users.models import User  # noqa: E402
+
+BATCH_SIZE = 10000
+PAGE_SIZE = 50
+SPREAD_CREATED_AT = {
+    'postgresql': "UPDATE posts_post SET created_at = now() - random() * interval '365 days' "
+                  "WHERE content = 'benchmark'",
+    'sqlite': "UPDATE posts_post SET created_at = strftime('%Y-%m-%d %H:%M:%f', 'now', "
+              "'-' || abs(random() % 31536000) || ' seconds') WHERE content = 'benchmark'",
+}
+
+
+def seed(users: int, pages: int, posts: int, follows: int, likes: int, replies: float) -> None:
+    """
+    Insert rows in batches without signals. Followers and likes are spread unevenly, so a few pages are large
+    """
+    started = time.perf_counter()
+    now = timezone.now()
+    first_user = (User.objects.order_by('-pk').values_list('pk', flat=True).first() or 0) + 1
+    for start in range(0, users, BATCH_SIZE):
+        User.objects.bulk_create(User(username=f'bench{first_user + n}', email=f'bench{first_user + n}@bench.local',
+                                      role='user', is_blocked=random.random() < 0.01)
+                                 for n in range(start, min(start + BATCH_SIZE, users)))
+    user_pks = list(User.objects.filter(username__startswith='bench').values_list('pk', flat=True))
+
+    first_page = (Page.objects.order_by('-pk').values_list('pk', flat=True).first() or 0) + 1
+    for start in range(0, pages, BATCH_SIZE):
+        Page.objects.bulk_create(Page(name=f'bench{first_page + n}', puid=f'bench{first_page + n}', description='',
+                                      owner_id=random.choice(user_pks),
+                                      unblock_date=now + timedelta(days=1) if random.random() < 0.02 else None)
+                                 for n in range(start, min(start + BATCH_SIZE, pages)))
+    page_pks = list(Page.objects.filter(puid__startswith='bench').values_list('pk', flat=True))
+
+    recent_post_pks = []
+    inserted = 0
+    while inserted < posts:
+        # the first batch is small and has no replies, so the rest can reply to it even when few posts are seeded
+        size = min(BATCH_SIZE if recent_post_pks else max(posts // 10, 1), posts - inserted)
+        Post.objects.bulk_create(
+            Post(page_id=random.choice(page_pks), content='benchmark',
+                 reply_to_id=random.choice(recent_post_pks) if recent_post_pks and random.random() < replies else None)
+            for _ in range(size))
+        inserted += size
+        recent_post_pks = list(Post.objects.order_by('-pk').values_list('pk', flat=True)[:BATCH_SIZE])
+        print(f'posts {inserted}/{posts}', end='\r', flush=True)
+    print()
+    # created_at is set to the time of insert, posts are spread over a year instead
+    with connection.cursor() as cursor:
+        cursor.execute(SPREAD_CREATED_AT[connection.vendor])
+
+    _relate(Page.followers.through, 'page_id', page_pks, 'user_id', user_pks, follows)
+    post_range = Post.objects.order_by('pk').values_list('pk', flat=True)
+    post_pks = (post_range.first(), post_range.last())
+    _relate(Post.likes.through, 'post_id', post_pks, 'user_id', user_pks, likes, pk_range=True)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('ANALYZE')
+    print(f'seeded in {time.perf_counter() - started:.0f}s')
+
+
+def _relate(through, left: str, left_pks, right: str, right_pks: list, count: int, pk_range: bool = False) -> None:
+    """
+    Insert count distinct pairs, left rows are picked with a skew, so some of them get most of the pairs
+    """
+    pairs = set()
+    while len(pairs) < count:
+        if pk_range:
+            left_pk = left_pks[0] + int((left_pks[1] - left_pks[0]) * random.random() ** 3)
+        else:
+            left_pk = left_pks[int(len(left_pks) * random.random() ** 3)]
+        pairs.add((left_pk, random.choice(right_pks)))
+        if len(pairs) >= BATCH_SIZE or len(pairs) == count:
+            through.objects.bulk_create((through(**{left: a, right: b}) for a, b in pairs), ignore_conflicts=True)
+            count -= len(pairs)
+            pairs = set()
+
+
+def queries() -> dict:
+    """
+    Querysets of viewset actions, for the user who follows most pages and the largest page and thread
+    """
+    now = timezone.now()
+    visible = Q(page__unblock_date=None) | Q(page__unblock_date__lt=now)
+    user = User.objects.get(pk=Page.followers.through.objects.values('user_id').annotate(n=Count('*'))
+                            .order_by('-n').values_list('user_id', flat=True)[0])
+    page = Page.objects.get(pk=Post.objects.values('page_id').annotate(n=Count('*'))
+                            .order_by('-n').values_list('page_id', flat=True)[0])
+    thread = Post.objects.filter(reply_to__isnull=False).values('reply_to_id').annotate(n=Count('*'))\
+                         .order_by('-n').values_list('reply_to_id', flat=True).first()
+    middle = Post.objects.filter(page=page).order_by('-created_at', '-pk')[min(PAGE_SIZE * 10, page.posts.count() - 1)]
+    news = viewset_data.querysets['news'].filter(visible).filter(page__owner__is_blocked=False)
+    plans = {
+        'news: timeline build': Post.objects.filter(page__followers=user).order_by('-created_at', '-pk')
+                                            .values_list('pk', 'created_at')[:800],
+        'news: own pages': Post.objects.filter(page__owner=user).order_by('-created_at', '-pk')[:PAGE_SIZE + 1],
+        'news: posts by id': news.filter(pk__in=list(Post.objects.filter(page__followers=user)
+                                                     .values_list('pk', flat=True)[:PAGE_SIZE])),
+        'page posts: first': page.posts.order_by('-created_at', '-pk')[:PAGE_SIZE + 1],
+        'page posts: after cursor': older_than(page.posts.all(), (middle.created_at, middle.pk))
+                                    .order_by('-created_at', '-pk')[:PAGE_SIZE + 1],
+        'liked': user.liked.order_by('-created_at', '-pk')[:PAGE_SIZE + 1],
+        'post list': viewset_data.querysets['list'][:PAGE_SIZE],
+    }
+    if thread is not None:
+        plans['replies'] = viewset_data.querysets['replies'].filter(reply_to=thread).filter(visible)\
+                                                            .filter(page__owner__is_blocked=False)\
+                                                            .order_by('-created_at', '-pk')[:PAGE_SIZE + 1]
+    return plans
+
+
+def explain(label: str, queryset) -> dict:
+    if connection.vendor == 'postgresql':
+        plan = queryset.explain(analyze=True, buffers=True)
+        took = float(re.search(r'Execution Time: ([\d.]+) ms', plan).group(1))
+    else:
+        plan = queryset.explain()
+        started = time.perf_counter()
+        list(queryset)
+        took = (time.perf_counter() - started) * 1000
+    print(f'{label:<28} {took:10.2f} ms')
+    return {'query': label, 'ms': took, 'plan': plan}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seed', action='store_true', help='Insert rows into the configured database first')
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--pages', type=int, default=50000)
+    parser.add_argument('--posts', type=int, default=2000000)
+    parser.add_argument('--follows', type=int, default=500000)
+    parser.add_argument('--likes', type=int, default=2000000)
+    parser.add_argument('--replies', type=float, default=0.2, help='Share of posts that are replies')
+    parser.add_argument('--output', help='Write plans and timings as JSON')
+    parser.add_argument('--verbose', action='store_true', help='Print plans')
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args.users, args.pages, args.posts, args.follows, args.likes, args.replies)
+    results = [explain(label, queryset) for label, queryset in queries().items()]
+    if args.verbose:
+        for result in results:
+            print(f'\n{result["query"]}\n{result["plan"]}')
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'vendor': connection.vendor, 'results': results}, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
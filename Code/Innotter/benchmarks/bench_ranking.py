@@ -0,0 +1,96 @@
+"""
+Time of scoring the candidates of a ranked news feed, per object in Python and in one vectorized pass with NumPy.
+Both start from the rows the candidate query returns, (post ID, created_at, likes, page ID), and pick the top posts.
+'scoring' is the vectorized pass alone, on columns that are already arrays.
+
+Usage:
+    pipenv run python benchmarks/bench_ranking.py --candidates 10000 50000 100000 --limit 50
+"""
+import argparse
+import heapq
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from functools import partial
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from posts.ranking import decay_scores, top  # noqa: E402
+
+HALF_LIFE = 24 * 3600
+LIKE_WEIGHT = 1.0
+FOLLOWER_WEIGHT = 0.5
+
+
+def candidates(count: int, pages: int) -> tuple[list, dict]:
+    """
+    Rows of posts of the last week and followers of their pages, both skewed so a few are popular
+    """
+    now = datetime.now(tz=timezone.utc)
+    rows = [(pk, now - timedelta(seconds=random.random() * 7 * 24 * 3600), int(random.paretovariate(1.5)) - 1,
+             random.randrange(pages)) for pk in range(count)]
+    followers = {page_pk: int(random.paretovariate(1.2) * 10) for page_pk in range(pages)}
+    return rows, followers
+
+
+def python_top(rows: list, followers: dict, now: float, limit: int) -> list:
+    scores = []
+    for pk, created_at, likes, page_pk in rows:
+        engagement = 1.0 + LIKE_WEIGHT * likes + FOLLOWER_WEIGHT * math.log1p(followers[page_pk])
+        scores.append((engagement * 2 ** (-max(now - created_at.timestamp(), 0.0) / HALF_LIFE), pk))
+    return [pk for _, pk in heapq.nlargest(limit, scores)]
+
+
+def numpy_top(rows: list, followers: dict, now: float, limit: int) -> list:
+    post_pks, created_at, likes, page_pks = zip(*rows)
+    scores = decay_scores(np.fromiter((value.timestamp() for value in created_at), float, len(rows)),
+                          np.array(likes, dtype=float),
+                          np.fromiter((followers[page_pk] for page_pk in page_pks), float, len(rows)),
+                          now, HALF_LIFE, LIKE_WEIGHT, FOLLOWER_WEIGHT)
+    return [post_pks[index] for index in top(scores, limit)]
+
+
+def scoring_top(columns: tuple, now: float, limit: int) -> list:
+    post_pks, created_at, likes, page_followers = columns
+    return post_pks[top(decay_scores(created_at, likes, page_followers, now, HALF_LIFE, LIKE_WEIGHT,
+                                     FOLLOWER_WEIGHT), limit)].tolist()
+
+
+def run(label: str, rank, count: int, limit: int, repeat: int) -> list:
+    now = time.time()
+    took = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = rank(now, limit)
+        took.append(time.perf_counter() - started)
+    print(f'{label:<10} {count:>7} candidates {min(took) * 1000:9.2f} ms')
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--candidates', type=int, nargs='+', default=[10000, 50000, 100000])
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for count in args.candidates:
+        rows, followers = candidates(count, args.pages)
+        expected = run('python', partial(python_top, rows, followers), count, args.limit, args.repeat)
+        result = run('numpy', partial(numpy_top, rows, followers), count, args.limit, args.repeat)
+        columns = (np.array([row[0] for row in rows]), np.array([row[1].timestamp() for row in rows]),
+                   np.array([row[2] for row in rows], dtype=float),
+                   np.array([followers[row[3]] for row in rows], dtype=float))
+        run('scoring', partial(scoring_top, columns), count, args.limit, args.repeat)
+        if set(result) != set(expected):
+            print('rankings differ')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from pages.services import reconcile_stats
+
+
+class Command(BaseCommand):
+    help = 'Fix counters of page statistic in microservice with counts from database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Number of pages compared at once')
+        parser.add_argument('--dry-run', action='store_true', help='Only print the differences')
+
+    def handle(self, *args, **options):
+        differences = 0
+        for page_pk, field, stored, count in reconcile_stats(options['chunk_size'], options['dry_run']):
+            differences += 1
+            self.stdout.write(f'page {page_pk}: {field} {stored} -> {count}')
+        action = 'found' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'{differences} differing counters {action}'))
@@ -0,0 +1,17 @@
+# Generated by Django 4.0.6 on 2026-10-18 13:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0003_remove_page_image'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='page',
+            index=models.Index(fields=['unblock_date'], name='pages_unblock_date_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.0.6 on 2026-10-18 18:40
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 10000
+
+
+def count_followers(apps, schema_editor):
+    """
+    Fill followers_count of existing pages from the followers table, one range of IDs per statement
+    """
+    Page = apps.get_model('pages', 'Page')
+    followers = Page.followers.through.objects.filter(page_id=OuterRef('pk')).values('page_id')\
+                                              .annotate(total=Count('*')).values('total')
+    last_pk = Page.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    for start in range(0, last_pk, BATCH_SIZE):
+        Page.objects.filter(pk__gt=start, pk__lte=start + BATCH_SIZE)\
+                    .update(followers_count=Coalesce(Subquery(followers, output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0004_page_pages_unblock_date_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='page',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_followers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.0.6 on 2026-10-18 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0005_page_followers_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='page',
+            index=models.Index(condition=models.Q(('unblock_date__isnull', True)), fields=['id'], name='pages_unblocked_idx'),
+        ),
+    ]
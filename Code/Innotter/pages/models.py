@@ -1,5 +1,6 @@
 from django.db import models
-from django.db.models.signals import post_save, m2m_changed
+from django.db.models import F
+from django.db.models.signals import post_save, pre_delete, m2m_changed
 from django.dispatch import receiver
 from Innotter.producer import Statistics
 
@@ -21,6 +22,15 @@ class Page(models.Model):
     is_private = models.BooleanField(default=False)
     follow_requests = models.ManyToManyField('users.User', related_name='requests', blank=True)
     unblock_date = models.DateTimeField(null=True, blank=True)
+    # number of rows of followers, kept by followers_handler in the transaction that changes them
+    followers_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['unblock_date'], name='pages_unblock_date_idx'),
+            # most pages were never blocked, feeds join only them through this index
+            models.Index(fields=['id'], condition=models.Q(unblock_date__isnull=True), name='pages_unblocked_idx'),
+        ]
 
     def __str__(self):
         return f'Name = {self.name}, puid = {self.puid}'
@@ -32,10 +42,40 @@ def new_page_handler(sender, instance, created, **kwargs):
         Statistics().publish(page_pk=int(instance.pk), field='page', action='new')
 
 
+@receiver(pre_delete, sender=Page)
+def delete_page_handler(sender, instance, using, **kwargs):
+    Statistics().publish(page_pk=int(instance.pk), field='page', action='delete')
+
+
 @receiver(m2m_changed, sender=Page.followers.through)
-def followers_handler(sender, instance, action, **kwargs):
+def followers_handler(sender, instance, action, reverse, pk_set, **kwargs):
+    match action:
+        case 'post_add' if pk_set:
+            # pk_set holds only the rows that were missing and are inserted
+            if reverse:
+                Page.objects.filter(pk__in=pk_set).update(followers_count=F('followers_count') + 1)
+            else:
+                Page.objects.filter(pk=instance.pk).update(followers_count=F('followers_count') + len(pk_set))
+        case 'pre_remove' if pk_set:
+            # pk_set holds every given ID, only the rows that exist are deleted
+            if reverse:
+                Page.objects.filter(pk__in=pk_set, followers=instance)\
+                            .update(followers_count=F('followers_count') - 1)
+            else:
+                removed = Page.followers.through.objects.filter(page_id=instance.pk, user_id__in=pk_set).count()
+                Page.objects.filter(pk=instance.pk).update(followers_count=F('followers_count') - removed)
+        case 'pre_clear' if reverse:
+            Page.objects.filter(followers=instance).update(followers_count=F('followers_count') - 1)
+        case 'post_clear' if not reverse:
+            Page.objects.filter(pk=instance.pk).update(followers_count=0)
     match action:
         case 'post_add':
             Statistics().publish(page_pk=int(instance.pk), field='follower', action='plus')
         case 'post_remove':
             Statistics().publish(page_pk=int(instance.pk), field='follower', action='minus')
+
+
+@receiver(pre_delete, sender='users.User')
+def delete_follower_handler(sender, instance, using, **kwargs):
+    # rows of a deleted user are removed by cascade, that sends no m2m_changed
+    Page.objects.filter(followers=instance).update(followers_count=F('followers_count') - 1)
@@ -1,3 +1,6 @@
+from datetime import timedelta
+
+from django.utils import timezone
 from rest_framework import serializers
 
 from pages.models import Page, Tag
@@ -46,3 +49,26 @@ class SimplePageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Page
         fields = ('id', 'unblock_date')
+
+
+class StatsSeriesSerializer(serializers.Serializer):
+    MAX_BUCKETS = 1000
+    STEPS = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+    granularity = serializers.ChoiceField(choices=tuple(STEPS), default='hour')
+
+    def validate(self, attrs):
+        attrs.setdefault('end', timezone.now())
+        attrs.setdefault('start', attrs['end'] - timedelta(days=7))
+        if attrs['start'] > attrs['end']:
+            raise serializers.ValidationError('Start of series must be before its end')
+        if (attrs['end'] - attrs['start']) / self.STEPS[attrs['granularity']] >= self.MAX_BUCKETS:
+            raise serializers.ValidationError(f'Series must have less than {self.MAX_BUCKETS} buckets')
+        return attrs
+
+
+class LeaderboardSerializer(serializers.Serializer):
+    field = serializers.ChoiceField(choices=('post', 'like', 'follower'), default='follower')
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
@@ -0,0 +1,52 @@
+from django.db.models import Count
+
+from Innotter.producer import Statistics
+from pages.models import Page
+from posts.models import Post
+
+COUNTERS = {'post': 'posts_count', 'like': 'likes_count', 'follower': 'followers_count'}
+
+
+def true_counts(page_pks: list) -> dict:
+    """
+    Count posts, likes and followers of pages with one grouped query per counter
+    @param page_pks: IDs of pages
+    @return: Counts by ID of page and field ('post', 'like', 'follower')
+    """
+    counts = {page_pk: dict.fromkeys(COUNTERS, 0) for page_pk in page_pks}
+    queries = {
+        'post': Post.objects.filter(page_id__in=page_pks).values_list('page_id'),
+        'like': Post.likes.through.objects.filter(post__page_id__in=page_pks).values_list('post__page_id'),
+        'follower': Page.followers.through.objects.filter(page_id__in=page_pks).values_list('page_id'),
+    }
+    for field, query in queries.items():
+        for page_pk, count in query.annotate(count=Count('*')).order_by():
+            counts[page_pk][field] = count
+    return counts
+
+
+def reconcile_stats(chunk_size: int = 1000, dry_run: bool = False):
+    """
+    Compare counters in microservice with counts from database, chunk by chunk of pages in order of ID,
+    and send the true values of differing counters to microservice. Only one chunk is held in memory.
+    Pages whose statistic was not received are skipped
+    @param chunk_size: Number of pages in a chunk
+    @param dry_run: Only report the differences
+    @return: Generator of differences, (page ID, field, counter in microservice, true count)
+    """
+    statistics = Statistics()
+    last_pk = 0
+    while page_pks := list(Page.objects.filter(pk__gt=last_pk).order_by('pk')
+                           .values_list('pk', flat=True)[:chunk_size]):
+        last_pk = page_pks[-1]
+        stored = statistics.get_stats_many(page_pks)
+        fixed = {}
+        for page_pk, counts in true_counts(page_pks).items():
+            if stored.get(page_pk) is None:
+                continue
+            for field, count in counts.items():
+                if stored[page_pk].get(COUNTERS[field], 0) != count:
+                    fixed.setdefault(page_pk, {})[field] = count
+                    yield page_pk, field, stored[page_pk].get(COUNTERS[field], 0), count
+        if fixed and not dry_run:
+            statistics.publish_counters(fixed)
@@ -1,6 +1,7 @@
 from celery import shared_task
 from Innotter.aws import ses
 from Innotter.settings import AWS
+from pages.services import reconcile_stats
 
 
 @shared_task
@@ -23,3 +24,8 @@ def send_mail_to_followers(post_content, page_name, followers_mails):
             },
             Source=AWS['AWS_EMAIL_SOURCE'],
         )
+
+
+@shared_task
+def reconcile_stats_task(chunk_size=1000, dry_run=False):
+    return sum(1 for _ in reconcile_stats(chunk_size, dry_run))
@@ -0,0 +1,48 @@
+import json
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from rest_framework.test import APITestCase
+
+from Innotter.producer import ChannelPool, Statistics
+from users.models import User
+from pages.models import Page
+from pages.services import true_counts
+from posts.models import Post
+
+
+def stored(posts=0, likes=0, followers=0):
+    return {'posts_count': posts, 'likes_count': likes, 'followers_count': followers}
+
+
+@patch.object(ChannelPool, 'publish')
+class ReconcileStatsTestCase(APITestCase):
+    fixtures = ['views.yaml']
+
+    def setUp(self):
+        self.user1 = User.objects.get(pk=1)
+        self.user2 = User.objects.get(pk=2)
+        self.page1 = Page.objects.get(pk=1)
+        self.page1.followers.set([self.user2])
+        for _ in range(2):
+            Post.objects.create(content='content', page=self.page1).likes.set([self.user1, self.user2])
+
+    def test_true_counts(self, mocked_publish):
+        self.assertEqual(true_counts([1, 2]), {1: {'post': 2, 'like': 4, 'follower': 1},
+                                               2: {'post': 0, 'like': 0, 'follower': 0}})
+
+    def test_differing_counters_are_sent(self, mocked_publish):
+        with patch.object(Statistics, 'get_stats_many', return_value={1: stored(2, 3, 1), 2: stored(followers=1)}):
+            out = StringIO()
+            call_command('reconcile_stats', chunk_size=1, stdout=out)
+        self.assertIn('page 1: like 3 -> 4', out.getvalue())
+        messages = [json.loads(call.args[0]) for call in mocked_publish.call_args_list]
+        self.assertEqual([message['counters'] for message in messages], [{'1': {'like': 4}}, {'2': {'follower': 0}}])
+
+    def test_dry_run_sends_nothing(self, mocked_publish):
+        with patch.object(Statistics, 'get_stats_many', return_value={1: stored(), 2: None}):
+            out = StringIO()
+            call_command('reconcile_stats', dry_run=True, stdout=out)
+        self.assertIn('3 differing counters found', out.getvalue())
+        mocked_publish.assert_not_called()
@@ -0,0 +1,106 @@
+import json
+from unittest.mock import patch
+
+from django.db import transaction
+from django.urls import reverse
+from rest_framework.test import APITestCase, APIClient
+
+from Innotter.producer import ChannelPool, Statistics, stats_batch
+from users.models import User
+from pages.models import Page
+from posts.models import Post
+
+
+@patch.object(ChannelPool, 'publish')
+class StatsBatchTestCase(APITestCase):
+    fixtures = ['views.yaml']
+
+    def setUp(self):
+        self.user1 = User.objects.get(pk=1)
+        self.user2 = User.objects.get(pk=2)
+        self.page1 = Page.objects.get(pk=1)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+
+    def test_accept_all_requests_sends_one_message(self, mocked_publish):
+        self.page1.follow_requests.set([self.user1, self.user2])
+        self.page1.is_private = True
+        self.page1.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(reverse('pages-accept-all-requests', args=[self.page1.pk]))
+        self.assertEqual(response.status_code, 200)
+        mocked_publish.assert_called_once()
+        message = json.loads(mocked_publish.call_args.args[0])
+        self.assertEqual(message['deltas'], {str(self.page1.pk): {'follower': 2}})
+
+    def test_opposite_events_cancel_out(self, mocked_publish):
+        with self.captureOnCommitCallbacks(execute=True):
+            with stats_batch():
+                Statistics().publish(page_pk=self.page1.pk, field='like', action='plus')
+                Statistics().publish(page_pk=self.page1.pk, field='like', action='minus')
+        mocked_publish.assert_not_called()
+
+    def test_rolled_back_events_are_not_sent(self, mocked_publish):
+        with self.captureOnCommitCallbacks(execute=True):
+            with stats_batch():
+                Statistics().publish(page_pk=self.page1.pk, field='post', action='plus')
+                try:
+                    with transaction.atomic():
+                        Statistics().publish(page_pk=self.page1.pk, field='post', action='plus')
+                        raise ValueError
+                except ValueError:
+                    pass
+        message = json.loads(mocked_publish.call_args.args[0])
+        self.assertEqual(message['deltas'], {str(self.page1.pk): {'post': 1}})
+
+    def test_post_delete_sends_counts(self, mocked_publish):
+        post = Post.objects.create(content='content', page=self.page1)
+        post.likes.set([self.user1, self.user2])
+        post.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            with stats_batch():
+                post.delete()
+        message = json.loads(mocked_publish.call_args.args[0])
+        self.assertEqual(message['deltas'], {str(self.page1.pk): {'like': -2, 'post': -1}})
+
+    def test_removed_likes_are_sent_as_one_change(self, mocked_publish):
+        post = Post.objects.create(content='content', page=self.page1)
+        post.likes.set([self.user1, self.user2])
+        mocked_publish.reset_mock()
+        with self.captureOnCommitCallbacks(execute=True):
+            post.likes.remove(self.user1, self.user2)
+        mocked_publish.assert_called_once()
+        message = json.loads(mocked_publish.call_args.args[0])
+        self.assertEqual(message['deltas'], {str(self.page1.pk): {'like': -2}})
+
+    def test_user_delete_sends_removed_likes(self, mocked_publish):
+        page2 = Page.objects.get(pk=2)
+        posts = [Post.objects.create(content='content', page=page) for page in (self.page1, page2, page2)]
+        self.user1.liked.set(posts)
+        self.user2.liked.set(posts[1:])
+        with self.captureOnCommitCallbacks(execute=True):
+            with stats_batch():
+                self.user1.delete()
+        message = json.loads(mocked_publish.call_args.args[0])
+        self.assertEqual(message['deltas'], {str(page2.pk): {'like': -2}})
+        self.assertEqual(message['deleted'], [self.page1.pk])
+        self.assertEqual(list(Post.objects.filter(page=page2).values_list('likes_count', flat=True)), [1, 1])
+
+    def test_page_delete_sends_one_event(self, mocked_publish):
+        for _ in range(3):
+            Post.objects.create(content='content', page=self.page1).likes.set([self.user2])
+        with self.captureOnCommitCallbacks(execute=True):
+            with stats_batch():
+                self.page1.delete()
+        mocked_publish.assert_called_once()
+        message = json.loads(mocked_publish.call_args.args[0])
+        self.assertEqual(message['deltas'], {})
+        self.assertEqual(message['deleted'], [1])
+
+    def test_messages_have_own_event_ids(self, mocked_publish):
+        with self.captureOnCommitCallbacks(execute=True):
+            Statistics().publish(page_pk=self.page1.pk, field='like', action='plus')
+            Statistics().publish(page_pk=self.page1.pk, field='like', action='plus')
+        event_ids = {call.args[1].message_id for call in mocked_publish.call_args_list}
+        self.assertEqual(len(event_ids), 2)
+        self.assertNotIn(None, event_ids)
@@ -0,0 +1,48 @@
+import json
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pika
+from rest_framework.test import APITestCase
+
+from Innotter.producer import StatsRpcClient
+
+
+class StatsRpcClientTestCase(APITestCase):
+    def setUp(self):
+        self.client = StatsRpcClient(pika.ConnectionParameters(host='localhost'), timeout=0.01)
+        self.client._pending = {}
+        self.client._ready = threading.Event()
+        self.client._ready.set()
+        self.client._connection = MagicMock()
+        patcher = patch.object(StatsRpcClient, '_ensure_started')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def reply(self, corr_id: str, body, **properties):
+        self.client._on_response(None, None, pika.BasicProperties(correlation_id=corr_id, **properties),
+                                 json.dumps(body))
+
+    def test_unanswered_requests_are_forgotten(self):
+        self.client._remember(('stats', 1), {'posts_count': 1})
+        self.assertEqual(self.client.get_stats(1), {'posts_count': 1})
+        self.assertEqual(self.client._pending, {})
+        publish = self.client._connection.add_callback_threadsafe.call_args.args[0]
+        self.reply(publish.args[0], {'posts_count': 2})
+
+    def test_answered_requests_are_forgotten(self):
+        future = self.client.request({'page': 1, 'field': 'page', 'action': 'stats'})
+        corr_id, = self.client._pending
+        self.reply(corr_id, {'posts_count': 2})
+        self.assertEqual((future.result(), self.client._pending), ({'posts_count': 2}, {}))
+
+    def test_error_reply_falls_back_at_once(self):
+        self.client.timeout = 5
+        self.client._remember(('stats', 1), {'posts_count': 1})
+        self.client._connection.add_callback_threadsafe.side_effect = \
+            lambda publish: self.reply(publish.args[0], {'detail': 'Statistic was not read'}, type='error')
+        started = time.monotonic()
+        self.assertEqual(self.client.get_stats(1), {'posts_count': 1})
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(self.client._pending, {})
@@ -1,7 +1,10 @@
+from concurrent.futures import Future
 from datetime import timezone
 from unittest.mock import patch
 
+import requests
 from django.urls import reverse
+from kink import di
 from rest_framework.test import APITestCase, APIClient
 from faker import Faker
 
@@ -9,6 +12,7 @@ from pages.serializers import PageSerializer, PageRetrieveSerializer, PageUserSe
 from posts.models import Post
 from users.models import User
 from pages.models import Page, Tag
+from Innotter.producer import StatsRpcClient
 
 
 class PageViewSetTestCase(APITestCase):
@@ -47,6 +51,21 @@ class PageViewSetTestCase(APITestCase):
         result = Page.objects.get(pk=self.page2.pk).followers.filter(pk=self.user1.pk).first()
         self.assertEqual(result, self.user1)
 
+    def test_followers_count_follows_changes_from_both_sides(self):
+        self.page1.followers.clear()
+        self.page2.followers.clear()
+        self.page1.followers.add(self.user1, self.user2)
+        self.user1.follows.add(self.page2)
+        self.assertEqual(list(Page.objects.order_by('pk').values_list('followers_count', flat=True)), [2, 1])
+        self.user1.follows.remove(self.page1, self.page2)
+        self.page1.followers.remove(self.user1)
+        self.assertEqual(list(Page.objects.order_by('pk').values_list('followers_count', flat=True)), [1, 0])
+        self.user2.follows.clear()
+        self.page2.followers.set([self.user1, self.user2])
+        self.assertEqual(list(Page.objects.order_by('pk').values_list('followers_count', flat=True)), [0, 2])
+        self.user1.delete()
+        self.assertEqual(Page.objects.get(pk=self.page2.pk).followers_count, 1)
+
     def test_unfollow(self):
         self.page2.followers.set([self.user1])
         self.assertEqual(self.user1, Page.objects.get(pk=self.page2.pk).followers.filter(pk=self.user1.pk).first())
@@ -63,13 +82,16 @@ class PageViewSetTestCase(APITestCase):
 
     def test_posts(self):
         response = self.client.get(reverse('pages-posts', args=[self.page2.pk]))
-        self.assertEqual(response.data, [])
+        self.assertEqual(response.data, {'next': None, 'results': []})
 
         post1 = Post.objects.create(content=self.fake.name(), page=self.page2)
         post2 = Post.objects.create(content=self.fake.name(), page=self.page2)
+        post3 = Post.objects.create(content=self.fake.name(), page=self.page2)
 
-        response = self.client.get(reverse('pages-posts', args=[self.page2.pk]))
-        self.assertEqual(response.data, PostsSerializer([post1, post2], many=True).data)
+        response = self.client.get(reverse('pages-posts', args=[self.page2.pk]), {'limit': 2})
+        self.assertEqual(response.data['results'], PostsSerializer([post3, post2], many=True).data)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.data, {'next': None, 'results': PostsSerializer([post1], many=True).data})
 
     @patch('Innotter.aws.ses')
     def test_new_post(self, mocked_ses):
@@ -164,3 +186,47 @@ class PageViewSetTestCase(APITestCase):
         self.page1.tags.add(tag)
         self.client.delete(reverse('pages-tag', args=[self.page1.pk]), data={'name': tag_name}, format='json')
         self.assertFalse(Page.objects.get(pk=self.page1.pk).tags.exists())
+
+    def test_stats(self):
+        stats = {'page_id': self.page1.pk, 'posts_count': 1, 'likes_count': 2, 'followers_count': 3}
+        answered, unanswered = Future(), Future()
+        answered.set_result(stats)
+        with patch.object(StatsRpcClient, 'request', side_effect=[answered, unanswered]):
+            response = self.client.get(reverse('pages-stats', args=[self.page1.pk]))
+            self.assertEqual(response.data, {'stats': stats})
+            with patch.object(di['stats_rpc'], 'timeout', 0.01):
+                response = self.client.get(reverse('pages-stats', args=[self.page1.pk]))
+            self.assertEqual(response.data, {'stats': stats})
+
+    def test_stats_series(self):
+        series = [{'start': '2022-09-01T00:00:00+00:00', 'posts_count': 0, 'likes_count': 2, 'followers_count': 1}]
+        answered = Future()
+        answered.set_result(series)
+        with patch.object(StatsRpcClient, 'request', return_value=answered) as mocked_request:
+            response = self.client.get(reverse('pages-stats-series', args=[self.page1.pk]),
+                                       {'granularity': 'day', 'start': '2022-09-01T00:00Z', 'end': '2022-09-07T00:00Z'})
+        self.assertEqual(response.data, {'series': series})
+        message = mocked_request.call_args.args[0]
+        self.assertEqual((message['action'], message['granularity']), ('series', 'day'))
+        response = self.client.get(reverse('pages-stats-series', args=[self.page1.pk]),
+                                   {'start': '2022-09-07T00:00Z', 'end': '2022-09-01T00:00Z'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_leaderboard(self):
+        entries = [{'rank': 1, 'page_id': self.page2.pk, 'likes_count': 7},
+                   {'rank': 2, 'page_id': 999, 'likes_count': 3}]
+        with patch('pages.views.requests.get') as mocked_get:
+            mocked_get.return_value.json.return_value = entries
+            response = self.client.get(reverse('pages-leaderboard'), {'field': 'like', 'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(entry['page_id'], entry['name']) for entry in response.data['leaderboard']],
+                         [(self.page2.pk, self.page2.name), (999, None)])
+        self.assertTrue(mocked_get.call_args.args[0].endswith('/leaderboard/like'))
+        self.assertEqual(mocked_get.call_args.kwargs['params'], {'limit': 2})
+        response = self.client.get(reverse('pages-leaderboard'), {'field': 'views'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_leaderboard_without_microservice(self):
+        with patch('pages.views.requests.get', side_effect=requests.ConnectionError):
+            response = self.client.get(reverse('pages-leaderboard'), {'field': 'like'})
+        self.assertEqual(response.status_code, 503)
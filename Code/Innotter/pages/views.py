@@ -5,13 +5,16 @@ from rest_framework.response import Response
 
 from pages.models import Page, Tag
 from pages.permissions import IsPageNotBlocked, IsOwner
-from pages.serializers import PageRetrieveSerializer, PostsSerializer
+from pages.serializers import PageRetrieveSerializer, PostsSerializer, StatsSeriesSerializer, LeaderboardSerializer
 from users.permissions import IsNotBlocked
 from users.models import User
 from pages import viewset_data
 from pages.tasks import send_mail_to_followers
 from Innotter.producer import Statistics
+from Innotter.pagination import KeysetPagination
+import logging
 import requests
+from django.conf import settings
 
 
 class PageViewSet(viewsets.ModelViewSet):
@@ -61,8 +64,9 @@ class PageViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def posts(self, request, pk=None):
         page = self.get_object()
-        serializer = self.get_serializer(instance=page.posts, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        paginator = KeysetPagination()
+        serializer = self.get_serializer(instance=paginator.paginate_queryset(page.posts.all(), request), many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['post'])
     def new_post(self, request, pk=None):
@@ -166,6 +170,34 @@ class PageViewSet(viewsets.ModelViewSet):
         page = self.get_object()
         return Response(data={'stats': Statistics().get_stats(page_pk=int(page.pk))}, status=status.HTTP_200_OK)
 
+    @action(detail=True, methods=['get'], url_path='stats/series')
+    def stats_series(self, request, pk=None):
+        page = self.get_object()
+        serializer = StatsSeriesSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        series = Statistics().get_series(page_pk=int(page.pk), **serializer.validated_data)
+        return Response(data={'series': series}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def leaderboard(self, request):
+        serializer = LeaderboardSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        field, limit = serializer.validated_data['field'], serializer.validated_data['limit']
+        try:
+            response = requests.get(f'{settings.STATS_SERVICE_URL}/leaderboard/{field}', params={'limit': limit},
+                                    timeout=settings.STATS_RPC_TIMEOUT)
+            response.raise_for_status()
+            entries = response.json()
+        except (requests.RequestException, ValueError):
+            logging.exception('Leaderboard of %s is not available', field)
+            return Response(data={'detail': 'Statistic service is not available'},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        pages = Page.objects.in_bulk([entry['page_id'] for entry in entries])
+        for entry in entries:
+            page = pages.get(entry['page_id'])
+            entry['name'] = page.name if page else None
+        return Response(data={'leaderboard': entries}, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['get'])
     def rest_stats(self, request, pk=None):
         page = self.get_object()
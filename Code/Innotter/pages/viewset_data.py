@@ -20,6 +20,7 @@ permissions = {
             'accept_request': [IsPageNotBlocked, IsOwner, IsPrivatePage, RequestIdInFollowRequests],
             'decline_request': [IsPageNotBlocked, IsOwner, IsPrivatePage, RequestIdInFollowRequests],
             'tag': [IsPageNotBlocked, IsOwner, IsValidTag],
+            'leaderboard': [AllowedMethod],
 }
 
 serializers = {
@@ -38,8 +39,7 @@ querysets = {
                                     .prefetch_related('followers', 'follow_requests', 'tags').all(),
             'followers': Page.objects.select_related('owner')
                                      .prefetch_related('followers').all(),
-            'posts': Page.objects.select_related('owner')
-                                 .prefetch_related('posts').all(),
+            'posts': Page.objects.select_related('owner').all(),
             'follow_requests': Page.objects.select_related('owner')
                                            .prefetch_related('follow_requests').all(),
             'accept_all_requests': Page.objects.select_related('owner')
@@ -0,0 +1,21 @@
+# Generated by Django 4.0.6 on 2026-10-18 13:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['page', 'created_at', 'id'], name='posts_page_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['reply_to', 'created_at', 'id'], name='posts_reply_created_idx'),
+        ),
+    ]
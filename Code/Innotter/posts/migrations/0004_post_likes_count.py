@@ -0,0 +1,36 @@
+# Generated by Django 4.0.6 on 2026-10-18 14:05
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 10000
+
+
+def count_likes(apps, schema_editor):
+    """
+    Fill likes_count of existing posts from the likes table, one range of IDs per statement
+    """
+    Post = apps.get_model('posts', 'Post')
+    likes = Post.likes.through.objects.filter(post_id=OuterRef('pk')).values('post_id')\
+                                      .annotate(total=Count('*')).values('total')
+    last_pk = Post.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    for start in range(0, last_pk, BATCH_SIZE):
+        Post.objects.filter(pk__gt=start, pk__lte=start + BATCH_SIZE)\
+                    .update(likes_count=Coalesce(Subquery(likes, output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0003_post_posts_page_created_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_likes, migrations.RunPython.noop),
+    ]
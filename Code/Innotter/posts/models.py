@@ -1,8 +1,11 @@
 from django.db import models
+from django.db.models import Count, F
 from django.db.models.signals import post_save, pre_delete, m2m_changed
 from django.dispatch import receiver
 from django.utils.timezone import localtime
 from Innotter.producer import Statistics
+from pages.models import Page
+from posts.timelines import Timelines
 
 
 class Post(models.Model):
@@ -12,6 +15,15 @@ class Post(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     likes = models.ManyToManyField('users.User', related_name='liked', blank=True)
+    # number of rows of likes, kept by like_handler in the transaction that changes them
+    likes_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # posts of a page and replies to a post, newest first, paginated by (created_at, id)
+            models.Index(fields=['page', 'created_at', 'id'], name='posts_page_created_idx'),
+            models.Index(fields=['reply_to', 'created_at', 'id'], name='posts_reply_created_idx'),
+        ]
 
     def __str__(self):
         return f'Post by {self.page.name} at {localtime(self.created_at).date()} at {localtime(self.created_at).time()}'
@@ -21,19 +33,72 @@ class Post(models.Model):
 def new_post_handler(sender, instance, created, **kwargs):
     if created:
         Statistics().publish(page_pk=int(instance.page.pk), field='post', action='plus')
+        Timelines().post_created(instance)
 
 
 @receiver(pre_delete, sender=Post)
 def delete_post(sender, instance, using, **kwargs):
-    for user in instance.likes.all():
-        Statistics().publish(page_pk=int(instance.page.pk), field='like', action='minus')
-    Statistics().publish(page_pk=int(instance.page.pk), field='post', action='minus')
+    Statistics().publish_deltas(page_pk=int(instance.page_id), deltas={'like': -instance.likes_count, 'post': -1})
 
 
 @receiver(m2m_changed, sender=Post.likes.through)
-def like_handler(sender, instance, action, **kwargs):
+def like_handler(sender, instance, action, reverse, pk_set, **kwargs):
     match action:
-        case 'post_add':
-            Statistics().publish(page_pk=int(instance.page.pk), field='like', action='plus')
-        case 'post_remove':
-            Statistics().publish(page_pk=int(instance.page.pk), field='like', action='minus')
+        case 'post_add' if pk_set:
+            # pk_set holds only the rows that were missing and are inserted
+            if reverse:
+                Post.objects.filter(pk__in=pk_set).update(likes_count=F('likes_count') + 1)
+                publish_likes(Post.objects.filter(pk__in=pk_set), 1)
+            else:
+                Post.objects.filter(pk=instance.pk).update(likes_count=F('likes_count') + len(pk_set))
+                Statistics().publish_deltas(page_pk=int(instance.page_id), deltas={'like': len(pk_set)})
+        case 'pre_remove' if pk_set:
+            # pk_set holds every given ID, only the rows that exist are deleted
+            if reverse:
+                publish_likes(Post.objects.filter(pk__in=pk_set, likes=instance), -1)
+                Post.objects.filter(pk__in=pk_set, likes=instance).update(likes_count=F('likes_count') - 1)
+            else:
+                removed = Post.likes.through.objects.filter(post_id=instance.pk, user_id__in=pk_set).count()
+                if removed:
+                    Post.objects.filter(pk=instance.pk).update(likes_count=F('likes_count') - removed)
+                    Statistics().publish_deltas(page_pk=int(instance.page_id), deltas={'like': -removed})
+        case 'pre_clear' if reverse:
+            publish_likes(Post.objects.filter(likes=instance), -1)
+            Post.objects.filter(likes=instance).update(likes_count=F('likes_count') - 1)
+        case 'pre_clear':
+            removed = Post.likes.through.objects.filter(post_id=instance.pk).count()
+            if removed:
+                Statistics().publish_deltas(page_pk=int(instance.page_id), deltas={'like': -removed})
+        case 'post_clear' if not reverse:
+            Post.objects.filter(pk=instance.pk).update(likes_count=0)
+
+
+@receiver(pre_delete, sender='users.User')
+def delete_liker_handler(sender, instance, using, **kwargs):
+    # likes of a deleted user are removed by cascade, that sends no m2m_changed,
+    # posts of the user's own pages are deleted with them and send their own counts
+    liked = Post.objects.filter(likes=instance).exclude(page__owner=instance)
+    publish_likes(liked, -1)
+    liked.update(likes_count=F('likes_count') - 1)
+
+
+def publish_likes(posts, sign: int) -> None:
+    """
+    Send changes of likes of posts by one like each, with one change per page
+    @param posts: Posts whose likes change
+    @param sign: 1 for added likes, -1 for removed ones
+    """
+    for page_pk, total in posts.order_by().values('page_id').annotate(total=Count('*')).values_list('page_id', 'total'):
+        Statistics().publish_deltas(page_pk=int(page_pk), deltas={'like': sign * total})
+
+
+@receiver(m2m_changed, sender=Page.followers.through)
+def timeline_followers_handler(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove') or not pk_set:
+        return
+    changed = Timelines().followed if action == 'post_add' else Timelines().unfollowed
+    if reverse:
+        for page in Page.objects.filter(pk__in=pk_set):
+            changed(page, [instance.pk])
+    else:
+        changed(instance, pk_set)
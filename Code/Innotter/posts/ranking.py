@@ -0,0 +1,27 @@
+import numpy as np
+
+
+def decay_scores(created_at: np.ndarray, likes: np.ndarray, followers: np.ndarray, now: float,
+                 half_life: float, like_weight: float, follower_weight: float) -> np.ndarray:
+    """
+    Score posts by engagement that loses half of its weight every half_life seconds:
+    (1 + like_weight * likes + follower_weight * log(1 + followers)) * 2 ** (-age / half_life)
+    @param created_at: Times of creation of posts as timestamps
+    @param likes: Numbers of likes of posts
+    @param followers: Numbers of followers of pages of posts
+    @param now: Timestamp the age of posts is counted to
+    @return: Scores of posts, in the order of the arrays
+    """
+    age = np.maximum(now - created_at, 0.0)
+    engagement = 1.0 + like_weight * likes + follower_weight * np.log1p(followers)
+    return engagement * np.exp2(-age / half_life)
+
+
+def top(scores: np.ndarray, limit: int) -> np.ndarray:
+    """
+    Indices of the limit highest scores, highest first, without sorting all of them
+    """
+    if limit >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    best = np.argpartition(-scores, limit - 1)[:limit]
+    return best[np.argsort(-scores[best], kind='stable')]
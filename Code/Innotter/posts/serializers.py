@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db.models.functions.datetime import datetime
 from rest_framework import serializers
 
@@ -41,11 +42,18 @@ class PostSerializer(serializers.ModelSerializer):
 
 
 class PostRetrieveSerializer(PostSerializer):
-    likes_count = serializers.SerializerMethodField()
-
-    def get_likes_count(self, obj):
-        return obj.likes.count()
-
     class Meta:
         model = Post
         fields = ('id', 'content', 'reply_to', 'created_at', 'updated_at', 'page', 'likes_count')
+        read_only_fields = ('likes_count',)
+
+
+class ThreadSerializer(serializers.Serializer):
+    depth = serializers.IntegerField(min_value=1, max_value=settings.THREAD_MAX_DEPTH,
+                                     default=settings.THREAD_MAX_DEPTH)
+    size = serializers.IntegerField(min_value=1, max_value=settings.THREAD_MAX_SIZE,
+                                    default=settings.THREAD_MAX_SIZE)
+
+
+class NewsSerializer(serializers.Serializer):
+    ranking = serializers.ChoiceField(choices=('recent', 'top'), default='recent')
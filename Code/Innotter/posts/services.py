@@ -0,0 +1,157 @@
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from kink import inject
+
+from Innotter.pagination import older_than
+from pages.models import Page
+from posts.models import Post
+from posts.ranking import decay_scores, top
+from posts.timelines import TimelineStore, score
+
+
+def build_timeline(user, timeline_store: TimelineStore, large_page_pks: list) -> None:
+    """
+    Fill timeline of user from database with the newest posts of the followed pages, that are written into it
+    @param user: Owner of timeline
+    @param timeline_store: Store of timelines
+    @param large_page_pks: IDs of followed pages that are read with the timeline instead
+    """
+    posts = Post.objects.filter(page__followers=user).exclude(page_id__in=large_page_pks)\
+                        .order_by('-created_at', '-pk').values_list('pk', 'created_at')
+    timeline_store.fill(user.pk, [(post_pk, score(created_at))
+                                  for post_pk, created_at in posts[:timeline_store.max_size]])
+
+
+@inject
+def news_feed(user, queryset, limit: int, timeline_store: TimelineStore, before: tuple = None) -> tuple[list, tuple]:
+    """
+    Newest posts of pages followed by user and of the user's own pages. Posts of followed pages come from
+    the timeline, posts of own pages and of pages with too many followers to be written into timelines
+    are read from database, as well as followed posts older than the timeline keeps.
+    Posts deleted or hidden by queryset since they were written are left out
+    @param user: Reader of news
+    @param queryset: Posts that can be shown
+    @param limit: Number of posts
+    @param timeline_store: Store of timelines
+    @param before: Only posts older than (created_at, post ID)
+    @return: Posts, newest first, and key (created_at, post ID) the next page starts after, None if it is the last
+    """
+    large_page_pks = list(Page.objects.filter(followers=user, followers_count__gt=settings.TIMELINE_FANOUT_LIMIT)
+                                      .values_list('pk', flat=True))
+    if not timeline_store.exists(user.pk):
+        build_timeline(user, timeline_store, large_page_pks)
+    entries = [(score(created_at), post_pk) for post_pk, created_at in _recent(
+        Post.objects.filter(Q(page__owner=user) | Q(page_id__in=large_page_pks)), limit + 1, before)]
+    timeline = timeline_store.range(user.pk, limit + 1, None if before is None else (score(before[0]), before[1]))
+    entries += [(entry_score, post_pk) for post_pk, entry_score in timeline]
+    if len(timeline) <= limit:
+        # the timeline ended, it may have been trimmed
+        followed = Post.objects.filter(page__followers=user).exclude(page_id__in=large_page_pks)
+        oldest = before if not timeline else (datetime.fromtimestamp(timeline[-1][1], tz=timezone.utc),
+                                               timeline[-1][0])
+        entries += [(score(created_at), post_pk)
+                    for post_pk, created_at in _recent(followed, limit + 1 - len(timeline), oldest)]
+
+    entries = sorted(set(entries), reverse=True)[:limit + 1]
+    next_before = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_before = (datetime.fromtimestamp(entries[-1][0], tz=timezone.utc), entries[-1][1])
+    post_pks = [post_pk for _, post_pk in entries]
+    posts = queryset.in_bulk(post_pks)
+    return [posts[post_pk] for post_pk in post_pks if post_pk in posts], next_before
+
+
+def _recent(posts, limit: int, before: tuple = None):
+    if before is not None:
+        posts = older_than(posts, before)
+    return posts.order_by('-created_at', '-pk').values_list('pk', 'created_at')[:limit]
+
+
+def top_news(user, queryset, limit: int) -> list:
+    """
+    Best recent posts of pages followed by user and of the user's own pages. Up to RANKING_CANDIDATES newest
+    posts of the last RANKING_WINDOW_DAYS are read as columns and scored together by time decay of likes
+    and followers of their pages, see decay_scores
+    @param user: Reader of news
+    @param queryset: Posts that can be shown
+    @param limit: Number of posts
+    @return: Posts, best first
+    """
+    now = datetime.now(tz=timezone.utc)
+    since = now - timedelta(days=settings.RANKING_WINDOW_DAYS)
+    page_pks = Page.objects.filter(Q(followers=user) | Q(owner=user)).values('pk')
+    candidates = queryset.prefetch_related(None)\
+                         .filter(page_id__in=page_pks, created_at__gte=since)\
+                         .order_by('-created_at', '-pk').values_list('pk', 'created_at', 'likes_count', 'page_id')
+    candidates = list(candidates[:settings.RANKING_CANDIDATES])
+    if not candidates:
+        return []
+    post_pks, created_at, likes_count, post_page_pks = zip(*candidates)
+    followers = dict(Page.objects.filter(pk__in=set(post_page_pks)).values_list('pk', 'followers_count'))
+    scores = decay_scores(np.fromiter((value.timestamp() for value in created_at), float, len(candidates)),
+                          np.array(likes_count, dtype=float),
+                          np.fromiter((followers[page_pk] for page_pk in post_page_pks), float, len(candidates)),
+                          now.timestamp(), settings.RANKING_HALF_LIFE_HOURS * 3600,
+                          settings.RANKING_LIKE_WEIGHT, settings.RANKING_FOLLOWER_WEIGHT)
+    best = [post_pks[index] for index in top(scores, limit)]
+    posts = queryset.in_bulk(best)
+    return [posts[post_pk] for post_pk in best]
+
+
+THREAD_SQL = """
+WITH RECURSIVE thread (id, depth) AS (
+    SELECT id, 1 FROM {table} WHERE reply_to_id IN ({roots}) AND id IN ({visible})
+    UNION ALL
+    SELECT post.id, thread.depth + 1 FROM {table} AS post JOIN thread ON post.reply_to_id = thread.id
+    WHERE thread.depth < %s AND post.id IN ({visible})
+)
+SELECT id FROM thread LIMIT %s
+"""
+
+
+def thread_replies(queryset, root_pks: list, depth: int, size: int) -> tuple[list, bool]:
+    """
+    Replies to posts and replies to them, down to depth levels, found with one recursive query. The query
+    is not ordered, so the database walks the thread level by level and stops as soon as the limit is reached:
+    the work is bounded by size however large the thread is, and the deepest replies are the ones cut by size.
+    Replies that are not shown are skipped together with their own replies
+    @param queryset: Posts that can be shown
+    @param root_pks: IDs of posts whose replies are fetched
+    @param depth: Number of levels of replies
+    @param size: Maximal number of replies
+    @return: Replies in order of creation, and whether some of them were cut by size
+    """
+    if not root_pks or depth < 1 or size < 1:
+        return [], False
+    visible, visible_params = queryset.order_by().values('pk').query.sql_with_params()
+    sql = THREAD_SQL.format(table=connection.ops.quote_name(Post._meta.db_table),
+                            roots=', '.join(['%s'] * len(root_pks)), visible=visible)
+    with connection.cursor() as cursor:
+        # one more than allowed tells whether the thread was cut
+        cursor.execute(sql, (*root_pks, *visible_params, depth, *visible_params, size + 1))
+        reply_pks = [reply_pk for reply_pk, in cursor.fetchall()]
+    if not reply_pks:
+        return [], False
+    replies = queryset.filter(pk__in=reply_pks[:size]).order_by('created_at', 'pk')
+    return list(replies), len(reply_pks) > size
+
+
+def nest(roots: list, replies: list, data: dict) -> list:
+    """
+    Assemble a tree of posts in one pass. Replies to a post that is not shown are left out with their own replies
+    @param roots: Posts on top of tree
+    @param replies: Replies under them, in any order
+    @param data: Serialized posts by ID
+    @return: Serialized roots, with serialized replies under 'replies' of every post
+    """
+    children = defaultdict(list)
+    for post in replies:
+        children[post.reply_to_id].append(dict(data[post.pk], replies=children[post.pk]))
+    return [dict(data[post.pk], replies=children[post.pk]) for post in roots]
+
@@ -0,0 +1,44 @@
+from unittest.mock import patch
+
+from django.urls import reverse
+from rest_framework.test import APITestCase, APIClient
+
+from Innotter.pagination import encode_cursor
+from Innotter.producer import ChannelPool
+from pages.models import Page
+from posts.models import Post
+from users.models import User
+
+
+@patch.object(ChannelPool, 'publish')
+class KeysetPaginationTestCase(APITestCase):
+    fixtures = ['views.yaml']
+
+    def setUp(self):
+        self.user1 = User.objects.get(pk=1)
+        self.page1 = Page.objects.get(pk=1)
+        self.post = Post.objects.create(content='post', page=self.page1)
+        self.replies = [Post.objects.create(content='reply', page=self.page1, reply_to=self.post) for _ in range(5)]
+        # replies created at the same moment are ordered by ID
+        Post.objects.filter(pk__in=[reply.pk for reply in self.replies[1:4]]).update(
+            created_at=self.replies[1].created_at)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+
+    def test_pages_follow_each_other_without_gaps(self, mocked_publish):
+        url, pks = reverse('posts-replies', args=[self.post.pk]), []
+        while url:
+            response = self.client.get(url, {'limit': 2} if not pks else None)
+            self.assertLessEqual(len(response.data['results']), 2)
+            pks += [reply['id'] for reply in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(pks, [reply.pk for reply in reversed(self.replies)])
+
+    def test_cursor_is_opaque_and_checked(self, mocked_publish):
+        self.replies[3].refresh_from_db()
+        cursor = encode_cursor(self.replies[3].created_at, self.replies[3].pk)
+        response = self.client.get(reverse('posts-replies', args=[self.post.pk]), {'cursor': cursor})
+        self.assertEqual([reply['id'] for reply in response.data['results']], [self.replies[2].pk, self.replies[1].pk,
+                                                                               self.replies[0].pk])
+        response = self.client.get(reverse('posts-replies', args=[self.post.pk]), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
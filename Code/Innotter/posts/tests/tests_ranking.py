@@ -0,0 +1,64 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+import numpy as np
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase, APIClient
+
+from Innotter.producer import ChannelPool
+from pages.models import Page
+from posts.models import Post
+from posts.ranking import decay_scores, top
+from users.models import User
+
+
+class DecayScoresTestCase(APITestCase):
+    def test_scores_halve_every_half_life(self):
+        scores = decay_scores(np.array([100.0, 90.0, 80.0]), np.array([0.0, 0.0, 3.0]), np.zeros(3), now=100.0,
+                              half_life=10.0, like_weight=1.0, follower_weight=0.0)
+        np.testing.assert_allclose(scores, [1.0, 0.5, 1.0])
+
+    def test_top_orders_highest_first(self):
+        scores = np.array([0.3, 0.9, 0.1, 0.7, 0.5])
+        self.assertEqual(top(scores, 2).tolist(), [1, 3])
+        self.assertEqual(top(scores, 10).tolist(), [1, 3, 4, 0, 2])
+
+
+@patch.object(ChannelPool, 'publish')
+class TopNewsTestCase(APITestCase):
+    fixtures = ['views.yaml']
+
+    def setUp(self):
+        self.user1 = User.objects.get(pk=1)
+        self.user2 = User.objects.get(pk=2)
+        self.page1 = Page.objects.get(pk=1)
+        self.page2 = Page.objects.get(pk=2)
+        self.page2.followers.add(self.user1)
+        self.new_post = Post.objects.create(content='new', page=self.page1)
+        self.liked_post = Post.objects.create(content='liked', page=self.page2)
+        self.liked_post.likes.add(self.user1, self.user2)
+        self.old_post = Post.objects.create(content='old', page=self.page2)
+        self.old_post.likes.add(self.user1, self.user2)
+        Post.objects.filter(pk=self.liked_post.pk).update(created_at=self.new_post.created_at - timedelta(hours=1))
+        Post.objects.filter(pk=self.old_post.pk).update(created_at=self.new_post.created_at - timedelta(days=30))
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+
+    def top_news(self, **params):
+        response = self.client.get(reverse('posts-news'), {'ranking': 'top', **params})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['next'])
+        return [post['id'] for post in response.data['results']]
+
+    def test_liked_posts_rank_above_newer_ones(self, mocked_publish):
+        self.assertEqual(self.top_news(), [self.liked_post.pk, self.new_post.pk])
+        self.assertEqual(self.top_news(limit=1), [self.liked_post.pk])
+
+    @override_settings(RANKING_HALF_LIFE_HOURS=0.1)
+    def test_short_half_life_prefers_recent_posts(self, mocked_publish):
+        self.assertEqual(self.top_news(), [self.new_post.pk, self.liked_post.pk])
+
+    def test_unknown_ranking_is_rejected(self, mocked_publish):
+        response = self.client.get(reverse('posts-news'), {'ranking': 'random'})
+        self.assertEqual(response.status_code, 400)
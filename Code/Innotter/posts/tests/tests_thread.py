@@ -0,0 +1,75 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase, APIClient
+
+from Innotter.producer import ChannelPool
+from pages.models import Page
+from posts.models import Post
+from posts.services import thread_replies
+from users.models import User
+
+
+@patch.object(ChannelPool, 'publish')
+class ThreadTestCase(APITestCase):
+    fixtures = ['views.yaml']
+
+    def setUp(self):
+        self.user1 = User.objects.get(pk=1)
+        self.page1 = Page.objects.get(pk=1)
+        self.page2 = Page.objects.get(pk=2)
+        self.post = Post.objects.create(content='post', page=self.page1)
+        self.first = Post.objects.create(content='first', page=self.page1, reply_to=self.post)
+        self.second = Post.objects.create(content='second', page=self.page2, reply_to=self.post)
+        self.first_1 = Post.objects.create(content='first.1', page=self.page2, reply_to=self.first)
+        self.first_1_1 = Post.objects.create(content='first.1.1', page=self.page1, reply_to=self.first_1)
+        self.first_2 = Post.objects.create(content='first.2', page=self.page1, reply_to=self.first)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+
+    def tree(self, posts):
+        return [(post['id'], self.tree(post['replies'])) for post in posts]
+
+    def test_thread_is_nested(self, mocked_publish):
+        response = self.client.get(reverse('posts-thread', args=[self.post.pk]))
+        self.assertEqual(self.tree(response.data['results']), [
+            (self.second.pk, []),
+            (self.first.pk, [(self.first_1.pk, [(self.first_1_1.pk, [])]), (self.first_2.pk, [])]),
+        ])
+        self.assertFalse(response.data['truncated'])
+
+    def test_replies_are_fetched_with_one_recursive_query(self, mocked_publish):
+        with self.assertNumQueries(2):
+            replies, truncated = thread_replies(Post.objects.all(), [self.first.pk, self.second.pk], 10, 10)
+        self.assertEqual((replies, truncated), ([self.first_1, self.first_1_1, self.first_2], False))
+        with self.assertNumQueries(2):
+            replies, truncated = thread_replies(Post.objects.all(), [self.first.pk, self.second.pk], 10, 2)
+        self.assertEqual((replies, truncated), ([self.first_1, self.first_2], True))
+        with self.assertNumQueries(2):
+            replies, truncated = thread_replies(Post.objects.all(), [self.first.pk, self.second.pk], 10, 1)
+        self.assertEqual((len(replies), truncated), (1, True))
+        with self.assertNumQueries(1):
+            replies, truncated = thread_replies(Post.objects.all(), [self.first_2.pk], 10, 10)
+        self.assertEqual((replies, truncated), ([], False))
+
+    def test_depth_size_and_pages(self, mocked_publish):
+        response = self.client.get(reverse('posts-thread', args=[self.post.pk]), {'depth': 2})
+        self.assertEqual(self.tree(response.data['results'])[1],
+                         (self.first.pk, [(self.first_1.pk, []), (self.first_2.pk, [])]))
+        response = self.client.get(reverse('posts-thread', args=[self.post.pk]), {'size': 4})
+        self.assertEqual(self.tree(response.data['results'])[1],
+                         (self.first.pk, [(self.first_1.pk, []), (self.first_2.pk, [])]))
+        self.assertTrue(response.data['truncated'])
+        response = self.client.get(reverse('posts-thread', args=[self.post.pk]), {'limit': 1})
+        self.assertEqual(self.tree(response.data['results']), [(self.second.pk, [])])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([post['id'] for post in response.data['results']], [self.first.pk])
+        self.assertIsNone(response.data['next'])
+
+    def test_replies_of_blocked_pages_are_left_out(self, mocked_publish):
+        self.page2.unblock_date = timezone.now() + timedelta(days=1)
+        self.page2.save()
+        response = self.client.get(reverse('posts-thread', args=[self.post.pk]))
+        self.assertEqual(self.tree(response.data['results']), [(self.first.pk, [(self.first_2.pk, [])])])
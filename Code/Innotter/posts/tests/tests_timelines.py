@@ -0,0 +1,104 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from kink import di
+from rest_framework.test import APITestCase, APIClient
+
+from Innotter.producer import ChannelPool
+from pages.models import Page
+from posts.models import Post
+from posts.timelines import MemoryTimelineStore
+from users.models import User
+
+
+class MemoryTimelineStoreTestCase(APITestCase):
+    def setUp(self):
+        self.store = MemoryTimelineStore(max_size=3)
+
+    def test_push_keeps_newest_posts_of_existing_timelines(self):
+        self.store.fill(1, [(1, 10.0), (2, 20.0)])
+        self.store.push([1, 2], [(3, 30.0), (4, 5.0), (5, 40.0)])
+        self.assertEqual(self.store.range(1, 10), [(5, 40.0), (3, 30.0), (2, 20.0)])
+        self.assertFalse(self.store.exists(2))
+
+    def test_least_recently_read_timelines_are_dropped(self):
+        store = MemoryTimelineStore(max_users=2)
+        store.fill(1, [(1, 10.0)])
+        store.fill(2, [(1, 10.0)])
+        store.range(1, 10)
+        store.fill(3, [(1, 10.0)])
+        self.assertEqual([store.exists(user_pk) for user_pk in (1, 2, 3)], [True, False, True])
+
+    def test_range_before(self):
+        self.store.fill(1, [(1, 10.0), (2, 20.0), (3, 20.0)])
+        self.assertEqual(self.store.range(1, 2, before=(20.0, 3)), [(2, 20.0), (1, 10.0)])
+        self.store.remove([1], [2])
+        self.assertEqual(self.store.range(1, 2, before=(20.0, 3)), [(1, 10.0)])
+
+
+@patch.object(ChannelPool, 'publish')
+class NewsTimelineTestCase(APITestCase):
+    fixtures = ['views.yaml']
+
+    def setUp(self):
+        di['timeline_store'] = self.store = MemoryTimelineStore()
+        self.user1 = User.objects.get(pk=1)
+        self.user2 = User.objects.get(pk=2)
+        self.page1 = Page.objects.get(pk=1)
+        self.page2 = Page.objects.get(pk=2)
+        self.page2.followers.add(self.user1)
+        self.own_post = Post.objects.create(content='own', page=self.page1)
+        self.followed_post = Post.objects.create(content='followed', page=self.page2)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+
+    def news(self, **params):
+        response = self.client.get(reverse('posts-news'), params)
+        self.assertEqual(response.status_code, 200)
+        return [post['id'] for post in response.data['results']]
+
+    def test_news_are_built_from_database(self, mocked_publish):
+        self.assertEqual(self.news(), [self.followed_post.pk, self.own_post.pk])
+        self.assertEqual(self.store.range(self.user1.pk, 10)[0][0], self.followed_post.pk)
+        response = self.client.get(reverse('posts-news'), {'limit': 1})
+        self.assertEqual([post['id'] for post in response.data['results']], [self.followed_post.pk])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(([post['id'] for post in response.data['results']], response.data['next']),
+                         ([self.own_post.pk], None))
+
+    def test_news_older_than_timeline_are_read_from_database(self, mocked_publish):
+        di['timeline_store'] = self.store = MemoryTimelineStore(max_size=1)
+        older_post = Post.objects.create(content='older', page=self.page2)
+        Post.objects.filter(pk=older_post.pk).update(created_at=self.own_post.created_at - timedelta(days=1))
+        self.assertEqual(self.news(), [self.followed_post.pk, self.own_post.pk, older_post.pk])
+
+    def test_new_post_is_pushed_to_followers(self, mocked_publish):
+        self.news()
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(content='new', page=self.page2)
+        self.assertEqual(self.store.range(self.user1.pk, 1), [(post.pk, post.created_at.timestamp())])
+        self.assertEqual(self.news()[0], post.pk)
+
+    def test_unfollow_removes_posts(self, mocked_publish):
+        self.news()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.page2.followers.remove(self.user1)
+        self.assertEqual(self.news(), [self.own_post.pk])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_large_pages_are_read_with_timeline(self, mocked_publish):
+        self.page2.followers.add(self.user2)
+        self.news()
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(content='new', page=self.page2)
+        self.assertEqual(self.store.range(self.user1.pk, 10), [])
+        self.assertEqual(self.news(), [post.pk, self.followed_post.pk, self.own_post.pk])
+
+    def test_blocked_pages_are_hidden(self, mocked_publish):
+        self.news()
+        self.page2.unblock_date = timezone.now() + timedelta(days=1)
+        self.page2.save()
+        self.assertEqual(self.news(), [self.own_post.pk])
@@ -64,10 +64,36 @@ class PostViewSetTestCase(APITestCase):
 
     def test_like(self):
         self.client.patch(reverse('posts-like', args=[self.post1.pk]))
+        response = self.client.patch(reverse('posts-like', args=[self.post1.pk]))
         self.assertTrue(Post.objects.get(pk=self.post1.pk).likes.filter(pk=self.user1.pk).exists())
+        self.assertEqual(response.data['likes_count'], 1)
 
     def test_unlike(self):
         self.post1.likes.set([self.user1])
         self.assertTrue(Post.objects.get(pk=self.post1.pk).likes.filter(pk=self.user1.pk).exists())
         self.client.patch(reverse('posts-unlike', args=[self.post1.pk]))
+        response = self.client.patch(reverse('posts-unlike', args=[self.post1.pk]))
         self.assertFalse(Post.objects.get(pk=self.post1.pk).likes.filter(pk=self.user1.pk).exists())
+        self.assertEqual(response.data['likes_count'], 0)
+
+    def test_likes_count_follows_changes_from_both_sides(self):
+        self.post1.likes.add(self.user1, self.user2)
+        self.user1.liked.add(self.post2)
+        self.assertEqual(list(Post.objects.order_by('pk').values_list('likes_count', flat=True)), [2, 1])
+        self.user1.liked.clear()
+        self.assertEqual(list(Post.objects.order_by('pk').values_list('likes_count', flat=True)), [1, 0])
+        self.post1.likes.remove(self.user2)
+        self.post2.likes.set([self.user1, self.user2])
+        self.assertEqual(list(Post.objects.order_by('pk').values_list('likes_count', flat=True)), [0, 2])
+        self.post2.likes.clear()
+        self.assertEqual(Post.objects.get(pk=self.post2.pk).likes_count, 0)
+
+    def test_removing_missing_likes_keeps_count(self):
+        self.post1.likes.add(self.user1)
+        self.post1.likes.remove(self.user1, self.user2)
+        self.post1.likes.remove(self.user1)
+        self.user2.liked.remove(self.post1, self.post2)
+        self.assertEqual(Post.objects.get(pk=self.post1.pk).likes_count, 0)
+        self.post1.likes.add(self.user2)
+        self.post1.likes.remove(self.user1)
+        self.assertEqual(Post.objects.get(pk=self.post1.pk).likes_count, 1)
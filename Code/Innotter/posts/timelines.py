@@ -0,0 +1,205 @@
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from kink import inject
+
+
+def score(created_at) -> float:
+    return created_at.timestamp()
+
+
+class TimelineStore(ABC):
+    """
+    News timelines of users: IDs of posts from followed pages scored by time of creation, newest first.
+    A timeline keeps only its max_size newest posts. A timeline that does not exist has to be built
+    from database before it is read or changed, since it would miss older posts otherwise
+    """
+
+    def __init__(self, max_size: int = 800) -> None:
+        self.max_size = max_size
+
+    @abstractmethod
+    def exists(self, user_pk: int) -> bool:
+        ...
+
+    @abstractmethod
+    def fill(self, user_pk: int, entries: list) -> None:
+        """
+        Replace timeline of user
+        @param entries: Posts as pairs (post ID, score)
+        """
+
+    @abstractmethod
+    def push(self, user_pks: list, entries: list) -> None:
+        """
+        Add posts to the existing timelines of users, the rest are left to be built when read
+        @param entries: Posts as pairs (post ID, score)
+        """
+
+    @abstractmethod
+    def remove(self, user_pks: list, post_pks: list) -> None:
+        ...
+
+    @abstractmethod
+    def range(self, user_pk: int, limit: int, before: tuple = None) -> list:
+        """
+        Newest posts of timeline
+        @param limit: Number of posts
+        @param before: Only posts older than (score, post ID)
+        @return: Pairs (post ID, score), newest first
+        """
+
+
+class MemoryTimelineStore(TimelineStore):
+    """
+    Timelines in memory of process, for tests and a single process.
+    Only the max_users timelines read or filled last are kept, the rest are built again when read
+    """
+
+    def __init__(self, max_size: int = 800, max_users: int = 10000) -> None:
+        super().__init__(max_size)
+        self.max_users = max_users
+        self.timelines = OrderedDict()
+        self.lock = threading.Lock()
+
+    def exists(self, user_pk: int) -> bool:
+        return user_pk in self.timelines
+
+    def fill(self, user_pk: int, entries: list) -> None:
+        timeline = sorted((entry_score, post_pk) for post_pk, entry_score in entries)
+        with self.lock:
+            self.timelines[user_pk] = timeline[-self.max_size:]
+            self.timelines.move_to_end(user_pk)
+            while len(self.timelines) > self.max_users:
+                self.timelines.popitem(last=False)
+
+    def push(self, user_pks: list, entries: list) -> None:
+        with self.lock:
+            for user_pk in user_pks:
+                timeline = self.timelines.get(user_pk)
+                if timeline is None:
+                    continue
+                for post_pk, entry_score in entries:
+                    if (entry_score, post_pk) not in timeline:
+                        insort(timeline, (entry_score, post_pk))
+                del timeline[:-self.max_size]
+
+    def remove(self, user_pks: list, post_pks: list) -> None:
+        post_pks = set(post_pks)
+        with self.lock:
+            for user_pk in user_pks:
+                if user_pk in self.timelines:
+                    self.timelines[user_pk] = [entry for entry in self.timelines[user_pk] if entry[1] not in post_pks]
+
+    def range(self, user_pk: int, limit: int, before: tuple = None) -> list:
+        with self.lock:
+            timeline = self.timelines.get(user_pk, [])
+            if user_pk in self.timelines:
+                self.timelines.move_to_end(user_pk)
+            end = len(timeline) if before is None else bisect_left(timeline, before)
+            return [(post_pk, entry_score) for entry_score, post_pk in reversed(timeline[max(end - limit, 0):end])]
+
+
+class RedisTimelineStore(TimelineStore):
+    """
+    Timelines in sorted sets of Redis or a server compatible with it, shared by all processes.
+    Timelines that are not read for ttl seconds expire
+    """
+
+    def __init__(self, client, max_size: int = 800, ttl: int = 7 * 24 * 3600, prefix: str = 'timeline') -> None:
+        super().__init__(max_size)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, user_pk: int) -> str:
+        return f'{self.prefix}:{user_pk}'
+
+    def exists(self, user_pk: int) -> bool:
+        return bool(self.client.exists(self._key(user_pk)))
+
+    def fill(self, user_pk: int, entries: list) -> None:
+        key = self._key(user_pk)
+        pipe = self.client.pipeline()
+        pipe.delete(key)
+        if entries:
+            pipe.zadd(key, {post_pk: entry_score for post_pk, entry_score in entries})
+            pipe.zremrangebyrank(key, 0, -self.max_size - 1)
+            pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def push(self, user_pks: list, entries: list) -> None:
+        keys = [self._key(user_pk) for user_pk in user_pks]
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.exists(key)
+        existing = [key for key, exists in zip(keys, pipe.execute()) if exists]
+        if not existing or not entries:
+            return
+        mapping = {post_pk: entry_score for post_pk, entry_score in entries}
+        for key in existing:
+            pipe.zadd(key, mapping)
+            pipe.zremrangebyrank(key, 0, -self.max_size - 1)
+        pipe.execute()
+
+    def remove(self, user_pks: list, post_pks: list) -> None:
+        if not post_pks:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for user_pk in user_pks:
+            pipe.zrem(self._key(user_pk), *post_pks)
+        pipe.execute()
+
+    def range(self, user_pk: int, limit: int, before: tuple = None) -> list:
+        key = self._key(user_pk)
+        pipe = self.client.pipeline(transaction=False)
+        if before is None:
+            pipe.zrevrangebyscore(key, '+inf', '-inf', start=0, num=limit, withscores=True)
+        else:
+            # posts with the same score are not ordered by ID in Redis, so they are fetched apart
+            pipe.zrangebyscore(key, before[0], before[0], withscores=True)
+            pipe.zrevrangebyscore(key, f'({before[0]}', '-inf', start=0, num=limit, withscores=True)
+        pipe.expire(key, self.ttl)
+        *ranges, _ = pipe.execute()
+        entries = [(int(post_pk), entry_score) for found in ranges for post_pk, entry_score in found]
+        if before is not None:
+            entries = [entry for entry in entries if (entry[1], entry[0]) < before]
+        return sorted(entries, key=lambda entry: (entry[1], entry[0]), reverse=True)[:limit]
+
+
+@inject
+class Timelines:
+    """
+    Fan-out on write: a new post is pushed into the timelines of followers of its page, once the transaction
+    commits. Pages with more than TIMELINE_FANOUT_LIMIT followers are not pushed, they are read with the timeline
+    """
+
+    def __init__(self, timeline_store: TimelineStore) -> None:
+        self.timeline_store = timeline_store
+
+    def post_created(self, post) -> None:
+        # the same count news_feed reads, so a page is either pushed or read with the timeline
+        post.page.refresh_from_db(fields=['followers_count'])
+        if post.page.followers_count > settings.TIMELINE_FANOUT_LIMIT:
+            return
+        follower_pks = list(post.page.followers.values_list('pk', flat=True))
+        transaction.on_commit(partial(self.timeline_store.push, follower_pks, [(post.pk, score(post.created_at))]))
+
+    def followed(self, page, user_pks: list) -> None:
+        """
+        Add recent posts of page to the timelines of its new followers
+        """
+        transaction.on_commit(partial(self.timeline_store.push, list(user_pks), self._recent_posts(page)))
+
+    def unfollowed(self, page, user_pks: list) -> None:
+        post_pks = [post_pk for post_pk, _ in self._recent_posts(page)]
+        transaction.on_commit(partial(self.timeline_store.remove, list(user_pks), post_pks))
+
+    def _recent_posts(self, page) -> list:
+        posts = page.posts.order_by('-created_at', '-pk').values_list('pk', 'created_at')
+        return [(post_pk, score(created_at)) for post_pk, created_at in posts[:self.timeline_store.max_size]]
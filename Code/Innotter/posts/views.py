@@ -2,22 +2,25 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from django.db import transaction
 from django.db.models import Q
 from datetime import datetime
 from django.utils import timezone
 
 from posts.models import Post
-from posts.serializers import PostSerializer
+from posts.serializers import NewsSerializer, PostSerializer, ThreadSerializer
 from users.permissions import IsNotBlocked
 from posts.permissions import PostOwnerIsNotBlockedOrStaff, PostPageIsNotBlockedOrStaff,\
     PageIsNotPrivate, IsOwnerOrStaff, IsNotPostMethod
 from posts import viewset_data
+from posts.services import news_feed, nest, thread_replies, top_news
+from Innotter.pagination import KeysetPagination
 
 
 class PostViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated, IsNotBlocked, IsNotPostMethod, IsOwnerOrStaff | PageIsNotPrivate]
-    retrieve_view_fields = ('id', 'content', 'reply_to', 'created_at', 'updated_at', 'page__id', 'page__name',
-                            'page__is_private', 'page__unblock_date', 'page__owner__id',
+    retrieve_view_fields = ('id', 'content', 'reply_to', 'created_at', 'updated_at', 'likes_count', 'page__id',
+                            'page__name', 'page__is_private', 'page__unblock_date', 'page__owner__id',
                             'page__owner__is_blocked')
 
     def get_permissions(self):
@@ -33,7 +36,14 @@ class PostViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         querysets = viewset_data.querysets
         return querysets.get(self.action, Post.objects.select_related('page', 'page__owner', 'reply_to')
-                                                      .only(*self.retrieve_view_fields).prefetch_related('likes').all())
+                                                      .only(*self.retrieve_view_fields).all())
+
+    @staticmethod
+    def lock(post) -> None:
+        """
+        Lock row of post until the transaction ends, so likes of the post are checked and changed one at a time
+        """
+        list(Post.objects.select_for_update().filter(pk=post.pk).values_list('pk'))
 
     @action(detail=True, methods=['get'])
     def likes(self, request, pk=None):
@@ -44,33 +54,63 @@ class PostViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['patch'])
     def like(self, request, pk=None):
         post = self.get_object()
-        if request.user not in tuple(post.likes.all()):
-            post.likes.add(request.user)
+        with transaction.atomic():
+            self.lock(post)
+            if not post.likes.filter(pk=request.user.pk).exists():
+                post.likes.add(request.user)
+        post.refresh_from_db(fields=['likes_count'])
         serializer = self.get_serializer(instance=post)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['patch'])
     def unlike(self, request, pk=None):
         post = self.get_object()
-        if request.user in tuple(post.likes.all()):
-            post.likes.remove(request.user)
+        with transaction.atomic():
+            self.lock(post)
+            if post.likes.filter(pk=request.user.pk).exists():
+                post.likes.remove(request.user)
+        post.refresh_from_db(fields=['likes_count'])
         serializer = self.get_serializer(instance=post)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    def get_visible_queryset(self):
+        return self.get_queryset().filter(Q(page__unblock_date=None)
+                                          | Q(page__unblock_date__lt=datetime.now(tz=timezone.utc)))\
+                                  .filter(page__owner__is_blocked=False)
+
     @action(detail=False, methods=['get'])
     def news(self, request):
-        query = self.get_queryset().filter(Q(page__owner__id__in=request.user.follows.all())
-                                           | Q(page__owner__id=request.user.pk))\
-                                    .filter(Q(page__unblock_date=None)
-                                        | Q(page__unblock_date__lt=datetime.now(tz=timezone.utc)))\
-                                    .filter(page__owner__is_blocked=False)
-        serializer = self.get_serializer(instance=query, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        query = self.get_visible_queryset()
+        paginator = KeysetPagination()
+        before = paginator.start(request)
+        params = NewsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        if params.validated_data['ranking'] == 'top':
+            # scores decay with time, so the ranked feed is a single page
+            posts = top_news(request.user, query, paginator.page_size)
+        else:
+            posts, paginator.next = news_feed(request.user, query, paginator.page_size, before=before)
+        serializer = self.get_serializer(instance=posts, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['get'])
     def replies(self, request, pk=None):
-        query = self.get_queryset().filter(reply_to=pk).filter(Q(page__unblock_date=None)
-                                    | Q(page__unblock_date__lt=datetime.now(tz=timezone.utc)))\
-                                    .filter(page__owner__is_blocked=False)
-        serializer = self.get_serializer(instance=query, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        query = self.get_visible_queryset().filter(reply_to=pk)
+        paginator = KeysetPagination()
+        serializer = self.get_serializer(instance=paginator.paginate_queryset(query, request), many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def thread(self, request, pk=None):
+        params = ThreadSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        query = self.get_visible_queryset()
+        paginator = KeysetPagination()
+        roots = paginator.paginate_queryset(query.filter(reply_to=pk), request)
+        replies, truncated = thread_replies(query, [post.pk for post in roots], params.validated_data['depth'] - 1,
+                                            params.validated_data['size'] - len(roots))
+        posts = roots + replies
+        data = {post.pk: post_data for post, post_data in zip(posts, self.get_serializer(posts, many=True).data)}
+        response = paginator.get_paginated_response(nest(roots, replies, data))
+        response.data['truncated'] = truncated
+        return response
@@ -24,6 +24,7 @@ querysets = {
             'list': Post.objects.select_related('page', 'reply_to').only(*list_view_fields).all(),
             'likes': Post.objects.select_related('page', 'page__owner').prefetch_related('likes').all(),
             'news': Post.objects.select_related('page', 'page__owner', 'reply_to')
-                                .only(*list_view_fields).prefetch_related('likes').all(),
+                                .only(*list_view_fields).all(),
             'replies': Post.objects.select_related('page', 'reply_to', 'page__owner').only(*list_view_fields).all(),
+            'thread': Post.objects.select_related('page', 'reply_to', 'page__owner').only(*list_view_fields).all(),
         }
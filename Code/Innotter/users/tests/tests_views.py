@@ -123,8 +123,8 @@ class UserViewSetTestCase(APITestCase):
         self.post2 = Post.objects.create(content=self.fake.name(), page=self.page1)
         self.post2.likes.set([self.user1])
         response = self.client.get(reverse('users-liked', args=[self.user1.pk]))
-        expected_data = UserPostSerializer([self.post1, self.post2], many=True).data
-        self.assertEqual(response.data, expected_data)
+        expected_data = UserPostSerializer([self.post2, self.post1], many=True).data
+        self.assertEqual(response.data, {'next': None, 'results': expected_data})
 
     def test_new_page(self):
         page_name = self.fake.last_name_male() + str(randint(1, 500))
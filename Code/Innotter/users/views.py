@@ -10,6 +10,7 @@ from users.serializers import PagesSerializer
 from users.renderers import UserJSONRenderer
 from users import viewset_data
 from users.services import upload_image_to_s3
+from Innotter.pagination import KeysetPagination
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -86,8 +87,9 @@ class UserViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def liked(self, request, pk=None):
         user = self.get_object()
-        serializer = UserPostSerializer(instance=user.liked, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        paginator = KeysetPagination()
+        serializer = UserPostSerializer(instance=paginator.paginate_queryset(user.liked.all(), request), many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['post'])
     def new_page(self, request, pk=None):
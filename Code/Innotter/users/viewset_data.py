@@ -7,7 +7,7 @@ from users.serializers import UserPostSerializer, UserImageSerializer
 
 querysets = {
             'pages': User.objects.prefetch_related('pages').all(),
-            'liked': User.objects.prefetch_related('liked').all(),
+            'liked': User.objects.all(),
         }
 
 permissions = {
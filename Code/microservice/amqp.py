@@ -0,0 +1,28 @@
+import asyncio
+
+from pika.adapters.asyncio_connection import AsyncioConnection
+from pika.connection import ConnectionParameters
+
+
+async def connect(conn_params: ConnectionParameters) -> tuple[AsyncioConnection, asyncio.Future]:
+    """
+    Open a connection to broker on the running event loop
+    :return: Connection and a future, that is resolved with the reason once the connection is closed
+    """
+    loop = asyncio.get_running_loop()
+    opened, closed = loop.create_future(), loop.create_future()
+    AsyncioConnection(conn_params,
+                      on_open_callback=opened.set_result,
+                      on_open_error_callback=lambda connection, err: opened.set_exception(err),
+                      on_close_callback=lambda connection, err: closed.done() or closed.set_result(err),
+                      custom_ioloop=loop)
+    return await opened, closed
+
+
+def wait(method, callback: str = 'callback', **kwargs) -> asyncio.Future:
+    """
+    Call a callback-style pika method and return a future of the value passed to its callback
+    """
+    future = asyncio.get_running_loop().create_future()
+    method(**kwargs, **{callback: lambda result: future.done() or future.set_result(result)})
+    return future
@@ -0,0 +1,149 @@
+"""
+Throughput of the stats consumer in messages/sec: HTTP loopback through uvicorn (old path)
+against calling services in-process, with a stand-in channel and the in-memory store.
+Also counts writes, which the coalescing window reduces to one per page.
+
+Usage:
+    pipenv run python benchmarks/bench_consumer.py --messages 5000 --window 1000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dependencies  # noqa: E402
+from cache import StatsCache  # noqa: E402
+from stores import MemoryStatsStore  # noqa: E402
+import pubsub  # noqa: E402
+from leaderboard import Leaderboards  # noqa: E402
+from pubsub import StatsBroadcaster  # noqa: E402
+from kink import di  # noqa: E402
+
+
+class CountingStore(MemoryStatsStore):
+    """
+    In-memory store, that also counts writes of counters
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def apply_deltas(self, page_id, deltas):
+        self.writes += 1
+        return super().apply_deltas(page_id, deltas)
+
+
+class StandInChannel:
+    """
+    Stand-in for the broker channel, only counts acknowledgements
+    """
+
+    def __init__(self):
+        self.acked = 0
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acked = delivery_tag if multiple else self.acked + 1
+
+    def basic_publish(self, **kwargs):
+        pass
+
+
+class Method:
+    def __init__(self, delivery_tag):
+        self.delivery_tag = delivery_tag
+
+
+def messages(count: int) -> list[bytes]:
+    fields = ('post', 'like', 'follower')
+    return [json.dumps({'page': random.randint(1, 100), 'field': random.choice(fields),
+                        'action': random.choice(('plus', 'minus'))}).encode() for _ in range(count)]
+
+
+def http_loopback(ch, method, props, body) -> None:
+    """
+    Consumer callback as it was before: every message is a request to the API of this same service
+    """
+    match json.loads(body):
+        case {'field': field, 'action': action, 'page': page_pk}:
+            requests.put(f'http://127.0.0.1:8001/{field}/{page_pk}', params={'action': action})
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+
+
+def report(label: str, messages: int, elapsed: float, writes: int) -> None:
+    print(f'{label:<20} {messages} messages in {elapsed:.2f}s -> {messages / elapsed:.0f} messages/sec, '
+          f'{writes} store writes')
+
+
+def run(label: str, callback, bodies: list[bytes]) -> None:
+    store = di['stats_store']
+    writes = store.writes
+    channel = StandInChannel()
+    started = time.perf_counter()
+    for tag, body in enumerate(bodies, start=1):
+        callback(channel, Method(tag), None, body)
+    report(label, channel.acked, time.perf_counter() - started, store.writes - writes)
+
+
+async def run_consumer(label: str, bodies: list[bytes], **options) -> None:
+    from consumer import AsyncConsumer
+
+    store = di['stats_store']
+    writes = store.writes
+    channel = StandInChannel()
+    consumer = AsyncConsumer(None, **options)
+    consumer.start(channel)
+    started = time.perf_counter()
+    for tag, body in enumerate(bodies, start=1):
+        consumer.on_message(channel, Method(tag), None, body)
+    while channel.acked < len(bodies):
+        await asyncio.sleep(0.001)
+    report(label, channel.acked, time.perf_counter() - started, store.writes - writes)
+    consumer.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--window', type=int, default=1000, help='Messages per coalescing window')
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    # no DynamoDB or RabbitMQ: the store is in memory and the consumer process is not started
+    dependencies.microservice_di = lambda: None
+    di['stats_store'] = CountingStore()
+    di['stats_cache'] = StatsCache()
+    di['db_executor'] = ThreadPoolExecutor(max_workers=16)
+    di['stats_updates'] = StatsBroadcaster()
+    di['leaderboards'] = Leaderboards()
+    di['leaderboard_options'] = {'reload_interval': 60, 'save_interval': 60}
+    di['api_options'] = {'embedded_consumer': False, 'ready_timeout': 10}
+    pubsub.relay_updates = lambda *args: asyncio.sleep(0)
+
+    import uvicorn
+    import main as api
+
+    server = uvicorn.Server(uvicorn.Config(api.app, host='127.0.0.1', port=8001, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    bodies = messages(args.messages)
+    run('http loopback', http_loopback, bodies)
+    asyncio.run(run_consumer('in-process dispatch', bodies, workers=1, max_messages=1))
+    asyncio.run(run_consumer('coalesced window', bodies, workers=args.workers,
+                             max_messages=args.window, max_delay=0.1))
+    server.should_exit = True
+
+
+if __name__ == '__main__':
+    main()
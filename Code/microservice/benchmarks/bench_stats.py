@@ -0,0 +1,104 @@
+"""
+Throughput of GET /stats/{id} under concurrent requests, with DynamoDB calls made on the event loop
+(as before) against calls made on the pool of DB threads. The store is in memory with a fixed latency
+per read and the cache is disabled, so every request is a round trip to the store.
+
+Usage:
+    pipenv run python benchmarks/bench_stats.py --requests 500 --concurrency 32 --latency-ms 10
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dependencies  # noqa: E402
+from cache import StatsCache  # noqa: E402
+from stores import MemoryStatsStore  # noqa: E402
+import pubsub  # noqa: E402
+from leaderboard import Leaderboards  # noqa: E402
+from pubsub import StatsBroadcaster  # noqa: E402
+from kink import di  # noqa: E402
+
+
+class SlowStore(MemoryStatsStore):
+    """
+    In-memory store, that answers every read after a fixed latency
+    """
+
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+
+    def get(self, page_id):
+        time.sleep(self.latency)
+        return super().get(page_id)
+
+
+class InlineExecutor(Executor):
+    """
+    Executor that runs calls right away in the calling thread, which is how the event loop was blocked before
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+
+def run(label: str, count: int, concurrency: int) -> None:
+    local = threading.local()
+
+    def get(page_id):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        local.session.get(f'http://127.0.0.1:8002/stats/{page_id}').raise_for_status()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        started = time.perf_counter()
+        list(clients.map(get, range(count)))
+        elapsed = time.perf_counter() - started
+    print(f'{label:<20} {count} requests in {elapsed:.2f}s -> {count / elapsed:.0f} requests/sec')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--latency-ms', type=float, default=10)
+    parser.add_argument('--threads', type=int, default=16, help='Size of the pool of DB threads')
+    args = parser.parse_args()
+
+    # no DynamoDB or RabbitMQ: the store is in memory and the consumer process is not started
+    dependencies.microservice_di = lambda: None
+    di['stats_store'] = SlowStore(args.latency_ms / 1000)
+    di['stats_cache'] = StatsCache(ttl=0)
+    di['stats_updates'] = StatsBroadcaster()
+    di['leaderboards'] = Leaderboards()
+    di['leaderboard_options'] = {'reload_interval': 60, 'save_interval': 60}
+    di['api_options'] = {'embedded_consumer': False, 'ready_timeout': 10}
+    di['db_executor'] = InlineExecutor()
+    pubsub.relay_updates = lambda *args: asyncio.sleep(0)
+
+    import uvicorn
+    import main as api
+
+    server = uvicorn.Server(uvicorn.Config(api.app, host='127.0.0.1', port=8002, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    run('blocking event loop', args.requests, args.concurrency)
+    di['db_executor'] = ThreadPoolExecutor(max_workers=args.threads)
+    run(f'{args.threads} DB threads', args.requests, args.concurrency)
+    server.should_exit = True
+
+
+if __name__ == '__main__':
+    main()
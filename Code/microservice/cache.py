@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class StatsCache:
+    """
+    LRU cache of page statistic with time to live. Counters of hits, misses, evictions
+    and expirations are kept for tuning of size and ttl.
+    Statistic read from the store is cached with fill, that skips pages set or invalidated by a change
+    since the read began, so a slow read never overwrites fresher statistic. Times of changes are kept for ttl
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 30) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.changed = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, page_id: int) -> dict | None:
+        """
+        Cached statistic of page, None if it is not cached or expired
+        """
+        with self.lock:
+            cached = self.items.get(page_id)
+            if cached is None:
+                self.misses += 1
+                return None
+            expires_at, stats = cached
+            if expires_at <= time.monotonic():
+                del self.items[page_id]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.items.move_to_end(page_id)
+            self.hits += 1
+            return stats
+
+    def set(self, page_id: int, stats: dict) -> None:
+        """
+        Cache statistic of page after a change
+        """
+        with self.lock:
+            self._changed(page_id)
+            self._store(page_id, stats)
+
+    def fill(self, page_id: int, stats: dict, read_at: float) -> None:
+        """
+        Cache statistic of page read from the store, unless the page was changed since the read began
+        :param read_at: Value of time.monotonic() before the read
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._forget_changes(now)
+            if now - read_at >= self.ttl or self.changed.get(page_id, float('-inf')) >= read_at:
+                return
+            self._store(page_id, stats)
+
+    def invalidate(self, page_id: int) -> None:
+        with self.lock:
+            self._changed(page_id)
+            self.items.pop(page_id, None)
+
+    def _store(self, page_id: int, stats: dict) -> None:
+        self.items[page_id] = (time.monotonic() + self.ttl, stats)
+        self.items.move_to_end(page_id)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+            self.evictions += 1
+
+    def _changed(self, page_id: int) -> None:
+        now = time.monotonic()
+        self.changed[page_id] = now
+        self.changed.move_to_end(page_id)
+        self._forget_changes(now)
+
+    def _forget_changes(self, now: float) -> None:
+        # reads that began before the oldest kept change are too old to be filled anyway
+        while self.changed and next(iter(self.changed.values())) <= now - self.ttl:
+            self.changed.popitem(last=False)
+
+    def info(self) -> dict:
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'size': len(self.items),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_ratio': self.hits / requests if requests else None,
+            }
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from itertools import chain
+
+import services
+
+CHANGES = {
+    ('post', 'plus'): ('post', 1),
+    ('post', 'minus'): ('post', -1),
+    ('like', 'plus'): ('like', 1),
+    ('like', 'minus'): ('like', -1),
+    ('follower', 'plus'): ('follower', 1),
+    ('follower', 'minus'): ('follower', -1),
+}
+
+
+def pages_of(message: dict) -> set:
+    """
+    Ids of pages changed by a change message
+    """
+    match message:
+        case {'field': 'batch', 'action': 'apply', 'new': new_pages, 'deltas': deltas}:
+            return {int(page_pk) for page_pk in chain(new_pages, deltas, message.get('deleted', []))}
+        case {'field': 'batch', 'action': 'set', 'counters': counters}:
+            return {int(page_pk) for page_pk in counters}
+        case {'page': page_pk}:
+            return {int(page_pk)}
+    return set()
+
+
+class Coalescer:
+    """
+    Collects changes of statistic over a time or size window and applies them with one update per page.
+    Delivery tags of collected messages are kept with pages they change, so messages can be acked
+    only after a successful flush
+    """
+
+    def __init__(self, max_messages: int = 1000, max_delay: float = 0.1) -> None:
+        self.max_messages = max_messages
+        self.max_delay = max_delay
+        self._reset()
+
+    def _reset(self) -> None:
+        self.new_pages = []
+        self.deleted_pages = []
+        self.counters = {}
+        self.deltas = defaultdict(lambda: defaultdict(int))
+        self.messages = 0
+        self.opened_at = None
+        self.delivery_tags = []
+        self.pages = defaultdict(set)
+
+    def __len__(self) -> int:
+        return self.messages
+
+    def add(self, message: dict, delivery_tag: int = None) -> None:
+        """
+        Merge a change message into the window
+        :param message: Single change or a batch from producer
+        :param delivery_tag: Delivery tag of the message
+        """
+        match message:
+            case {'field': 'batch', 'action': 'apply', 'new': new_pages, 'deltas': deltas}:
+                for page_pk in new_pages:
+                    self._new(int(page_pk))
+                for page_pk, page_deltas in deltas.items():
+                    for field, delta in page_deltas.items():
+                        self.deltas[int(page_pk)][field] += delta
+                for page_pk in message.get('deleted', []):
+                    self._delete(int(page_pk))
+            case {'field': 'batch', 'action': 'set', 'counters': counters}:
+                for page_pk, values in counters.items():
+                    self._set(int(page_pk), values)
+            case {'field': 'page', 'action': 'new', 'page': page_pk}:
+                self._new(int(page_pk))
+            case {'field': 'page', 'action': 'delete', 'page': page_pk}:
+                self._delete(int(page_pk))
+            case {'field': field, 'action': action, 'page': page_pk} if (field, action) in CHANGES:
+                field, delta = CHANGES[field, action]
+                self.deltas[int(page_pk)][field] += delta
+            case _:
+                logging.error('Unknown message: %s', message)
+        if self.opened_at is None:
+            self.opened_at = time.monotonic()
+        self.messages += 1
+        self.delivery_tags.append(delivery_tag)
+        self.pages[delivery_tag].update(pages_of(message))
+
+    def _new(self, page_pk: int) -> None:
+        self.new_pages.append(page_pk)
+        self.counters.pop(page_pk, None)
+        self.deltas.pop(page_pk, None)
+
+    def _delete(self, page_pk: int) -> None:
+        self.deleted_pages.append(page_pk)
+        self.counters.pop(page_pk, None)
+        self.deltas.pop(page_pk, None)
+
+    def _set(self, page_pk: int, values: dict) -> None:
+        """
+        Replace counters of page, changes of these counters collected before are overridden
+        """
+        self.counters.setdefault(page_pk, {}).update(values)
+        for field in values:
+            self.deltas.get(page_pk, {}).pop(field, None)
+
+    def is_full(self) -> bool:
+        return self.messages >= self.max_messages
+
+    def is_due(self) -> bool:
+        return self.opened_at is not None and time.monotonic() - self.opened_at >= self.max_delay
+
+    def time_left(self) -> float | None:
+        """
+        Seconds until the window is due, None if the window is empty
+        """
+        if self.opened_at is None:
+            return None
+        return max(0.0, self.opened_at + self.max_delay - time.monotonic())
+
+    def take(self) -> tuple[list, list, dict, dict, list]:
+        """
+        Empty the window, returning its changes and delivery tags
+        """
+        window = self.new_pages, self.deleted_pages, self.counters, self.deltas, self.delivery_tags
+        self._reset()
+        return window
+
+    async def flush(self) -> set:
+        """
+        Apply collected changes, one update per page, with updates of different pages running concurrently.
+        A page whose update failed is not changed further, while other pages are still applied.
+        The window is cleared even if applying fails, the caller is expected to reject the messages
+        that changed failed pages, so they are delivered again
+        :return: Ids of pages whose changes were not applied
+        """
+        new_pages, deleted_pages, counters, deltas, delivery_tags = self.take()
+        failed = set()
+        await self._apply(services.new_page, {page_pk: () for page_pk in new_pages}, failed)
+        await self._apply(services.set_counters, {page_pk: (values,) for page_pk, values in counters.items()}, failed)
+        await self._apply(services.apply_deltas, {page_pk: (page_deltas,) for page_pk, page_deltas in deltas.items()},
+                          failed)
+        await self._apply(services.delete_page, {page_pk: () for page_pk in deleted_pages}, failed)
+        return failed
+
+    @staticmethod
+    async def _apply(update, changes: dict, failed: set) -> None:
+        """
+        Run update for every page that did not fail yet, adding the pages it fails for to failed
+        :param changes: Arguments of update after id of page, by id of page
+        """
+        pages = [page_pk for page_pk in changes if page_pk not in failed]
+        results = await asyncio.gather(*(update(page_pk, *changes[page_pk]) for page_pk in pages),
+                                       return_exceptions=True)
+        for page_pk, result in zip(pages, results):
+            if isinstance(result, Exception):
+                logging.error('Statistic of page %s was not applied', page_pk, exc_info=result)
+                failed.add(page_pk)
@@ -1,38 +1,452 @@
+import asyncio
 import json
+import logging
+import signal
+import time
+from datetime import datetime
 import services
+from collections import deque
+from functools import partial
+from amqp import connect, wait
+from coalescer import Coalescer, pages_of
+from dedup import RecentEvents
 from encoders import DecimalEncoder
+from leaderboard import Leaderboards
+from pubsub import UPDATES_EXCHANGE, StatsBroadcaster
 import pika
-from pika.adapters.blocking_connection import BlockingChannel
+from pika.channel import Channel
+from pika.connection import ConnectionParameters
 from pika.spec import BasicProperties, Basic
-from kink import inject
+from kink import di, inject
 from dependencies import microservice_di
-import requests
 
-microservice_di()
 
+def partition(message: dict, key) -> dict:
+    """
+    Function that split a change message into parts by key of their pages
+    :param key: Function that gives the key of part of a page
+    :return: Parts of message by key, a message without pages is a single part with key None
+    """
+    match message:
+        case {'field': 'batch', 'action': 'apply', 'new': new_pages, 'deltas': deltas}:
+            parts = {}
+
+            def part(page_pk):
+                return parts.setdefault(key(page_pk), {'field': 'batch', 'action': 'apply',
+                                                       'new': [], 'deltas': {}, 'deleted': []})
 
-def callback(ch: BlockingChannel, method: Basic.Deliver, props: BasicProperties, body: str) -> None:
+            for page_pk in new_pages:
+                part(page_pk)['new'].append(page_pk)
+            for page_pk, page_deltas in deltas.items():
+                part(page_pk)['deltas'][page_pk] = page_deltas
+            for page_pk in message.get('deleted', []):
+                part(page_pk)['deleted'].append(page_pk)
+            return parts
+        case {'field': 'batch', 'action': 'set', 'counters': counters}:
+            parts = {}
+            for page_pk, values in counters.items():
+                parts.setdefault(key(page_pk), {'field': 'batch', 'action': 'set',
+                                                'counters': {}})['counters'][page_pk] = values
+            return parts
+        case {'page': page_pk}:
+            return {key(page_pk): message}
+    return {None: message}
+
+
+def split(message: dict, workers: int) -> dict:
     """
-    Function that handle incoming messages, and if it's necessary send back page statistic as a response
+    Function that split a change message into parts by worker, so a page is always handled by the same worker
+    :return: Parts of message by index of worker
     """
-    print('[x] Received', json.loads(body))
-    print(" [x] Done")
-    match json.loads(body):
-        case {'field': 'page', 'action': 'stats', 'page': page_pk}:
-            ch.basic_publish(exchange='',
-                             routing_key=props.reply_to,
-                             properties=pika.BasicProperties(correlation_id=props.correlation_id),
-                             body=json.dumps(services.page_stats(page_id=page_pk),
-                                             cls=DecimalEncoder))
-        case {'field': 'page', 'action': 'new', 'page': page_pk}:
-            requests.post(f'http://localhost:8001/page/{page_pk}', params={'action': 'new'})
-        case {'field': field, 'action': action, 'page': page_pk}:
-            requests.put(f'http://localhost:8001/{field}/{page_pk}', params={'action': action})
-    ch.basic_ack(delivery_tag=method.delivery_tag)
+    parts = partition(message, lambda page_pk: int(page_pk) % workers)
+    return {index or 0: part for index, part in parts.items()} or {0: message}
+
+
+class AckTracker:
+    """
+    Acks messages in delivery order: a message is acked once it and every message delivered before it are done,
+    so all of them are acked at once. A message split into parts is settled when all of its parts are done,
+    and it is rejected as a whole if any of them failed. Messages delivered after a rejected one
+    in the same run are acked one by one, so an ack never covers the rejected message
+    """
+
+    def __init__(self, on_settled=None) -> None:
+        """
+        :param on_settled: Function called with delivery tag and whether the message was applied,
+        when all parts of the message are done
+        """
+        self.channel = None
+        self.order = deque()
+        self.parts = {}
+        self.failed_tags = set()
+        self.on_settled = on_settled
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def track(self, delivery_tag: int, parts: int = 1) -> None:
+        self.order.append(delivery_tag)
+        self.parts[delivery_tag] = parts
+
+    def done(self, delivery_tag: int) -> None:
+        self._finish(delivery_tag, failed=False)
+
+    def failed(self, delivery_tag: int) -> None:
+        self._finish(delivery_tag, failed=True)
+
+    def _finish(self, delivery_tag: int, failed: bool) -> None:
+        if self.parts.get(delivery_tag, 0) <= 0:
+            return
+        self.parts[delivery_tag] -= 1
+        if failed:
+            self.failed_tags.add(delivery_tag)
+        if self.parts[delivery_tag] > 0:
+            return
+        applied = delivery_tag not in self.failed_tags
+        if not applied:
+            self.channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+        if self.on_settled is not None:
+            self.on_settled(delivery_tag, applied)
+        self._ack_done()
+
+    def _ack_done(self) -> None:
+        last, one_by_one, nacked = None, [], False
+        while self.order and self.parts[self.order[0]] <= 0:
+            delivery_tag = self.order.popleft()
+            del self.parts[delivery_tag]
+            if delivery_tag in self.failed_tags:
+                self.failed_tags.discard(delivery_tag)
+                nacked = True
+            elif nacked:
+                one_by_one.append(delivery_tag)
+            else:
+                last = delivery_tag
+        if last is not None:
+            self.channel.basic_ack(delivery_tag=last, multiple=True)
+        for delivery_tag in one_by_one:
+            self.channel.basic_ack(delivery_tag=delivery_tag)
+
+
+class AsyncConsumer:
+    """
+    Consumer of statistic queue on an asyncio connection, with up to prefetch messages in flight.
+    Changes are routed by page to a fixed pool of workers, each flushing its own coalescing window,
+    so a slow update stalls only its worker, while changes of one page are still applied in order.
+    Changes are delivered at least once, so events seen recently are dropped by their message id.
+    A message is rejected as a whole if a part of it failed, so changes of its pages that were applied
+    are remembered and dropped when it is delivered again.
+    Events applied by a window are saved to the store before their messages are acked, and loaded at startup,
+    so messages that were applied but not acked before a restart are not applied twice when delivered again.
+    Statistic changed by a window is published to the updates exchange, for API processes to push it to clients,
+    and kept in leaderboards, that are saved every save_interval seconds and before exit.
+    On SIGTERM messages in flight are applied before the connection is closed, so none is delivered again.
+    If broker closes the channel, the connection is closed too and the consumer stops, to be started again
+    by the supervisor; its unacked messages are delivered again
+    """
+
+    def __init__(self, conn_params: ConnectionParameters, queue: str = 'fastapi', prefetch: int = 1000,
+                 workers: int = 8, max_messages: int = 1000, max_delay: float = 0.1,
+                 dedup_size: int = 100000, dedup_window: float = 600,
+                 stats_updates: StatsBroadcaster = None, drain_timeout: float = 30,
+                 leaderboards: Leaderboards = None, save_interval: float = 60) -> None:
+        self.conn_params = conn_params
+        self.queue = queue
+        self.prefetch = prefetch
+        self.workers = workers
+        self.coalescers = [Coalescer(max_messages=max_messages, max_delay=max_delay) for _ in range(workers)]
+        self.tracker = AckTracker(on_settled=self.settled)
+        self.events = RecentEvents(max_size=dedup_size, window=dedup_window)
+        self.partly_applied = RecentEvents(max_size=dedup_size, window=dedup_window)
+        self.event_ids = {}
+        self.applied = {}
+        self.updates = {}
+        if stats_updates is not None:
+            stats_updates.listen(self.updates.__setitem__)
+        self.drain_timeout = drain_timeout
+        self.leaderboards = leaderboards
+        self.save_interval = save_interval
+        self.channel = None
+        self.consumer_tag = None
+        self.inboxes = []
+        self.tasks = []
+        self.replies = None
+        self.reply_tasks = set()
+
+    async def run(self) -> None:
+        """
+        Connect to broker and consume until the connection is closed
+        """
+        connection, closed = await connect(self.conn_params)
+        channel = await wait(connection.channel, 'on_open_callback')
+        channel.add_on_close_callback(partial(self.on_channel_closed, connection))
+        await wait(channel.queue_declare, queue=self.queue)
+        await wait(channel.exchange_declare, exchange=UPDATES_EXCHANGE, exchange_type='fanout')
+        await wait(channel.basic_qos, prefetch_count=self.prefetch)
+        self.start(channel)
+        self.consumer_tag = channel.basic_consume(queue=self.queue, on_message_callback=self.on_message)
+        if self.leaderboards is not None:
+            self.tasks.append(asyncio.create_task(self.keep_leaderboards()))
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM,
+                                                      lambda: asyncio.create_task(self.drain(connection)))
+        print(' [*] Waiting for messages. To exit press CTRL+C')
+        logging.error('Consumer connection closed: %r', await closed)
+        self.stop()
+
+    def start(self, channel: Channel) -> None:
+        self.channel = self.tracker.channel = channel
+        self.replies = asyncio.Semaphore(self.workers)
+        self.inboxes = [asyncio.Queue() for _ in range(self.workers)]
+        self.tasks = [asyncio.create_task(self.work(index)) for index in range(self.workers)]
+
+    def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+
+    async def drain(self, connection) -> None:
+        """
+        Stop receiving messages, wait until the ones in flight are acked and replies to requests are sent,
+        or drain_timeout passes, and close connection
+        """
+        await wait(self.channel.basic_cancel, consumer_tag=self.consumer_tag)
+        deadline = time.monotonic() + self.drain_timeout
+        while len(self.tracker) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.reply_tasks:
+            await asyncio.wait(self.reply_tasks, timeout=max(deadline - time.monotonic(), 0))
+        if len(self.tracker):
+            logging.error('%d messages were not applied before exit', len(self.tracker))
+        if self.leaderboards is not None:
+            await self.save_leaderboards()
+        connection.close()
+
+    async def keep_leaderboards(self) -> None:
+        while True:
+            await asyncio.sleep(self.save_interval)
+            await self.save_leaderboards()
+
+    @staticmethod
+    async def save_leaderboards() -> None:
+        try:
+            await services.in_thread(services.save_leaderboards)
+        except Exception:
+            logging.exception('Leaderboards were not saved')
+
+    @staticmethod
+    def on_channel_closed(connection, channel: Channel, reason: Exception) -> None:
+        """
+        Close the connection when broker closes the channel, e.g. on an unknown delivery tag,
+        since no message can be acked without it
+        """
+        if connection.is_open:
+            logging.error('Consumer channel closed: %r', reason)
+            connection.close()
+
+    def on_message(self, ch: Channel, method: Basic.Deliver, props: BasicProperties, body: bytes) -> None:
+        """
+        Function that handle incoming messages, and if it's necessary send back page statistic as a response
+        """
+        message = json.loads(body)
+        logging.debug('Received %s', message)
+        match message:
+            case {'field': 'page', 'action': 'stats', 'page': page_pk}:
+                self.tracker.track(method.delivery_tag)
+                self.start_reply(partial(services.page_stats, page_id=page_pk), props, method.delivery_tag)
+            case {'field': 'page', 'action': 'stats_many', 'pages': page_pks}:
+                self.tracker.track(method.delivery_tag)
+                self.start_reply(partial(services.pages_stats, page_ids=page_pks), props, method.delivery_tag)
+            case {'field': 'page', 'action': 'series', 'page': page_pk, 'granularity': granularity,
+                  'from': start, 'to': end}:
+                self.tracker.track(method.delivery_tag)
+                self.start_reply(partial(services.page_series, page_id=page_pk, granularity=granularity,
+                                         start=datetime.fromisoformat(start), end=datetime.fromisoformat(end)),
+                                 props, method.delivery_tag)
+            case _:
+                if self.is_duplicate(props, method.delivery_tag) \
+                        or (message := self.unapplied(message, props)) is None:
+                    logging.debug('Dropped duplicate event %s', props.message_id)
+                    self.tracker.track(method.delivery_tag)
+                    self.tracker.done(method.delivery_tag)
+                    return
+                parts = split(message, self.workers)
+                self.tracker.track(method.delivery_tag, len(parts))
+                for index, part in parts.items():
+                    self.inboxes[index].put_nowait((part, method.delivery_tag))
+
+    def restore_events(self, events: list) -> None:
+        """
+        Remember events applied before a restart. Ids of single pages of events, 'event/page', mark changes
+        of a page applied by a part of a message
+        :param events: Pairs (event ID, expiry in seconds since epoch), oldest first
+        """
+        for event_id, expires_at in events:
+            if '/' in event_id:
+                self.partly_applied.restore(event_id.split('/', 1)[0], expires_at)
+                self.partly_applied.restore(event_id, expires_at)
+            else:
+                self.events.restore(event_id, expires_at)
+
+    def applied_events(self, delivery_tags: list, pages: dict, failed: set) -> list:
+        """
+        Ids of events applied by a window: id of event if its whole message is applied with it,
+        otherwise 'event/page' for every page it applied
+        """
+        event_ids = []
+        for delivery_tag in delivery_tags:
+            event_id = self.event_ids.get(delivery_tag)
+            if event_id is None:
+                continue
+            applied = pages[delivery_tag] - failed
+            if applied == pages[delivery_tag] and self.tracker.parts.get(delivery_tag) == 1 \
+                    and delivery_tag not in self.tracker.failed_tags:
+                event_ids.append(event_id)
+            else:
+                event_ids += [f'{event_id}/{page_pk}' for page_pk in applied]
+        return event_ids
+
+    async def save_events(self, event_ids: list) -> None:
+        try:
+            await services.save_events(event_ids=event_ids, expires_at=int(time.time() + self.events.window))
+        except Exception:
+            logging.exception('Applied events were not saved')
+
+    def is_duplicate(self, props: BasicProperties, delivery_tag: int) -> bool:
+        """
+        Check whether the event of message was seen recently, remembering it otherwise.
+        Messages without id are never duplicates
+        """
+        event_id = props.message_id if props else None
+        if event_id is None:
+            return False
+        if self.events.seen(event_id):
+            return True
+        self.event_ids[delivery_tag] = event_id
+        return False
+
+    def unapplied(self, message: dict, props: BasicProperties) -> dict | None:
+        """
+        Drop changes of pages that were applied before the message was rejected, when it is delivered again
+        :return: The rest of message, None if changes of all its pages were applied
+        """
+        event_id = props.message_id if props else None
+        if event_id is None or event_id not in self.partly_applied:
+            return message
+        applied = {page_pk for page_pk in pages_of(message) if f'{event_id}/{page_pk}' in self.partly_applied}
+        return partition(message, lambda page_pk: int(page_pk) in applied).get(False) if applied else message
+
+    def settled(self, delivery_tag: int, applied: bool) -> None:
+        """
+        Forget the event of a rejected message, so it is applied when delivered again,
+        but remember the pages it changed before, so their changes are not applied twice
+        """
+        event_id = self.event_ids.pop(delivery_tag, None)
+        pages = self.applied.pop(delivery_tag, ())
+        if applied or event_id is None:
+            return
+        self.events.forget(event_id)
+        if pages:
+            self.partly_applied.seen(event_id)
+            for page_pk in pages:
+                self.partly_applied.seen(f'{event_id}/{page_pk}')
+
+    def start_reply(self, read, props: BasicProperties, delivery_tag: int) -> None:
+        """
+        Reply in a task that is kept until it is done, so it is not garbage collected while it runs
+        and drain can wait for it
+        """
+        task = asyncio.create_task(self.reply(read, props, delivery_tag))
+        self.reply_tasks.add(task)
+        task.add_done_callback(self.reply_tasks.discard)
+
+    async def reply(self, read, props: BasicProperties, delivery_tag: int) -> None:
+        """
+        Send back statistic as a response to RPC request. If statistic is not read, an error reply is sent,
+        so the client does not wait for a reply until its timeout
+        :param read: Function that read the requested statistic
+        """
+        async with self.replies:
+            try:
+                stats, reply_type = await read(), None
+            except Exception:
+                logging.exception('Statistic was not read')
+                stats, reply_type = {'detail': 'Statistic was not read'}, 'error'
+        self.channel.basic_publish(exchange='',
+                                   routing_key=props.reply_to,
+                                   properties=pika.BasicProperties(correlation_id=props.correlation_id,
+                                                                   type=reply_type),
+                                   body=json.dumps(stats, cls=DecimalEncoder))
+        self.tracker.done(delivery_tag)
+
+    async def work(self, index: int) -> None:
+        """
+        Worker that collects its changes into a window and flushes it when it is full or due
+        """
+        inbox, coalescer = self.inboxes[index], self.coalescers[index]
+        while True:
+            try:
+                part, delivery_tag = await asyncio.wait_for(inbox.get(), coalescer.time_left())
+            except asyncio.TimeoutError:
+                pass
+            else:
+                coalescer.add(part, delivery_tag)
+            if coalescer.is_full() or coalescer.is_due():
+                await self.flush(coalescer)
+
+    async def flush(self, coalescer: Coalescer) -> None:
+        """
+        Apply the window and ack its messages, or reject the ones that changed a page that failed
+        to be redelivered. Pages changed by applied parts of messages with events are kept until the messages
+        are settled, so only the pages that failed are applied when a message is delivered again
+        """
+        delivery_tags, pages = list(coalescer.delivery_tags), coalescer.pages
+        try:
+            failed = await coalescer.flush()
+        except Exception:
+            logging.exception('Statistics window was not applied')
+            failed = set().union(*pages.values())
+        await self.save_events(self.applied_events(delivery_tags, pages, failed))
+        for delivery_tag in delivery_tags:
+            if delivery_tag in self.event_ids:
+                self.applied.setdefault(delivery_tag, set()).update(pages[delivery_tag] - failed)
+            if pages[delivery_tag] & failed:
+                self.tracker.failed(delivery_tag)
+            else:
+                self.tracker.done(delivery_tag)
+        await self.publish_updates()
+
+    async def publish_updates(self) -> None:
+        """
+        Publish statistic of pages changed since the last time as one message. Statistic that is unknown
+        after a change, as of sharded pages, is read first. It is None if it could not be read
+        """
+        if not self.updates:
+            return
+        updates = dict(self.updates)
+        self.updates.clear()
+        unknown = [page_id for page_id, stats in updates.items() if stats is None]
+        if unknown:
+            try:
+                updates.update(await services.pages_stats(page_ids=unknown))
+            except Exception:
+                logging.exception('Changed statistic was not read')
+        if self.leaderboards is not None:
+            for page_id, stats in updates.items():
+                self.leaderboards.update(page_id, stats)
+        updates = {str(page_id): stats for page_id, stats in updates.items()}
+        self.channel.basic_publish(exchange=UPDATES_EXCHANGE, routing_key='',
+                                   body=json.dumps(updates, cls=DecimalEncoder))
 
 
 @inject()
-def start_consumer(channel: BlockingChannel) -> None:
-    print(' [*] Waiting for messages. To exit press CTRL+C')
-    channel.basic_consume(on_message_callback=callback, queue='fastapi')
-    channel.start_consuming()
+def start_consumer(conn_params: ConnectionParameters, consumer_options: dict, stats_updates: StatsBroadcaster,
+                   leaderboards: Leaderboards, leaderboard_options: dict) -> None:
+    # connect to the store, load leaderboards and applied events before consuming, not on the event loop
+    services.restore_leaderboards()
+    consumer = AsyncConsumer(conn_params, stats_updates=stats_updates, leaderboards=leaderboards,
+                             save_interval=leaderboard_options['save_interval'], **consumer_options)
+    consumer.restore_events(services.load_events())
+    asyncio.run(consumer.run())
+
+
+if __name__ == '__main__':
+    microservice_di()
+    start_consumer()
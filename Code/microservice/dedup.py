@@ -0,0 +1,57 @@
+import time
+from collections import OrderedDict
+
+
+class RecentEvents:
+    """
+    Sliding window of event ids seen by this consumer, bounded both by size and by age.
+    Lookups and insertions are O(1), the oldest ids are dropped first
+    """
+
+    def __init__(self, max_size: int = 100000, window: float = 600) -> None:
+        self.max_size = max_size
+        self.window = window
+        self.events = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def __contains__(self, event_id: str) -> bool:
+        self._expire(time.monotonic())
+        return event_id in self.events
+
+    def seen(self, event_id: str) -> bool:
+        """
+        Check whether the event was already seen, remembering it if it was not
+        """
+        now = time.monotonic()
+        self._expire(now)
+        if event_id in self.events:
+            return True
+        self.events[event_id] = now
+        if len(self.events) > self.max_size:
+            self.events.popitem(last=False)
+        return False
+
+    def restore(self, event_id: str, expires_at: float) -> None:
+        """
+        Remember an event seen before a restart until it expires, expires_at is in seconds since epoch.
+        Events are restored oldest first, so the oldest ids are still dropped first
+        """
+        self.events[event_id] = time.monotonic() + expires_at - time.time() - self.window
+        self.events.move_to_end(event_id)
+        if len(self.events) > self.max_size:
+            self.events.popitem(last=False)
+
+    def forget(self, event_id: str) -> None:
+        """
+        Forget the event, so it is handled when it is delivered again, e.g. after it failed
+        """
+        self.events.pop(event_id, None)
+
+    def _expire(self, now: float) -> None:
+        while self.events:
+            event_id, seen_at = next(iter(self.events.items()))
+            if now - seen_at < self.window:
+                break
+            del self.events[event_id]
@@ -1,9 +1,15 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from kink import di
 import boto3
 from dotenv import dotenv_values
 from boto3.resources.base import ServiceResource
 from boto3.dynamodb.table import TableResource
 import pika
+from cache import StatsCache
+from leaderboard import Leaderboards
+from pubsub import StatsBroadcaster
+from stores import DynamoStatsStore, MemoryStatsStore, SQLiteStatsStore, StatsStore
 
 
 def microservice_di() -> None:
@@ -11,46 +17,123 @@ def microservice_di() -> None:
     Function that define dependencies, to be registered in inside dependency injection container
     """
     config = dotenv_values('.env')
-    db = boto3.resource('dynamodb',
-                        endpoint_url=config['AWS_ENDPOINT_URL'],
-                        region_name=config['AWS_DEFAULT_REGION'],
-                        aws_access_key_id=config['AWS_ACCESS_KEY_ID'],
-                        aws_secret_access_key=config['AWS_SECRET_ACCESS_KEY'])
+    # connecting to the store is slow, so it is done on first use instead of at import
+    di['stats_store'] = lambda di: create_stats_store(config)
 
-    if not list(db.tables.all()):
-        table = initialize_db(db)
-    else:
-        table = db.Table('Statistic')
+    di['db_executor'] = ThreadPoolExecutor(max_workers=int(config.get('DB_THREADS', 16)),
+                                           thread_name_prefix='stats-store')
+    di['stats_cache'] = StatsCache(max_size=int(config.get('STATS_CACHE_SIZE', 10000)),
+                                   ttl=float(config.get('STATS_CACHE_TTL', 30)))
 
-    di['database'] = db
-    di['db_table'] = table
+    di['stats_updates'] = StatsBroadcaster()
+    di['leaderboards'] = Leaderboards(size=int(config.get('LEADERBOARD_SIZE', 100)))
+    di['leaderboard_options'] = {
+        'reload_interval': float(config.get('LEADERBOARD_RELOAD_S', 60)),
+        'save_interval': float(config.get('LEADERBOARD_SAVE_S', 60)),
+    }
+    di['sse_options'] = {
+        'heartbeat': float(config.get('SSE_HEARTBEAT_S', 15)),
+        'min_interval': int(config.get('SSE_MIN_INTERVAL_MS', 500)) / 1000,
+    }
 
-    conn_params = pika.ConnectionParameters(host='rabbit', port=5672)
-    connection = pika.BlockingConnection(conn_params)
-    channel = connection.channel()
-    channel.queue_declare(queue='fastapi')
+    di['conn_params'] = pika.ConnectionParameters(host='rabbit', port=5672)
+    di['api_options'] = {
+        'embedded_consumer': config.get('EMBEDDED_CONSUMER', 'false').lower() in ('1', 'true', 'yes'),
+        'ready_timeout': float(config.get('READY_TIMEOUT_S', 10)),
+    }
+    di['consumer_options'] = {
+        'prefetch': int(config.get('CONSUMER_PREFETCH', 1000)),
+        'workers': int(config.get('CONSUMER_WORKERS', 8)),
+        'max_messages': int(config.get('COALESCE_MAX_MESSAGES', 1000)),
+        'max_delay': int(config.get('COALESCE_MAX_DELAY_MS', 100)) / 1000,
+        'dedup_size': int(config.get('DEDUP_MAX_EVENTS', 100000)),
+        'dedup_window': float(config.get('DEDUP_WINDOW_S', 600)),
+        'drain_timeout': float(config.get('CONSUMER_DRAIN_S', 30)),
+    }
+    di['supervisor_options'] = {
+        'interval': float(config.get('CONSUMER_CHECK_INTERVAL_S', 5)),
+    }
 
-    di['channel'] = channel
 
+def create_stats_store(config: dict) -> StatsStore:
+    """
+    Function that connect to the store of statistic, chosen by STATS_STORE, creating its tables when they are missing
+    """
+    hourly_retention = timedelta(days=float(config.get('HISTORY_HOURLY_RETENTION_DAYS', 7)))
+    match config.get('STATS_STORE', 'dynamodb'):
+        case 'memory':
+            return MemoryStatsStore(hourly_retention)
+        case 'sqlite':
+            return SQLiteStatsStore(config.get('SQLITE_PATH', 'statistic.sqlite3'), hourly_retention)
+        case _:
+            db = boto3.resource('dynamodb',
+                                endpoint_url=config['AWS_ENDPOINT_URL'],
+                                region_name=config['AWS_DEFAULT_REGION'],
+                                aws_access_key_id=config['AWS_ACCESS_KEY_ID'],
+                                aws_secret_access_key=config['AWS_SECRET_ACCESS_KEY'])
+
+            tables = [table.name for table in db.tables.all()]
+            if 'Statistic' not in tables:
+                table = initialize_db(db)
+            else:
+                table = db.Table('Statistic')
+
+            shards_table = None
+            if config.get('SHARDED_COUNTERS', 'false').lower() in ('1', 'true', 'yes'):
+                if 'StatisticShards' not in tables:
+                    shards_table = initialize_db(db, name='StatisticShards', key='shard_id', key_type='S')
+                else:
+                    shards_table = db.Table('StatisticShards')
+
+            if 'StatisticHistory' not in tables:
+                history_table = initialize_db(db, name='StatisticHistory', sort_key='bucket')
+            else:
+                history_table = db.Table('StatisticHistory')
+            enable_ttl(db, history_table)
+
+            if 'StatisticLeaderboard' not in tables:
+                leaderboard_table = initialize_db(db, name='StatisticLeaderboard', key='counter', key_type='S')
+            else:
+                leaderboard_table = db.Table('StatisticLeaderboard')
+
+            if 'StatisticEvents' not in tables:
+                events_table = initialize_db(db, name='StatisticEvents', key='event_id', key_type='S')
+            else:
+                events_table = db.Table('StatisticEvents')
+            enable_ttl(db, events_table)
 
-def initialize_db(db: ServiceResource) -> TableResource:
+            return DynamoStatsStore(db, table, shards_table,
+                                    shard_count=int(config.get('SHARD_COUNT', 8)),
+                                    promote_rate=int(config.get('SHARD_PROMOTE_WRITES_PER_S', 50)),
+                                    history_table=history_table, hourly_retention=hourly_retention,
+                                    leaderboard_table=leaderboard_table, events_table=events_table)
+
+
+def initialize_db(db: ServiceResource, name: str = 'Statistic', key: str = 'page_id',
+                  key_type: str = 'N', sort_key: str = None) -> TableResource:
     """
-    Function that create a table in db, that are specified as a parameter, and return that Table
+    Function that create a table in db, that are specified as a parameter, and return that Table.
+    A table with sort key is sorted by a string attribute within each key
     """
+    key_schema = [
+        {
+            'AttributeName': key,
+            'KeyType': 'HASH'
+        }
+    ]
+    attributes = [
+        {
+            'AttributeName': key,
+            'AttributeType': key_type
+        }
+    ]
+    if sort_key is not None:
+        key_schema.append({'AttributeName': sort_key, 'KeyType': 'RANGE'})
+        attributes.append({'AttributeName': sort_key, 'AttributeType': 'S'})
     table = db.create_table(
-            TableName='Statistic',
-            KeySchema=[
-                {
-                    'AttributeName': 'page_id',
-                    'KeyType': 'HASH'
-                }
-            ],
-            AttributeDefinitions=[
-                {
-                    'AttributeName': 'page_id',
-                    'AttributeType': 'N'
-                }
-            ],
+            TableName=name,
+            KeySchema=key_schema,
+            AttributeDefinitions=attributes,
             ProvisionedThroughput={
                 'ReadCapacityUnits': 5,
                 'WriteCapacityUnits': 5,
@@ -58,3 +141,17 @@ def initialize_db(db: ServiceResource) -> TableResource:
     print(f'Table status: {table.table_status}')
 
     return table
+
+
+def enable_ttl(db: ServiceResource, table: TableResource, attribute: str = 'expires_at') -> None:
+    """
+    Function that let DynamoDB remove expired items of table by attribute, once the table is active.
+    It is checked on every start, so a table whose TTL was never enabled, e.g. when a start failed
+    right after creating it, gets it enabled later
+    """
+    table.wait_until_exists()
+    ttl = db.meta.client.describe_time_to_live(TableName=table.name)['TimeToLiveDescription']
+    if ttl['TimeToLiveStatus'] in ('ENABLED', 'ENABLING'):
+        return
+    db.meta.client.update_time_to_live(TableName=table.name,
+                                       TimeToLiveSpecification={'Enabled': True, 'AttributeName': attribute})
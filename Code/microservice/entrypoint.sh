@@ -1,4 +1,7 @@
 #!/bin/sh
 
-sleep 15
-pipenv run uvicorn main:app --host 0.0.0.0 --port 8001 --reload
+# several workers cannot reload on changes, so --reload is used only with one
+if [ "${API_WORKERS:-1}" -gt 1 ]; then
+    exec pipenv run uvicorn main:app --host 0.0.0.0 --port 8001 --workers "$API_WORKERS"
+fi
+exec pipenv run uvicorn main:app --host 0.0.0.0 --port 8001 --reload
@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta, timezone
+
+GRANULARITIES = {
+    'hour': ('%Y-%m-%dT%H:00', timedelta(hours=1)),
+    'day': ('%Y-%m-%d', timedelta(days=1)),
+}
+MAX_BUCKETS = 1000
+
+
+def utc(moment: datetime) -> datetime:
+    """
+    Moment in UTC, a naive moment is taken as UTC
+    """
+    return moment.astimezone(timezone.utc) if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+def floor(moment: datetime, granularity: str) -> datetime:
+    """
+    Start of the bucket of given granularity, that contains the moment, in UTC
+    """
+    moment = utc(moment).replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if granularity == 'day' else moment
+
+
+def bucket_key(moment: datetime, granularity: str) -> str:
+    """
+    Key of the bucket, that contains the moment. Keys of one granularity sort in time order
+    """
+    return f'{granularity}#{floor(moment, granularity).strftime(GRANULARITIES[granularity][0])}'
+
+
+def check_range(start: datetime, end: datetime, granularity: str) -> None:
+    """
+    Raise ValueError if the range is reversed or has too many buckets
+    """
+    if utc(start) > utc(end) or (utc(end) - utc(start)) / GRANULARITIES[granularity][1] >= MAX_BUCKETS:
+        raise ValueError(f'Range must be ordered and have less than {MAX_BUCKETS} buckets')
+
+
+def bucket_starts(start: datetime, end: datetime, granularity: str) -> list[datetime]:
+    """
+    Starts of all buckets between two moments, both included
+    """
+    step = GRANULARITIES[granularity][1]
+    moment, end = floor(start, granularity), floor(end, granularity)
+    starts = []
+    while moment <= end:
+        starts.append(moment)
+        moment += step
+    return starts
@@ -0,0 +1,68 @@
+from stores import COUNTERS
+
+
+class Leaderboard:
+    """
+    Top pages by one counter, kept up to date with every change of statistic.
+    Twice as many pages as shown are tracked, so a page that drops out of the top is still replaced
+    by one that is known. A page that is not tracked enters only when it changes
+    """
+
+    def __init__(self, counter: str, size: int = 100) -> None:
+        self.counter = counter
+        self.size = size
+        self.capacity = size * 2
+        self.values = {}
+        self.ranked = None
+
+    def load(self, entries: list) -> None:
+        """
+        Add saved entries, pages that changed since they were saved keep their current values
+        """
+        for page_id, value in entries:
+            if page_id not in self.values:
+                self.update(page_id, value)
+
+    def update(self, page_id: int, value: int) -> None:
+        if value <= 0:
+            if self.values.pop(page_id, None) is not None:
+                self.ranked = None
+            return
+        if page_id not in self.values and len(self.values) >= self.capacity:
+            lowest = min(self.values, key=self.values.get)
+            if value <= self.values[lowest]:
+                return
+            del self.values[lowest]
+        if self.values.get(page_id) != value:
+            self.values[page_id] = value
+            self.ranked = None
+
+    def ranking(self) -> list:
+        """
+        All tracked pages in descending order of value, as pairs (page ID, value). Ranking is kept until the next change
+        """
+        if self.ranked is None:
+            self.ranked = sorted(self.values.items(), key=lambda entry: (-entry[1], entry[0]))
+        return self.ranked
+
+    def top(self, limit: int) -> list:
+        return self.ranking()[:min(limit, self.size)]
+
+
+class Leaderboards:
+    """
+    Leaderboards of every counter, fed by the pub/sub of statistic changes
+    """
+
+    def __init__(self, size: int = 100) -> None:
+        self.size = size
+        self.boards = {counter: Leaderboard(counter, size) for counter in COUNTERS}
+
+    def __getitem__(self, counter: str) -> Leaderboard:
+        return self.boards[counter]
+
+    def update(self, page_id: int, stats: dict | None) -> None:
+        if stats is None:
+            return
+        for counter, board in self.boards.items():
+            board.update(int(page_id), int(stats.get(counter, 0)))
@@ -1,33 +1,155 @@
-from fastapi import FastAPI, Depends
+from datetime import datetime, timedelta, timezone
+import asyncio
+import logging
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from consumer import start_consumer
+from dependencies import microservice_di
 from multiprocessing import Process
 import services
+from kink import di
+from pubsub import relay_updates
 from pydantic import BaseModel
 from typing import Literal
 
 
 app = FastAPI()
 
-process = Process(target=start_consumer)
-process.start()
+
+@app.on_event('startup')
+async def startup():
+    """
+    Register dependencies and start background work without waiting for brokers or the store,
+    so the server accepts connections right away. Every uvicorn worker runs it for itself
+    """
+    microservice_di()
+    app.state.ready = asyncio.Event()
+    app.state.consumer = None
+    if di['api_options']['embedded_consumer']:
+        app.state.consumer = Process(target=start_consumer)
+        app.state.consumer.start()
+    di['stats_updates'].listen(di['leaderboards'].update)
+    app.state.tasks = [asyncio.create_task(relay_updates()), asyncio.create_task(connect_store())]
+
+
+@app.on_event('shutdown')
+async def shutdown():
+    for task in app.state.tasks:
+        task.cancel()
+    if app.state.consumer is not None:
+        app.state.consumer.terminate()
+        app.state.consumer.join()
+
+
+async def connect_store(retry: float = 5) -> None:
+    """
+    Connect to the store on a thread until it answers, then mark the service ready and start keeping leaderboards
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, di.__getitem__, 'stats_store')
+            break
+        except Exception:
+            logging.exception('Statistic store is not available')
+            await asyncio.sleep(retry)
+    app.state.ready.set()
+    app.state.tasks.append(asyncio.create_task(services.keep_leaderboards()))
+
+
+async def store_ready() -> None:
+    """
+    Hold requests that need the store until it is connected, so they never connect to it on the event loop
+    """
+    if not app.state.ready.is_set():
+        try:
+            await asyncio.wait_for(app.state.ready.wait(), di['api_options']['ready_timeout'])
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail='Statistic store is not available')
+
+
+router = APIRouter(dependencies=[Depends(store_ready)])
 
 
 class ActionItem(BaseModel):
     action: Literal['plus', 'minus']
 
 
-@app.get('/stats/{page_id}')
+class DeltasItem(BaseModel):
+    post: int = 0
+    like: int = 0
+    follower: int = 0
+
+
+@app.get('/health/live')
+async def live():
+    return {'status': 'ok'}
+
+
+@app.get('/health/ready')
+async def ready():
+    checks = {'store': app.state.ready.is_set()}
+    if app.state.consumer is not None:
+        checks['consumer'] = app.state.consumer.is_alive()
+    return JSONResponse({'status': 'ok' if all(checks.values()) else 'unavailable', 'checks': checks},
+                        status_code=200 if all(checks.values()) else 503)
+
+
+@app.get('/cache/stats')
+async def cache_stats():
+    return di['stats_cache'].info()
+
+
+@router.get('/stats')
+async def stats_many(ids: str = Query(regex=r'^\d+(,\d+)*$')):
+    return await services.pages_stats(page_ids=[int(page_id) for page_id in ids.split(',')])
+
+
+@router.get('/stats/{page_id}')
 async def stats(page_id: int):
-    return services.page_stats(page_id=page_id)
+    return await services.page_stats(page_id=page_id)
+
+
+@router.get('/stats/{page_id}/stream')
+async def stats_stream(page_id: int):
+    return StreamingResponse(services.stats_events(page_id), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@router.get('/stats/{page_id}/series')
+async def stats_series(page_id: int, start: datetime | None = Query(None, alias='from'),
+                       end: datetime | None = Query(None, alias='to'),
+                       granularity: Literal['hour', 'day'] = 'hour'):
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(days=7)
+    try:
+        return await services.page_series(page_id, granularity, start, end)
+    except ValueError as err:
+        raise HTTPException(status_code=400, detail=str(err))
+
 
+@router.get('/leaderboard/{field}')
+async def leaderboard(field: Literal['post', 'like', 'follower'], limit: int = Query(10, ge=1, le=1000)):
+    return services.leaderboard(field, limit)
 
-@app.post('/page/{page_id}')
+
+@router.post('/page/{page_id}')
 async def page(page_id: int, action: str):
     if action == 'new':
         await services.new_page(page_id)
 
 
-@app.put('/post/{page_id}')
+@router.put('/page/{page_id}')
+async def page_deltas(page_id: int, deltas: DeltasItem):
+    await services.apply_deltas(page_id, deltas.dict())
+
+
+@router.delete('/page/{page_id}')
+async def delete_page(page_id: int):
+    await services.delete_page(page_id)
+
+
+@router.put('/post/{page_id}')
 async def post(page_id: int, action: ActionItem = Depends()):
     match action.action:
         case 'plus':
@@ -36,7 +158,7 @@ async def post(page_id: int, action: ActionItem = Depends()):
             await services.post_minus(page_id)
 
 
-@app.put('/like/{page_id}')
+@router.put('/like/{page_id}')
 async def post(page_id: int, action: ActionItem = Depends()):
     match action.action:
         case 'plus':
@@ -45,10 +167,13 @@ async def post(page_id: int, action: ActionItem = Depends()):
             await services.like_minus(page_id)
 
 
-@app.put('/follower/{page_id}')
+@router.put('/follower/{page_id}')
 async def post(page_id: int, action: ActionItem = Depends()):
     match action.action:
         case 'plus':
             await services.follower_plus(page_id)
         case 'minus':
             await services.follower_minus(page_id)
+
+
+app.include_router(router)
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import logging
+from contextlib import contextmanager
+
+from kink import inject
+from pika.connection import ConnectionParameters
+
+from amqp import connect, wait
+from cache import StatsCache
+
+UPDATES_EXCHANGE = 'stats_updates'
+
+
+class Subscription:
+    """
+    Subscription to changes of one page. Only the latest statistic is kept, so a burst of changes
+    is received as a single update
+    """
+
+    def __init__(self) -> None:
+        self.changed = asyncio.Event()
+        self.stats = None
+
+    def notify(self, stats: dict | None) -> None:
+        self.stats = stats
+        self.changed.set()
+
+    async def wait(self, timeout: float) -> bool:
+        """
+        Wait for a change of page
+        :return: False if nothing changed within timeout
+        """
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def take(self) -> dict | None:
+        """
+        Latest statistic of page, None if it is unknown and must be read
+        """
+        self.changed.clear()
+        stats, self.stats = self.stats, None
+        return stats
+
+
+class StatsBroadcaster:
+    """
+    In-process pub/sub of changes of page statistic. Subscribers of a page are notified about every change,
+    listeners about changes of all pages. An idle subscriber costs only an event, so a process can hold
+    thousands of them
+    """
+
+    def __init__(self) -> None:
+        self.subscribers = {}
+        self.listeners = []
+
+    @contextmanager
+    def subscribe(self, page_id: int):
+        subscription = Subscription()
+        self.subscribers.setdefault(page_id, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            subscribers = self.subscribers[page_id]
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.subscribers[page_id]
+
+    def listen(self, callback) -> None:
+        """
+        Call callback(page_id, stats) on every change
+        """
+        self.listeners.append(callback)
+
+    def publish(self, page_id: int, stats: dict | None) -> None:
+        """
+        Notify about a change of page
+        :param stats: New statistic of page, None if it is unknown
+        """
+        for subscription in self.subscribers.get(page_id, ()):
+            subscription.notify(stats)
+        for callback in self.listeners:
+            callback(page_id, stats)
+
+
+@inject()
+async def relay_updates(conn_params: ConnectionParameters, stats_updates: StatsBroadcaster,
+                        stats_cache: StatsCache, retry: float = 5) -> None:
+    """
+    Receive changes applied by consumers from the updates exchange, keep the cache of this process
+    in sync with them and publish them to subscribers of this process. Reconnects until cancelled
+    """
+    def on_message(ch, method, props, body):
+        for page_id, stats in json.loads(body).items():
+            page_id = int(page_id)
+            if stats is None:
+                stats_cache.invalidate(page_id)
+            else:
+                stats_cache.set(page_id, stats)
+            stats_updates.publish(page_id, stats)
+
+    while True:
+        try:
+            connection, closed = await connect(conn_params)
+            channel = await wait(connection.channel, 'on_open_callback')
+            await wait(channel.exchange_declare, exchange=UPDATES_EXCHANGE, exchange_type='fanout')
+            frame = await wait(channel.queue_declare, queue='', exclusive=True)
+            await wait(channel.queue_bind, queue=frame.method.queue, exchange=UPDATES_EXCHANGE)
+            channel.basic_consume(queue=frame.method.queue, on_message_callback=on_message, auto_ack=True)
+            logging.error('Updates connection closed: %r', await closed)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception('Updates of statistic are not received')
+        await asyncio.sleep(retry)
@@ -1,125 +1,320 @@
+import asyncio
+import json
 import logging
+import time
+from concurrent.futures import Executor
+from datetime import datetime, timezone
+from functools import partial
 
-from botocore.exceptions import ClientError
 from kink import inject
-from boto3.dynamodb.table import TableResource
+
+from cache import StatsCache
+from encoders import DecimalEncoder
+from leaderboard import Leaderboards
+from pubsub import StatsBroadcaster
+from history import bucket_key, bucket_starts, check_range
+from stores import COUNTERS as STORE_COUNTERS, StatsStore, empty_stats
+
+COUNTERS = {'post': 'posts_count', 'like': 'likes_count', 'follower': 'followers_count'}
 
 
 @inject()
-def page_stats(page_id: int, db_table: TableResource) -> dict:
+def in_thread(call, db_executor: Executor) -> asyncio.Future:
+    """
+    Run a blocking call to the store on the pool of DB threads, so it doesn't block the event loop
+    :param call: Function without arguments, that makes the call
+    :param db_executor: Pool of threads, that bounds the number of concurrent calls to DB
+    """
+    return asyncio.get_running_loop().run_in_executor(db_executor, call)
+
+
+@inject()
+async def page_stats(page_id: int, stats_store: StatsStore, stats_cache: StatsCache) -> dict:
     """
     Function that return statistic for existing page
     :param page_id: ID of page that would be handled
-    :param db_table: Table in DB in which we work
-    :return: Statistics of page
+    :param stats_store: Store of statistic in which we work
+    :param stats_cache: Cache of statistic, that is read through
+    :return: Statistics of page, zero counters if page has no statistic yet
     """
-    return db_table.get_item(Key={'page_id': page_id})['Item']
+    stats = stats_cache.get(page_id)
+    if stats is None:
+        read_at = time.monotonic()
+        stats = await in_thread(partial(stats_store.get, page_id)) or empty_stats(page_id)
+        stats_cache.fill(page_id, stats, read_at)
+    return stats
 
 
 @inject()
-async def new_page(page_id: int, db_table: TableResource) -> None:
+async def pages_stats(page_ids: list, stats_store: StatsStore, stats_cache: StatsCache) -> dict:
+    """
+    Function that return statistic for several pages, reading pages that are not cached at once
+    :param page_ids: IDs of pages
+    :param stats_store: Store of statistic in which we work
+    :param stats_cache: Cache of statistic, that is read through
+    :return: Statistics by ID of page, zero counters for pages without statistic. Pages that could not be read
+    are None, so they are not mistaken for pages with zero counters
+    """
+    stats = {page_id: stats_cache.get(page_id) for page_id in page_ids}
+    missed = [page_id for page_id, page in stats.items() if page is None]
+    if missed:
+        read_at = time.monotonic()
+        read = await in_thread(partial(stats_store.get_many, missed))
+        for page_id in missed:
+            if page_id in read:
+                stats[page_id] = read[page_id] or empty_stats(page_id)
+                stats_cache.fill(page_id, stats[page_id], read_at)
+    return stats
+
+
+@inject()
+async def new_page(page_id: int, stats_store: StatsStore, stats_cache: StatsCache,
+                   stats_updates: StatsBroadcaster) -> None:
     """
     Function that create a new page as an item in db
     :param page_id: ID of page that would be created
-    :param db_table: Table in DB in which we work
+    :param stats_store: Store of statistic in which we work
+    :param stats_cache: Cache of statistic, that is kept in sync with db
+    :param stats_updates: Pub/sub, that is notified about the change
     """
-    db_table.put_item(Item={
-        'page_id': page_id,
-        'posts_count': 0,
-        'likes_count': 0,
-        'followers_count': 0
-    })
+    _changed(page_id, await in_thread(partial(stats_store.create_page, page_id)), stats_cache, stats_updates)
 
 
 @inject()
-async def post_plus(page_id: int, db_table: TableResource) -> None:
+async def delete_page(page_id: int, stats_store: StatsStore, stats_cache: StatsCache,
+                      stats_updates: StatsBroadcaster) -> None:
     """
-    Function that increment count of posts on a specified page
-    :param page_id: ID of page that would be changed
-    :param db_table: Table in DB in which we work
+    Function that remove statistic of a deleted page from db
+    :param page_id: ID of page that would be deleted
+    :param stats_store: Store of statistic in which we work
+    :param stats_cache: Cache of statistic, that is kept in sync with db
+    :param stats_updates: Pub/sub, that is notified about the change
     """
-    db_table.update_item(
-        Key={'page_id': page_id},
-        UpdateExpression='ADD posts_count :inc',
-        ExpressionAttributeValues={':inc': 1})
+    await in_thread(partial(stats_store.delete_page, page_id))
+    _changed(page_id, empty_stats(page_id), stats_cache, stats_updates)
 
 
 @inject()
-async def post_minus(page_id: int, db_table: TableResource) -> None:
+async def apply_deltas(page_id: int, deltas: dict, stats_store: StatsStore, stats_cache: StatsCache,
+                       stats_updates: StatsBroadcaster) -> None:
     """
-    Function that decrement count of posts on a specified page
+    Function that change several counters of a specified page by net deltas in a single update,
+    and add them to hourly and daily history of page. As in single decrements, no counter is allowed to go below zero.
+    Counters are already changed when history is written, so a failure to write history is only logged:
+    the change must not be delivered again and applied twice
     :param page_id: ID of page that would be changed
-    :param db_table: Table in DB in which we work
+    :param deltas: Changes of counters by field ('post', 'like', 'follower')
+    :param stats_store: Store of statistic in which we work
+    :param stats_cache: Cache of statistic, updated with the new values of counters
+    :param stats_updates: Pub/sub, that is notified about the change
     """
+    deltas = {COUNTERS[field]: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    stats = await in_thread(partial(stats_store.apply_deltas, page_id, deltas))
+    _changed(page_id, stats, stats_cache, stats_updates)
     try:
-        db_table.update_item(
-            Key={'page_id': page_id},
-            UpdateExpression='ADD posts_count :dec',
-            ConditionExpression="posts_count > :zero",
-            ExpressionAttributeValues={':dec': -1,
-                                       ':zero': 0})
-    except ClientError as err:
-        logging.error(err.response['Error']['Code'])
+        await in_thread(partial(stats_store.add_history, page_id, deltas, datetime.now(timezone.utc)))
+    except Exception:
+        logging.exception('History of page %d was not changed', page_id)
 
 
 @inject()
-async def like_plus(page_id: int, db_table: TableResource) -> None:
+async def set_counters(page_id: int, counters: dict, stats_store: StatsStore, stats_cache: StatsCache,
+                       stats_updates: StatsBroadcaster) -> None:
     """
-    Function that increment count of likes on a specified page
+    Function that replace counters of a specified page with true values, e.g. after reconciliation with Innotter
     :param page_id: ID of page that would be changed
-    :param db_table: Table in DB in which we work
+    :param counters: Values of counters by field ('post', 'like', 'follower')
+    :param stats_store: Store of statistic in which we work
+    :param stats_cache: Cache of statistic, updated with the new values of counters
+    :param stats_updates: Pub/sub, that is notified about the change
+    """
+    stats = await in_thread(partial(stats_store.set_counters, page_id,
+                                    {COUNTERS[field]: value for field, value in counters.items()}))
+    _changed(page_id, stats, stats_cache, stats_updates)
+
+
+def _changed(page_id: int, stats: dict | None, stats_cache: StatsCache, stats_updates: StatsBroadcaster) -> None:
+    """
+    Keep the cache in sync with a change of page and notify subscribers about it
+    :param stats: New statistic of page, None if it is unknown
+    """
+    if stats is None:
+        stats_cache.invalidate(page_id)
+    else:
+        stats_cache.set(page_id, stats)
+    stats_updates.publish(page_id, stats)
+
+
+@inject()
+async def page_series(page_id: int, granularity: str, start: datetime, end: datetime,
+                      stats_store: StatsStore) -> list:
+    """
+    Function that return changes of page statistic per hour or day
+    :param page_id: ID of page that would be handled
+    :param granularity: 'hour' or 'day'
+    :param start: Moment in the first bucket of series
+    :param end: Moment in the last bucket of series
+    :param stats_store: Store of statistic in which we work
+    :return: Buckets in time order, with start of bucket and changes of counters, zero if nothing changed
+    :raise ValueError: If the range is reversed or too long
+    """
+    check_range(start, end, granularity)
+    buckets = await in_thread(partial(stats_store.history, page_id, granularity, start, end))
+    zero = dict.fromkeys(STORE_COUNTERS, 0)
+    return [{'start': bucket_start.isoformat(), **buckets.get(bucket_key(bucket_start, granularity), zero)}
+            for bucket_start in bucket_starts(start, end, granularity)]
+
+
+@inject()
+async def stats_events(page_id: int, stats_updates: StatsBroadcaster, sse_options: dict):
+    """
+    Server-sent events with statistic of page: the current one, then one after each change.
+    Changes that come within min_interval of the last event are sent together, a comment is sent
+    as heartbeat if nothing changed for heartbeat seconds
+    :param page_id: ID of page that would be handled
+    :param stats_updates: Pub/sub, that is notified about changes
+    :param sse_options: Seconds of heartbeat and min_interval
+    """
+    with stats_updates.subscribe(page_id) as subscription:
+        stats = await page_stats(page_id)
+        while True:
+            yield f'data: {json.dumps(stats, cls=DecimalEncoder)}\n\n'
+            await asyncio.sleep(sse_options['min_interval'])
+            while not await subscription.wait(sse_options['heartbeat']):
+                yield ': heartbeat\n\n'
+            stats = subscription.take() or await page_stats(page_id)
+
+
+@inject()
+def leaderboard(field: str, limit: int, leaderboards: Leaderboards) -> list:
+    """
+    Function that return pages with the highest counter
+    :param field: Counter by which pages are ranked ('post', 'like', 'follower')
+    :param limit: Number of pages, no more than the size of leaderboards
+    :param leaderboards: Leaderboards of every counter
+    :return: Ranked pages with the value of counter
+    """
+    counter = COUNTERS[field]
+    return [{'rank': rank, 'page_id': page_id, counter: value}
+            for rank, (page_id, value) in enumerate(leaderboards[counter].top(limit), start=1)]
+
+
+@inject()
+async def keep_leaderboards(leaderboards: Leaderboards, stats_store: StatsStore, leaderboard_options: dict) -> None:
+    """
+    Load leaderboards saved by the consumer every reload_interval seconds. Between loads they are kept
+    up to date with every change of statistic, so the store is never scanned by API processes
+    :param leaderboards: Leaderboards of every counter
+    :param stats_store: Store of statistic in which we work
+    :param leaderboard_options: Seconds of reload_interval
     """
-    db_table.update_item(
-        Key={'page_id': page_id},
-        UpdateExpression='ADD likes_count :inc',
-        ExpressionAttributeValues={':inc': 1})
+    while True:
+        for counter, board in leaderboards.boards.items():
+            try:
+                entries = await in_thread(partial(stats_store.load_leaderboard, counter))
+            except Exception:
+                logging.exception('Leaderboard of %s was not loaded', counter)
+                continue
+            if entries is not None:
+                board.load(entries)
+        await asyncio.sleep(leaderboard_options['reload_interval'])
 
 
 @inject()
-async def like_minus(page_id: int, db_table: TableResource) -> None:
+def restore_leaderboards(leaderboards: Leaderboards, stats_store: StatsStore) -> None:
+    """
+    Load saved leaderboards into the ones the consumer keeps with every change it applies.
+    A leaderboard that was never saved is built from statistic of every page and saved, once per store
+    :param leaderboards: Leaderboards of every counter
+    :param stats_store: Store of statistic in which we work
+    """
+    for counter, board in leaderboards.boards.items():
+        entries = stats_store.load_leaderboard(counter)
+        if entries is None:
+            logging.info('Leaderboard of %s was never saved, it is built from the store', counter)
+            entries = stats_store.top(counter, board.capacity)
+            stats_store.save_leaderboard(counter, entries)
+        board.load(entries)
+
+
+@inject()
+def save_leaderboards(leaderboards: Leaderboards, stats_store: StatsStore) -> None:
+    """
+    Save leaderboards kept by the consumer, with every tracked page, for API processes to load them
+    :param leaderboards: Leaderboards of every counter
+    :param stats_store: Store of statistic in which we work
+    """
+    for counter, board in leaderboards.boards.items():
+        stats_store.save_leaderboard(counter, board.ranking())
+
+
+@inject()
+def load_events(stats_store: StatsStore) -> list:
+    """
+    Function that return ids of events applied before a restart, that are still within the window of duplicates
+    :param stats_store: Store of statistic in which we work
+    :return: Pairs (event ID, expiry in seconds since epoch), oldest first
+    """
+    return stats_store.load_events()
+
+
+@inject()
+async def save_events(event_ids: list, expires_at: int, stats_store: StatsStore) -> None:
+    """
+    Function that remember ids of applied events, so they are dropped when delivered again after a restart
+    :param event_ids: IDs of events
+    :param expires_at: Time in seconds since epoch, until which they are remembered
+    :param stats_store: Store of statistic in which we work
+    """
+    if event_ids:
+        await in_thread(partial(stats_store.save_events, event_ids, expires_at))
+
+
+async def post_plus(page_id: int) -> None:
+    """
+    Function that increment count of posts on a specified page
+    :param page_id: ID of page that would be changed
+    """
+    await apply_deltas(page_id, {'post': 1})
+
+
+async def post_minus(page_id: int) -> None:
+    """
+    Function that decrement count of posts on a specified page
+    :param page_id: ID of page that would be changed
+    """
+    await apply_deltas(page_id, {'post': -1})
+
+
+async def like_plus(page_id: int) -> None:
+    """
+    Function that increment count of likes on a specified page
+    :param page_id: ID of page that would be changed
+    """
+    await apply_deltas(page_id, {'like': 1})
+
+
+async def like_minus(page_id: int) -> None:
     """
     Function that decrement count of likes on a specified page
     :param page_id: ID of page that would be changed
-    :param db_table: Table in DB in which we work
     """
-    try:
-        db_table.update_item(
-            Key={'page_id': page_id},
-            UpdateExpression='ADD likes_count :dec',
-            ConditionExpression="likes_count > :zero",
-            ExpressionAttributeValues={':dec': -1,
-                                       ':zero': 0})
-    except ClientError as err:
-        logging.error(err.response['Error']['Code'])
+    await apply_deltas(page_id, {'like': -1})
 
 
-@inject()
-async def follower_plus(page_id: int, db_table: TableResource) -> None:
+async def follower_plus(page_id: int) -> None:
     """
     Function that increment count of followers on a specified page
     :param page_id: ID of page that would be changed
-    :param db_table: Table in DB in which we work
     """
-
-    db_table.update_item(
-        Key={'page_id': page_id},
-        UpdateExpression='ADD followers_count :inc',
-        ExpressionAttributeValues={':inc': 1})
+    await apply_deltas(page_id, {'follower': 1})
 
 
-@inject()
-async def follower_minus(page_id: int, db_table: TableResource) -> None:
+async def follower_minus(page_id: int) -> None:
     """
     Function that decrement count of followers on a specified page
     :param page_id: ID of page that would be changed
-    :param db_table: Table in DB in which we work
     """
-    try:
-        db_table.update_item(
-            Key={'page_id': page_id},
-            UpdateExpression='ADD followers_count :dec',
-            ConditionExpression="followers_count > :zero",
-            ExpressionAttributeValues={':dec': -1,
-                                       ':zero': 0})
-    except ClientError as err:
-        logging.error(err.response['Error']['Code'])
+    await apply_deltas(page_id, {'follower': -1})
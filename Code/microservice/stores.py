@@ -0,0 +1,685 @@
+import heapq
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from datetime import datetime, timedelta
+
+from botocore.exceptions import ClientError
+from boto3.resources.base import ServiceResource
+from boto3.dynamodb.conditions import Attr, Key
+from boto3.dynamodb.table import TableResource
+
+from history import GRANULARITIES, bucket_key, floor
+
+COUNTERS = ('posts_count', 'likes_count', 'followers_count')
+BATCH_GET_LIMIT = 100
+BATCH_GET_RETRIES = 5
+CLAMP_RETRIES = 5
+HOURLY_RETENTION = timedelta(days=7)
+
+
+def empty_stats(page_id: int) -> dict:
+    return {'page_id': page_id, **{counter: 0 for counter in COUNTERS}}
+
+
+class StatsStore(ABC):
+    """
+    Storage of page statistic. Methods are blocking, services run them on the pool of DB threads.
+    Counters never go below zero: a decrement larger than a counter sets it to zero
+    """
+
+    @abstractmethod
+    def get(self, page_id: int) -> dict | None:
+        """
+        Statistic of page, None if page has no statistic
+        """
+
+    @abstractmethod
+    def get_many(self, page_ids: list) -> dict:
+        """
+        Statistic of several pages by ID of page, None for pages without statistic.
+        Pages that could not be read are left out
+        """
+
+    @abstractmethod
+    def create_page(self, page_id: int) -> dict:
+        """
+        Create zero counters of page and return them
+        """
+
+    @abstractmethod
+    def delete_page(self, page_id: int) -> None:
+        pass
+
+    @abstractmethod
+    def apply_deltas(self, page_id: int, deltas: dict) -> dict | None:
+        """
+        Add deltas to counters of page
+        :param deltas: Changes by name of counter ('posts_count', 'likes_count', 'followers_count')
+        :return: New statistic of page, None if it is unknown
+        """
+
+    @abstractmethod
+    def set_counters(self, page_id: int, counters: dict) -> dict | None:
+        """
+        Replace counters of page with given values
+        :param counters: Values by name of counter
+        :return: New statistic of page, None if it is unknown
+        """
+
+    @abstractmethod
+    def add_history(self, page_id: int, deltas: dict, moment: datetime) -> None:
+        """
+        Add deltas to the hourly and the daily bucket of page, that contain the moment.
+        Hourly buckets expire after the retention of store, daily buckets are kept
+        """
+
+    @abstractmethod
+    def history(self, page_id: int, granularity: str, start: datetime, end: datetime) -> dict:
+        """
+        Deltas of page by key of bucket, for buckets between two moments. Buckets without changes are left out
+        """
+
+    @abstractmethod
+    def top(self, counter: str, limit: int) -> list:
+        """
+        Pages with the highest values of counter. It may read statistic of every page,
+        so it is only used to build a leaderboard that was never saved
+        :return: Pairs (page ID, value) in descending order of value
+        """
+
+    @abstractmethod
+    def load_leaderboard(self, counter: str) -> list | None:
+        """
+        Saved leaderboard of counter, as pairs (page ID, value), None if it was never saved
+        """
+
+    @abstractmethod
+    def save_leaderboard(self, counter: str, entries: list) -> None:
+        pass
+
+    @abstractmethod
+    def load_events(self) -> list:
+        """
+        Ids of applied events that have not expired, as pairs (event ID, expiry in seconds since epoch), oldest first
+        """
+
+    @abstractmethod
+    def save_events(self, event_ids: list, expires_at: int) -> None:
+        """
+        Remember ids of applied events until expires_at, in seconds since epoch
+        """
+
+    @staticmethod
+    def _expires_at(moment: datetime, retention: timedelta) -> int:
+        return int((floor(moment, 'hour') + retention).timestamp())
+
+
+class DynamoStatsStore(StatsStore):
+    """
+    Statistic kept in a DynamoDB table, one item per page.
+    With a table of shards, a page written more than promote_rate times a second is promoted to sharded
+    counters: the item of page gets a 'shards' attribute, its later changes are spread over items
+    'page_id#shard' of the shards table, and statistic of page is the sum of its item and its shards
+    """
+
+    def __init__(self, database: ServiceResource, table: TableResource, shards_table: TableResource = None,
+                 shard_count: int = 8, promote_rate: int = 50, history_table: TableResource = None,
+                 hourly_retention: timedelta = HOURLY_RETENTION, leaderboard_table: TableResource = None,
+                 events_table: TableResource = None) -> None:
+        self.database = database
+        self.table = table
+        self.leaderboard_table = leaderboard_table
+        self.events_table = events_table
+        self.history_table = history_table
+        self.hourly_retention = hourly_retention
+        self.shards_table = shards_table
+        self.shard_count = shard_count
+        self.promote_rate = promote_rate
+        self.sharded = {}
+        self.lock = threading.Lock()
+        self.second = None
+        self.writes = Counter()
+
+    def get(self, page_id: int) -> dict | None:
+        stats = self._add_shards({page_id: self.table.get_item(Key={'page_id': page_id}).get('Item')})
+        if page_id not in stats:
+            raise LookupError(f'Shards of page {page_id} were not read')
+        return stats[page_id]
+
+    def get_many(self, page_ids: list) -> dict:
+        stats = dict.fromkeys(page_ids)
+        items, unread = self._batch_get(self.table, [{'page_id': page_id} for page_id in page_ids])
+        for item in items:
+            stats[int(item['page_id'])] = item
+        for key in unread:
+            del stats[key['page_id']]
+        return self._add_shards(stats)
+
+    def _batch_get(self, table: TableResource, keys: list) -> tuple[list, list]:
+        """
+        Read items by keys with BatchGetItem, retrying unprocessed keys with backoff
+        :return: Items that were read and keys that were not
+        """
+        items, unread = [], []
+        for start in range(0, len(keys), BATCH_GET_LIMIT):
+            chunk = keys[start:start + BATCH_GET_LIMIT]
+            for attempt in range(BATCH_GET_RETRIES):
+                response = self.database.batch_get_item(RequestItems={table.name: {'Keys': chunk}})
+                items.extend(response['Responses'].get(table.name, []))
+                chunk = response.get('UnprocessedKeys', {}).get(table.name, {}).get('Keys')
+                if not chunk:
+                    break
+                time.sleep(0.05 * 2 ** attempt)
+            else:
+                logging.error('%d items of %s were not read', len(chunk), table.name)
+                unread.extend(chunk)
+        return items, unread
+
+    def _add_shards(self, stats: dict) -> dict:
+        """
+        Add counters of shards to statistic of sharded pages. Pages with shards that could not be read are left out
+        """
+        sharded = {page_id: int(item['shards']) for page_id, item in stats.items() if item and 'shards' in item}
+        if not sharded or self.shards_table is None:
+            return stats
+        with self.lock:
+            self.sharded.update(sharded)
+        items, unread = self._batch_get(self.shards_table, [{'shard_id': f'{page_id}#{shard}'}
+                                                            for page_id, shards in sharded.items()
+                                                            for shard in range(shards)])
+        for page_id in sharded:
+            stats[page_id] = {'page_id': page_id, **{counter: stats[page_id].get(counter, 0) for counter in COUNTERS}}
+        for item in items:
+            for counter in COUNTERS:
+                stats[int(item['page_id'])][counter] += item.get(counter, 0)
+        for key in unread:
+            stats.pop(int(key['shard_id'].split('#')[0]), None)
+        return stats
+
+    def create_page(self, page_id: int) -> dict:
+        stats = empty_stats(page_id)
+        self.table.put_item(Item=stats)
+        with self.lock:
+            self.sharded.pop(page_id, None)
+        return stats
+
+    def delete_page(self, page_id: int) -> None:
+        item = self.table.delete_item(Key={'page_id': page_id}, ReturnValues='ALL_OLD').get('Attributes', {})
+        with self.lock:
+            self.sharded.pop(page_id, None)
+        if 'shards' in item and self.shards_table is not None:
+            with self.shards_table.batch_writer() as batch:
+                for shard in range(int(item['shards'])):
+                    batch.delete_item(Key={'shard_id': f'{page_id}#{shard}'})
+        if self.history_table is not None:
+            with self.history_table.batch_writer() as batch:
+                for bucket in self._query_history(page_id, ProjectionExpression='bucket'):
+                    batch.delete_item(Key={'page_id': page_id, 'bucket': bucket['bucket']})
+
+    def apply_deltas(self, page_id: int, deltas: dict) -> dict | None:
+        """
+        Apply all deltas in a single update. If a decrement guard fails, they are applied again in a single
+        update that clamps counters at zero. Changes of sharded pages go to one of their shards.
+        Errors other than a failed guard, e.g. throttling, are raised, so the change is delivered again
+        """
+        with self.lock:
+            shards = self.sharded.get(page_id)
+        if shards and self.shards_table is not None:
+            self._apply_to_shard(page_id, shards, deltas)
+            return None
+        try:
+            stats = self.table.update_item(Key={'page_id': page_id}, ReturnValues='ALL_NEW',
+                                           **self._update(deltas))['Attributes']
+        except ClientError as err:
+            if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            stats = self._clamp(self.table, {'page_id': page_id}, deltas)[1]
+        if 'shards' in stats:
+            with self.lock:
+                self.sharded[page_id] = int(stats['shards'])
+            return None
+        self._count_write(page_id)
+        return stats
+
+    @staticmethod
+    def _clamp(table: TableResource, key: dict, deltas: dict, attributes: dict = None) -> tuple[dict, dict]:
+        """
+        Apply deltas in a single update conditioned on the counters read before it, setting counters that would go
+        below zero to zero. The update is tried again while the counters are changed concurrently
+        :param attributes: Other attributes set by the update
+        :return: Item before and after the update
+        """
+        for attempt in range(CLAMP_RETRIES):
+            item = table.get_item(Key=key, ConsistentRead=True).get('Item', {})
+            values = {counter: max(int(item.get(counter, 0)) + delta, 0) for counter, delta in deltas.items()}
+            if all(item.get(counter) == value for counter, value in values.items()):
+                return item, item
+            values.update(attributes or {})
+            try:
+                response = table.update_item(
+                    Key=key, ReturnValues='ALL_NEW',
+                    UpdateExpression='SET ' + ', '.join(f'{name} = :{name}' for name in values),
+                    ConditionExpression=' AND '.join(f'{counter} = :{counter}_read' if counter in item
+                                                     else f'attribute_not_exists({counter})' for counter in deltas),
+                    ExpressionAttributeValues={**{f':{name}': value for name, value in values.items()},
+                                               **{f':{counter}_read': item[counter]
+                                                  for counter in deltas if counter in item}})
+                return item, response['Attributes']
+            except ClientError as err:
+                if err.response['Error']['Code'] != 'ConditionalCheckFailedException' or attempt == CLAMP_RETRIES - 1:
+                    raise
+
+    def _count_write(self, page_id: int) -> None:
+        """
+        Count writes of page during the current second, promoting the page once it is written too often.
+        It runs after the change is applied, so a failed promotion is only logged and tried on a later write
+        """
+        if self.shards_table is None:
+            return
+        second = int(time.monotonic())
+        with self.lock:
+            if second != self.second:
+                self.second = second
+                self.writes.clear()
+            self.writes[page_id] += 1
+            if self.writes[page_id] < self.promote_rate:
+                return
+        try:
+            response = self.table.update_item(Key={'page_id': page_id},
+                                              UpdateExpression='SET shards = if_not_exists(shards, :shards)',
+                                              ExpressionAttributeValues={':shards': self.shard_count},
+                                              ReturnValues='UPDATED_NEW')
+        except ClientError as err:
+            logging.error('Page %d is not promoted: %s', page_id, err.response['Error']['Code'])
+            return
+        logging.info('Page %d is promoted to sharded counters', page_id)
+        with self.lock:
+            self.sharded[page_id] = int(response['Attributes']['shards'])
+
+    def _apply_to_shard(self, page_id: int, shards: int, deltas: dict) -> None:
+        """
+        Apply deltas to a random shard. A decrement that doesn't fit in that shard is taken from the shards
+        in turn and then from the item of page, clamping each of them at zero, so counters of page still never go
+        below zero. Errors other than a failed guard are raised
+        """
+        first = random.randrange(shards)
+        try:
+            self.shards_table.update_item(Key={'shard_id': f'{page_id}#{first}'}, **self._shard_update(page_id, deltas))
+            return
+        except ClientError as err:
+            if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+        increments = {counter: delta for counter, delta in deltas.items() if delta > 0}
+        if increments:
+            self.shards_table.update_item(Key={'shard_id': f'{page_id}#{first}'},
+                                          **self._shard_update(page_id, increments))
+        for counter, delta in deltas.items():
+            remaining = -delta
+            for shard in [*range(first, shards), *range(first)]:
+                if remaining <= 0:
+                    break
+                item = self._clamp(self.shards_table, {'shard_id': f'{page_id}#{shard}'}, {counter: -remaining},
+                                   {'page_id': page_id})[0]
+                remaining -= min(int(item.get(counter, 0)), remaining)
+            if remaining > 0:
+                self._clamp(self.table, {'page_id': page_id}, {counter: -remaining})
+
+    def set_counters(self, page_id: int, counters: dict) -> dict | None:
+        """
+        Set counters on the item of page. Shards of a sharded page are reset to zero
+        """
+        response = self.table.update_item(Key={'page_id': page_id}, ReturnValues='ALL_NEW',
+                                          UpdateExpression='SET ' + ', '.join(f'{counter} = :{counter}'
+                                                                              for counter in counters),
+                                          ExpressionAttributeValues={f':{counter}': value
+                                                                     for counter, value in counters.items()})
+        stats = response['Attributes']
+        if 'shards' not in stats or self.shards_table is None:
+            return stats
+        for shard in range(int(stats['shards'])):
+            self.shards_table.update_item(Key={'shard_id': f'{page_id}#{shard}'},
+                                          UpdateExpression='SET page_id = :page_id, '
+                                                           + ', '.join(f'{counter} = :zero' for counter in counters),
+                                          ExpressionAttributeValues={':page_id': page_id, ':zero': 0})
+        return None
+
+    def add_history(self, page_id: int, deltas: dict, moment: datetime) -> None:
+        if self.history_table is None:
+            return
+        for granularity in GRANULARITIES:
+            update = {
+                'UpdateExpression': 'ADD ' + ', '.join(f'{counter} :{counter}' for counter in deltas),
+                'ExpressionAttributeValues': {f':{counter}': delta for counter, delta in deltas.items()},
+            }
+            if granularity == 'hour':
+                update['UpdateExpression'] = 'SET expires_at = :expires_at ' + update['UpdateExpression']
+                update['ExpressionAttributeValues'][':expires_at'] = self._expires_at(moment, self.hourly_retention)
+            self.history_table.update_item(Key={'page_id': page_id, 'bucket': bucket_key(moment, granularity)},
+                                           **update)
+
+    def history(self, page_id: int, granularity: str, start: datetime, end: datetime) -> dict:
+        """
+        Query buckets of page by range of their keys. Expired hourly buckets, that DynamoDB has not removed yet,
+        are skipped
+        """
+        if self.history_table is None:
+            return {}
+        now = time.time()
+        return {item['bucket']: {counter: item.get(counter, 0) for counter in COUNTERS}
+                for item in self._query_history(page_id, bucket_key(start, granularity), bucket_key(end, granularity))
+                if item.get('expires_at', now) >= now}
+
+    def _query_history(self, page_id: int, first: str = None, last: str = None, **kwargs):
+        condition = Key('page_id').eq(page_id)
+        if first is not None:
+            condition &= Key('bucket').between(first, last)
+        while True:
+            response = self.history_table.query(KeyConditionExpression=condition, **kwargs)
+            yield from response['Items']
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def top(self, counter: str, limit: int) -> list:
+        """
+        Scan the table keeping only limit best pages in memory. Sharded pages are summed with their shards after the scan
+        """
+        best, sharded = [], []
+        kwargs = {'ProjectionExpression': 'page_id, #counter, shards', 'ExpressionAttributeNames': {'#counter': counter}}
+        while True:
+            response = self.table.scan(**kwargs)
+            for item in response['Items']:
+                if 'shards' in item:
+                    sharded.append(int(item['page_id']))
+                    continue
+                entry = (int(item.get(counter, 0)), int(item['page_id']))
+                if len(best) < limit:
+                    heapq.heappush(best, entry)
+                else:
+                    heapq.heappushpop(best, entry)
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        for page_id, stats in self.get_many(sharded).items():
+            if stats is not None:
+                heapq.heappush(best, (int(stats[counter]), page_id))
+        return [(page_id, value) for value, page_id in heapq.nlargest(limit, best)]
+
+    def load_leaderboard(self, counter: str) -> list | None:
+        if self.leaderboard_table is None:
+            return None
+        item = self.leaderboard_table.get_item(Key={'counter': counter}).get('Item')
+        return [(int(page_id), int(value)) for page_id, value in item['entries']] if item else None
+
+    def save_leaderboard(self, counter: str, entries: list) -> None:
+        if self.leaderboard_table is not None:
+            self.leaderboard_table.put_item(Item={'counter': counter, 'entries': [list(entry) for entry in entries]})
+
+    def load_events(self) -> list:
+        """
+        Scan the table of events, that DynamoDB keeps small by removing expired items. It is only done at startup
+        """
+        if self.events_table is None:
+            return []
+        events, kwargs = [], {'FilterExpression': Attr('expires_at').gte(int(time.time()))}
+        while True:
+            response = self.events_table.scan(**kwargs)
+            events += [(item['event_id'], int(item['expires_at'])) for item in response['Items']]
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        return sorted(events, key=lambda event: event[1])
+
+    def save_events(self, event_ids: list, expires_at: int) -> None:
+        if self.events_table is None:
+            return
+        with self.events_table.batch_writer(overwrite_by_pkeys=['event_id']) as batch:
+            for event_id in event_ids:
+                batch.put_item(Item={'event_id': event_id, 'expires_at': expires_at})
+
+    def _shard_update(self, page_id: int, deltas: dict) -> dict:
+        update = self._update(deltas)
+        update['UpdateExpression'] = 'SET page_id = :page_id ' + update['UpdateExpression']
+        update['ExpressionAttributeValues'][':page_id'] = page_id
+        return update
+
+    @staticmethod
+    def _update(deltas: dict) -> dict:
+        """
+        Build arguments of update_item that add deltas to counters, guarding decrements
+        """
+        update = {
+            'UpdateExpression': 'ADD ' + ', '.join(f'{counter} :{counter}' for counter in deltas),
+            'ExpressionAttributeValues': {f':{counter}': delta for counter, delta in deltas.items()},
+        }
+        conditions = [f'{counter} >= :{counter}_min' for counter, delta in deltas.items() if delta < 0]
+        if conditions:
+            update['ConditionExpression'] = ' AND '.join(conditions)
+            update['ExpressionAttributeValues'].update(
+                {f':{counter}_min': -delta for counter, delta in deltas.items() if delta < 0})
+        return update
+
+
+class MemoryStatsStore(StatsStore):
+    """
+    Statistic kept in a dict of this process, for load tests and benchmarks
+    """
+
+    def __init__(self, hourly_retention: timedelta = HOURLY_RETENTION) -> None:
+        self.items = {}
+        self.buckets = {}
+        self.leaderboards = {}
+        self.events = {}
+        self.hourly_retention = hourly_retention
+        self.lock = threading.Lock()
+
+    def get(self, page_id: int) -> dict | None:
+        with self.lock:
+            stats = self.items.get(page_id)
+            return dict(stats) if stats else None
+
+    def get_many(self, page_ids: list) -> dict:
+        return {page_id: self.get(page_id) for page_id in page_ids}
+
+    def create_page(self, page_id: int) -> dict:
+        with self.lock:
+            self.items[page_id] = empty_stats(page_id)
+            return dict(self.items[page_id])
+
+    def delete_page(self, page_id: int) -> None:
+        with self.lock:
+            self.items.pop(page_id, None)
+            self.buckets.pop(page_id, None)
+
+    def apply_deltas(self, page_id: int, deltas: dict) -> dict | None:
+        with self.lock:
+            stats = self.items.setdefault(page_id, empty_stats(page_id))
+            for counter, delta in deltas.items():
+                stats[counter] = max(stats[counter] + delta, 0)
+            return dict(stats)
+
+    def set_counters(self, page_id: int, counters: dict) -> dict | None:
+        with self.lock:
+            stats = self.items.setdefault(page_id, empty_stats(page_id))
+            stats.update(counters)
+            return dict(stats)
+
+    def add_history(self, page_id: int, deltas: dict, moment: datetime) -> None:
+        now = time.time()
+        with self.lock:
+            buckets = self.buckets.setdefault(page_id, {})
+            for key in [key for key, bucket in buckets.items() if bucket.get('expires_at', now) < now]:
+                del buckets[key]
+            for granularity in GRANULARITIES:
+                bucket = buckets.setdefault(bucket_key(moment, granularity), dict.fromkeys(COUNTERS, 0))
+                for counter, delta in deltas.items():
+                    bucket[counter] += delta
+                if granularity == 'hour':
+                    bucket['expires_at'] = self._expires_at(moment, self.hourly_retention)
+
+    def history(self, page_id: int, granularity: str, start: datetime, end: datetime) -> dict:
+        first, last, now = bucket_key(start, granularity), bucket_key(end, granularity), time.time()
+        with self.lock:
+            return {key: {counter: bucket[counter] for counter in COUNTERS}
+                    for key, bucket in self.buckets.get(page_id, {}).items()
+                    if first <= key <= last and bucket.get('expires_at', now) >= now}
+
+    def top(self, counter: str, limit: int) -> list:
+        with self.lock:
+            best = heapq.nlargest(limit, self.items.items(), key=lambda item: item[1][counter])
+            return [(page_id, stats[counter]) for page_id, stats in best]
+
+    def load_leaderboard(self, counter: str) -> list | None:
+        with self.lock:
+            return self.leaderboards.get(counter)
+
+    def save_leaderboard(self, counter: str, entries: list) -> None:
+        with self.lock:
+            self.leaderboards[counter] = list(entries)
+
+    def load_events(self) -> list:
+        now = time.time()
+        with self.lock:
+            return sorted(((event_id, expires_at) for event_id, expires_at in self.events.items() if expires_at >= now),
+                          key=lambda event: event[1])
+
+    def save_events(self, event_ids: list, expires_at: int) -> None:
+        now = time.time()
+        with self.lock:
+            for event_id in [event_id for event_id, expires in self.events.items() if expires < now]:
+                del self.events[event_id]
+            self.events.update(dict.fromkeys(event_ids, expires_at))
+
+
+class SQLiteStatsStore(StatsStore):
+    """
+    Statistic kept in a SQLite file in WAL mode, for small deployments without DynamoDB.
+    Every thread has its own connection, so reads don't wait for writes
+    """
+
+    def __init__(self, path: str = 'statistic.sqlite3', hourly_retention: timedelta = HOURLY_RETENTION) -> None:
+        self.path = path
+        self.hourly_retention = hourly_retention
+        self.purged_at = 0
+        self.local = threading.local()
+        counters = ', '.join(f'{counter} INTEGER NOT NULL DEFAULT 0' for counter in COUNTERS)
+        with self.connection() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(f'CREATE TABLE IF NOT EXISTS statistic (page_id INTEGER PRIMARY KEY, {counters})')
+            connection.execute(f'CREATE TABLE IF NOT EXISTS history (page_id INTEGER, bucket TEXT, {counters}, '
+                               f'expires_at INTEGER, PRIMARY KEY (page_id, bucket))')
+            connection.execute('CREATE TABLE IF NOT EXISTS leaderboard (counter TEXT PRIMARY KEY, entries TEXT)')
+            connection.execute('CREATE TABLE IF NOT EXISTS events (event_id TEXT PRIMARY KEY, expires_at INTEGER)')
+
+    def connection(self) -> sqlite3.Connection:
+        if not hasattr(self.local, 'connection'):
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return self.local.connection
+
+    def get(self, page_id: int) -> dict | None:
+        row = self.connection().execute('SELECT * FROM statistic WHERE page_id = ?', (page_id,)).fetchone()
+        return dict(row) if row else None
+
+    def get_many(self, page_ids: list) -> dict:
+        stats = dict.fromkeys(page_ids)
+        for start in range(0, len(page_ids), BATCH_GET_LIMIT):
+            chunk = page_ids[start:start + BATCH_GET_LIMIT]
+            rows = self.connection().execute(
+                f'SELECT * FROM statistic WHERE page_id IN ({", ".join("?" * len(chunk))})', chunk)
+            stats.update((row['page_id'], dict(row)) for row in rows)
+        return stats
+
+    def create_page(self, page_id: int) -> dict:
+        with self.connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO statistic (page_id) VALUES (?)', (page_id,))
+        return empty_stats(page_id)
+
+    def delete_page(self, page_id: int) -> None:
+        with self.connection() as connection:
+            connection.execute('DELETE FROM statistic WHERE page_id = ?', (page_id,))
+            connection.execute('DELETE FROM history WHERE page_id = ?', (page_id,))
+
+    def apply_deltas(self, page_id: int, deltas: dict) -> dict | None:
+        counters = [counter for counter in deltas if counter in COUNTERS]
+        with self.connection() as connection:
+            connection.execute(
+                f'INSERT INTO statistic (page_id, {", ".join(counters)}) '
+                f'VALUES (:page_id, {", ".join(f"MAX(:{counter}, 0)" for counter in counters)}) '
+                f'ON CONFLICT (page_id) DO UPDATE SET '
+                + ', '.join(f'{counter} = MAX({counter} + :{counter}, 0)' for counter in counters),
+                {'page_id': page_id, **{counter: deltas[counter] for counter in counters}})
+        return self.get(page_id)
+
+    def set_counters(self, page_id: int, counters: dict) -> dict | None:
+        counters = {counter: value for counter, value in counters.items() if counter in COUNTERS}
+        with self.connection() as connection:
+            connection.execute(
+                f'INSERT INTO statistic (page_id, {", ".join(counters)}) '
+                f'VALUES (:page_id, {", ".join(f":{counter}" for counter in counters)}) '
+                f'ON CONFLICT (page_id) DO UPDATE SET '
+                + ', '.join(f'{counter} = :{counter}' for counter in counters),
+                {'page_id': page_id, **counters})
+        return self.get(page_id)
+
+    def add_history(self, page_id: int, deltas: dict, moment: datetime) -> None:
+        """
+        Add deltas to buckets with upserts, removing expired hourly buckets once an hour
+        """
+        counters = [counter for counter in deltas if counter in COUNTERS]
+        now = time.time()
+        with self.connection() as connection:
+            if now - self.purged_at >= 3600:
+                self.purged_at = now
+                connection.execute('DELETE FROM history WHERE expires_at < ?', (now,))
+            for granularity in GRANULARITIES:
+                connection.execute(
+                    f'INSERT INTO history (page_id, bucket, expires_at, {", ".join(counters)}) '
+                    f'VALUES (:page_id, :bucket, :expires_at, {", ".join(f":{counter}" for counter in counters)}) '
+                    f'ON CONFLICT (page_id, bucket) DO UPDATE SET '
+                    + ', '.join(f'{counter} = {counter} + :{counter}' for counter in counters),
+                    {'page_id': page_id, 'bucket': bucket_key(moment, granularity),
+                     'expires_at': self._expires_at(moment, self.hourly_retention) if granularity == 'hour' else None,
+                     **{counter: deltas[counter] for counter in counters}})
+
+    def history(self, page_id: int, granularity: str, start: datetime, end: datetime) -> dict:
+        rows = self.connection().execute(
+            'SELECT * FROM history WHERE page_id = ? AND bucket BETWEEN ? AND ? '
+            'AND (expires_at IS NULL OR expires_at >= ?)',
+            (page_id, bucket_key(start, granularity), bucket_key(end, granularity), time.time()))
+        return {row['bucket']: {counter: row[counter] for counter in COUNTERS} for row in rows}
+
+    def top(self, counter: str, limit: int) -> list:
+        if counter not in COUNTERS:
+            raise ValueError(f'Unknown counter {counter}')
+        rows = self.connection().execute(f'SELECT page_id, {counter} FROM statistic ORDER BY {counter} DESC LIMIT ?',
+                                         (limit,))
+        return [tuple(row) for row in rows]
+
+    def load_leaderboard(self, counter: str) -> list | None:
+        row = self.connection().execute('SELECT entries FROM leaderboard WHERE counter = ?', (counter,)).fetchone()
+        return [tuple(entry) for entry in json.loads(row['entries'])] if row else None
+
+    def save_leaderboard(self, counter: str, entries: list) -> None:
+        with self.connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO leaderboard (counter, entries) VALUES (?, ?)',
+                               (counter, json.dumps(entries)))
+
+    def load_events(self) -> list:
+        rows = self.connection().execute('SELECT event_id, expires_at FROM events WHERE expires_at >= ? '
+                                         'ORDER BY expires_at', (time.time(),))
+        return [tuple(row) for row in rows]
+
+    def save_events(self, event_ids: list, expires_at: int) -> None:
+        with self.connection() as connection:
+            connection.execute('DELETE FROM events WHERE expires_at < ?', (time.time(),))
+            connection.executemany('INSERT OR REPLACE INTO events (event_id, expires_at) VALUES (?, ?)',
+                                   [(event_id, expires_at) for event_id in event_ids])
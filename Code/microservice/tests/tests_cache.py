@@ -0,0 +1,30 @@
+import time
+from unittest import TestCase
+
+from cache import StatsCache
+
+
+class StatsCacheTestCase(TestCase):
+    def test_least_recently_used_pages_are_evicted(self):
+        cache = StatsCache(max_size=2)
+        cache.set(1, {'page_id': 1})
+        cache.set(2, {'page_id': 2})
+        cache.get(1)
+        cache.set(3, {'page_id': 3})
+        self.assertEqual([cache.get(page_id) is not None for page_id in (1, 2, 3)], [True, False, True])
+        self.assertEqual(cache.info()['evictions'], 1)
+
+    def test_read_does_not_overwrite_change_made_during_it(self):
+        cache = StatsCache()
+        read_at = time.monotonic()
+        cache.set(1, {'likes_count': 2})
+        cache.invalidate(2)
+        cache.fill(1, {'likes_count': 1}, read_at)
+        cache.fill(2, {'likes_count': 1}, read_at)
+        cache.fill(3, {'likes_count': 1}, read_at)
+        self.assertEqual([cache.get(page_id) for page_id in (1, 2, 3)], [{'likes_count': 2}, None, {'likes_count': 1}])
+
+    def test_old_reads_are_not_cached(self):
+        cache = StatsCache(ttl=30)
+        cache.fill(1, {'likes_count': 1}, time.monotonic() - 30)
+        self.assertIsNone(cache.get(1))
@@ -0,0 +1,63 @@
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from coalescer import Coalescer, pages_of
+
+
+class CoalescerTestCase(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.calls = []
+        self.failing = set()
+        for name in ('new_page', 'set_counters', 'apply_deltas', 'delete_page'):
+            patcher = patch(f'services.{name}', self.recorder(name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.coalescer = Coalescer(max_messages=10, max_delay=1)
+
+    def recorder(self, name):
+        async def update(page_id, *args):
+            self.calls.append((name, page_id, *args))
+            if (name, page_id) in self.failing:
+                raise RuntimeError(name)
+        return update
+
+    async def test_stages_are_applied_in_order(self):
+        self.coalescer.add({'field': 'page', 'action': 'delete', 'page': 4}, 1)
+        self.coalescer.add({'field': 'like', 'action': 'plus', 'page': 1}, 2)
+        self.coalescer.add({'field': 'batch', 'action': 'set', 'counters': {'3': {'post': 5}}}, 3)
+        self.coalescer.add({'field': 'page', 'action': 'new', 'page': 2}, 4)
+        self.assertEqual(await self.coalescer.flush(), set())
+        self.assertEqual(self.calls, [('new_page', 2), ('set_counters', 3, {'post': 5}),
+                                      ('apply_deltas', 1, {'like': 1}), ('delete_page', 4)])
+        self.assertEqual(len(self.coalescer), 0)
+
+    async def test_changes_are_merged_per_page(self):
+        self.coalescer.add({'field': 'like', 'action': 'plus', 'page': 1}, 1)
+        self.coalescer.add({'field': 'batch', 'action': 'apply', 'new': [],
+                            'deltas': {'1': {'like': 2, 'post': 1}}, 'deleted': []}, 2)
+        self.coalescer.add({'field': 'batch', 'action': 'set', 'counters': {'1': {'post': 7}}}, 3)
+        await self.coalescer.flush()
+        self.assertEqual(self.calls, [('set_counters', 1, {'post': 7}), ('apply_deltas', 1, {'like': 3})])
+
+    async def test_new_and_deleted_pages_drop_earlier_changes(self):
+        self.coalescer.add({'field': 'like', 'action': 'plus', 'page': 1}, 1)
+        self.coalescer.add({'field': 'page', 'action': 'new', 'page': 1}, 2)
+        self.coalescer.add({'field': 'post', 'action': 'plus', 'page': 2}, 3)
+        self.coalescer.add({'field': 'page', 'action': 'delete', 'page': 2}, 4)
+        await self.coalescer.flush()
+        self.assertEqual(self.calls, [('new_page', 1), ('delete_page', 2)])
+
+    async def test_failed_page_is_not_changed_further(self):
+        self.failing.add(('new_page', 1))
+        self.coalescer.add({'field': 'page', 'action': 'new', 'page': 1}, 1)
+        self.coalescer.add({'field': 'like', 'action': 'plus', 'page': 1}, 2)
+        self.coalescer.add({'field': 'like', 'action': 'plus', 'page': 2}, 3)
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(await self.coalescer.flush(), {1})
+        self.assertEqual(self.calls, [('new_page', 1), ('apply_deltas', 2, {'like': 1})])
+
+    def test_pages_of_messages(self):
+        self.assertEqual(pages_of({'field': 'batch', 'action': 'apply', 'new': ['1'],
+                                   'deltas': {'2': {'like': 1}}, 'deleted': ['3']}), {1, 2, 3})
+        self.assertEqual(pages_of({'field': 'like', 'action': 'plus', 'page': '4'}), {4})
+        self.assertEqual(pages_of({'field': 'unknown'}), set())
@@ -0,0 +1,63 @@
+from unittest import TestCase
+from unittest.mock import MagicMock, call
+
+from consumer import AckTracker, split
+
+
+class AckTrackerTestCase(TestCase):
+    def setUp(self):
+        self.settled = []
+        self.tracker = AckTracker(on_settled=lambda delivery_tag, applied: self.settled.append((delivery_tag, applied)))
+        self.tracker.channel = self.channel = MagicMock()
+
+    def test_messages_are_acked_in_delivery_order(self):
+        for delivery_tag in (1, 2, 3):
+            self.tracker.track(delivery_tag)
+        self.tracker.done(2)
+        self.channel.basic_ack.assert_not_called()
+        self.tracker.done(1)
+        self.channel.basic_ack.assert_called_once_with(delivery_tag=2, multiple=True)
+        self.tracker.done(3)
+        self.channel.basic_ack.assert_called_with(delivery_tag=3, multiple=True)
+        self.assertEqual(len(self.tracker), 0)
+        self.assertEqual(self.settled, [(2, True), (1, True), (3, True)])
+
+    def test_messages_after_nacked_one_are_acked_one_by_one(self):
+        for delivery_tag in (1, 2, 3, 4):
+            self.tracker.track(delivery_tag)
+        self.tracker.done(3)
+        self.tracker.done(4)
+        self.tracker.failed(2)
+        self.channel.basic_nack.assert_called_once_with(delivery_tag=2, requeue=True)
+        self.channel.basic_ack.assert_not_called()
+        self.tracker.done(1)
+        self.assertEqual(self.channel.basic_ack.call_args_list,
+                         [call(delivery_tag=1, multiple=True), call(delivery_tag=3), call(delivery_tag=4)])
+        self.assertIn((2, False), self.settled)
+
+    def test_message_is_settled_when_all_parts_are_done(self):
+        self.tracker.track(1, parts=2)
+        self.tracker.failed(1)
+        self.channel.basic_nack.assert_not_called()
+        self.tracker.done(1)
+        self.channel.basic_nack.assert_called_once_with(delivery_tag=1, requeue=True)
+        self.channel.basic_ack.assert_not_called()
+        self.assertEqual(self.settled, [(1, False)])
+
+    def test_unknown_delivery_tag_is_ignored(self):
+        self.tracker.done(5)
+        self.channel.basic_ack.assert_not_called()
+        self.assertEqual(self.settled, [])
+
+
+class SplitTestCase(TestCase):
+    def test_pages_are_split_by_worker(self):
+        parts = split({'field': 'batch', 'action': 'apply', 'new': ['2'],
+                       'deltas': {'1': {'like': 1}, '3': {'post': 1}}, 'deleted': []}, 2)
+        self.assertEqual(parts, {
+            0: {'field': 'batch', 'action': 'apply', 'new': ['2'], 'deltas': {}, 'deleted': []},
+            1: {'field': 'batch', 'action': 'apply', 'new': [], 'deltas': {'1': {'like': 1}, '3': {'post': 1}},
+                'deleted': []},
+        })
+        self.assertEqual(split({'field': 'like', 'action': 'plus', 'page': 5}, 4),
+                         {1: {'field': 'like', 'action': 'plus', 'page': 5}})
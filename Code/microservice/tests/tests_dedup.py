@@ -0,0 +1,45 @@
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from dedup import RecentEvents
+
+
+class RecentEventsTestCase(TestCase):
+    def test_events_are_seen_once(self):
+        events = RecentEvents()
+        self.assertFalse(events.seen('a'))
+        self.assertTrue(events.seen('a'))
+        self.assertIn('a', events)
+
+    def test_oldest_events_are_evicted(self):
+        events = RecentEvents(max_size=2)
+        for event_id in ('a', 'b', 'c'):
+            events.seen(event_id)
+        self.assertEqual([event_id in events for event_id in ('a', 'b', 'c')], [False, True, True])
+        self.assertEqual(len(events), 2)
+
+    @patch('dedup.time.monotonic')
+    def test_events_expire_after_window(self, monotonic):
+        events = RecentEvents(window=10)
+        monotonic.return_value = 100
+        events.seen('a')
+        monotonic.return_value = 105
+        events.seen('b')
+        monotonic.return_value = 110
+        self.assertEqual(['a' in events, 'b' in events], [False, True])
+        self.assertFalse(events.seen('a'))
+
+    def test_forgotten_event_is_seen_again(self):
+        events = RecentEvents()
+        events.seen('a')
+        events.forget('a')
+        events.forget('unknown')
+        self.assertFalse(events.seen('a'))
+
+    def test_restored_events_expire_with_their_window(self):
+        events = RecentEvents(window=10)
+        events.restore('old', time.time() - 1)
+        events.restore('recent', time.time() + 5)
+        self.assertEqual(['old' in events, 'recent' in events], [False, True])
+        self.assertTrue(events.seen('recent'))
@@ -0,0 +1,31 @@
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase
+
+from history import MAX_BUCKETS, bucket_key, bucket_starts, check_range
+
+
+class HistoryTestCase(TestCase):
+    def test_bucket_keys(self):
+        moment = datetime(2026, 10, 18, 13, 45, 10, tzinfo=timezone.utc)
+        self.assertEqual(bucket_key(moment, 'hour'), 'hour#2026-10-18T13:00')
+        self.assertEqual(bucket_key(moment, 'day'), 'day#2026-10-18')
+
+    def test_moments_are_taken_in_utc(self):
+        self.assertEqual(bucket_key(datetime(2026, 10, 18, 1, 30), 'hour'), 'hour#2026-10-18T01:00')
+        minsk = timezone(timedelta(hours=3))
+        self.assertEqual(bucket_key(datetime(2026, 10, 18, 1, 30, tzinfo=minsk), 'day'), 'day#2026-10-17')
+
+    def test_bucket_starts_include_both_ends(self):
+        start = datetime(2026, 10, 18, 13, 45, tzinfo=timezone.utc)
+        self.assertEqual(bucket_starts(start, start + timedelta(hours=2), 'hour'),
+                         [datetime(2026, 10, 18, hour, tzinfo=timezone.utc) for hour in (13, 14, 15)])
+        self.assertEqual(bucket_starts(start, start, 'day'), [datetime(2026, 10, 18, tzinfo=timezone.utc)])
+        self.assertEqual(bucket_starts(start, start - timedelta(days=1), 'day'), [])
+
+    def test_ranges_are_checked(self):
+        start = datetime(2026, 10, 18, tzinfo=timezone.utc)
+        check_range(start, start + timedelta(hours=MAX_BUCKETS - 1), 'hour')
+        with self.assertRaises(ValueError):
+            check_range(start, start + timedelta(hours=MAX_BUCKETS), 'hour')
+        with self.assertRaises(ValueError):
+            check_range(start, start - timedelta(days=1), 'day')
@@ -0,0 +1,76 @@
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from unittest import TestCase
+
+from stores import MemoryStatsStore, SQLiteStatsStore
+
+
+class StoreTestsMixin:
+    def make_store(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.store = self.make_store()
+
+    def test_decrements_are_clamped_at_zero(self):
+        self.store.apply_deltas(1, {'likes_count': 2, 'posts_count': 3})
+        stats = self.store.apply_deltas(1, {'likes_count': -5, 'posts_count': -1})
+        self.assertEqual((stats['likes_count'], stats['posts_count'], stats['followers_count']), (0, 2, 0))
+        self.assertEqual(self.store.apply_deltas(1, {'likes_count': 1})['likes_count'], 1)
+
+    def test_decrement_of_new_page_is_clamped_at_zero(self):
+        self.assertEqual(self.store.apply_deltas(2, {'followers_count': -1})['followers_count'], 0)
+
+    def test_counters_are_set(self):
+        self.store.apply_deltas(1, {'likes_count': 2})
+        stats = self.store.set_counters(1, {'posts_count': 4})
+        self.assertEqual((stats['likes_count'], stats['posts_count']), (2, 4))
+
+    def test_unknown_pages_are_none(self):
+        self.store.create_page(1)
+        self.assertEqual(self.store.get_many([1, 2])[2], None)
+        self.store.delete_page(1)
+        self.assertIsNone(self.store.get(1))
+
+    def test_history_is_kept_per_bucket(self):
+        moment = datetime(2026, 10, 18, 13, 45, tzinfo=timezone.utc)
+        self.store.add_history(1, {'likes_count': 2}, moment)
+        self.store.add_history(1, {'likes_count': -1}, moment.replace(minute=5))
+        self.store.add_history(1, {'likes_count': 1}, moment.replace(hour=14))
+        hours = self.store.history(1, 'hour', moment.replace(hour=0), moment.replace(hour=23))
+        self.assertEqual({key: stats['likes_count'] for key, stats in hours.items()},
+                         {'hour#2026-10-18T13:00': 1, 'hour#2026-10-18T14:00': 1})
+        days = self.store.history(1, 'day', moment, moment)
+        self.assertEqual(days['day#2026-10-18']['likes_count'], 2)
+
+    def test_events_are_loaded_until_they_expire(self):
+        now = int(time.time())
+        self.store.save_events(['a', 'b'], now + 60)
+        self.store.save_events(['c'], now + 30)
+        self.store.save_events(['d'], now - 1)
+        self.assertEqual(self.store.load_events(), [('c', now + 30), ('a', now + 60), ('b', now + 60)])
+
+    def test_leaderboards_are_saved(self):
+        self.assertIsNone(self.store.load_leaderboard('likes_count'))
+        self.store.save_leaderboard('likes_count', [(1, 5), (2, 3)])
+        self.assertEqual(self.store.load_leaderboard('likes_count'), [(1, 5), (2, 3)])
+
+
+class MemoryStatsStoreTestCase(StoreTestsMixin, TestCase):
+    def make_store(self):
+        return MemoryStatsStore()
+
+
+class SQLiteStatsStoreTestCase(StoreTestsMixin, TestCase):
+    def make_store(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return SQLiteStatsStore(os.path.join(directory.name, 'statistic.sqlite3'))
+
+    def test_top_is_ordered_by_counter(self):
+        for page_id, likes in ((1, 3), (2, 7), (3, 5)):
+            self.store.apply_deltas(page_id, {'likes_count': likes})
+        self.assertEqual(self.store.top('likes_count', 2), [(2, 7), (3, 5)])
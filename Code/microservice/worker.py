@@ -0,0 +1,100 @@
+"""
+Supervisor of the consumer process. It runs the consumer of the statistic queue and starts it again when it exits.
+
+There is a single consumer: changes of a page must be applied in order, and consumers of one queue take its messages
+in turn, so two of them could apply changes of a page out of order. Throughput grows with the worker pool
+of the consumer (CONSUMER_WORKERS) instead, which keeps changes of a page on one worker.
+
+Usage:
+    pipenv run python worker.py
+"""
+import logging
+import signal
+import time
+from multiprocessing import Process
+
+from kink import inject
+
+from consumer import start_consumer
+from dependencies import microservice_di
+
+
+class Supervisor:
+    """
+    Runs the consumer process and starts it again when it exits on its own,
+    with a growing delay while it keeps crashing
+    """
+
+    def __init__(self, interval: float = 5, drain_timeout: float = 30, max_restart_delay: float = 60) -> None:
+        self.interval = interval
+        self.drain_timeout = drain_timeout
+        self.max_restart_delay = max_restart_delay
+        self.worker = None
+        self.restart_delay = 0
+        self.restart_at = 0
+        self.stopping = False
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.start_worker()
+        while not self.stopping:
+            self.reap()
+            time.sleep(self.interval)
+        if self.worker is not None:
+            self.stop_worker(self.worker)
+
+    def stop(self, signum, frame) -> None:
+        self.stopping = True
+
+    @staticmethod
+    def consume() -> None:
+        # a forked consumer must not inherit the handlers of supervisor, it drains on SIGTERM itself
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        start_consumer()
+
+    def start_worker(self) -> None:
+        self.worker = Process(target=self.consume)
+        self.worker.start()
+        self.worker.started_at = time.monotonic()
+        logging.info('Consumer %d started', self.worker.pid)
+
+    def stop_worker(self, worker: Process) -> None:
+        """
+        Ask the consumer to apply its messages in flight and exit, killing it if it does not
+        """
+        worker.terminate()
+        worker.join(timeout=self.drain_timeout + 5)
+        if worker.is_alive():
+            logging.error('Consumer %d did not exit, killed', worker.pid)
+            worker.kill()
+            worker.join()
+
+    def reap(self) -> None:
+        """
+        Replace the consumer if it exited. A consumer that exits within interval after start is crashing,
+        so the next restart waits twice as long as the previous one
+        """
+        now = time.monotonic()
+        if self.worker is not None and not self.worker.is_alive():
+            logging.error('Consumer %d exited with code %s', self.worker.pid, self.worker.exitcode)
+            if now - self.worker.started_at < self.interval * 2:
+                self.restart_delay = min(max(self.restart_delay * 2, 1), self.max_restart_delay)
+                self.restart_at = now + self.restart_delay
+            else:
+                self.restart_delay = 0
+            self.worker = None
+        if self.worker is None and now >= self.restart_at:
+            self.start_worker()
+
+
+@inject()
+def supervise(consumer_options: dict, supervisor_options: dict) -> None:
+    Supervisor(drain_timeout=consumer_options['drain_timeout'], **supervisor_options).run()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    microservice_di()
+    supervise()